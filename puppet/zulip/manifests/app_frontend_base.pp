@@ -166,6 +166,7 @@ class zulip::app_frontend_base {
     'thumbnail',
     'user_activity',
     'user_activity_interval',
+    'user_presence',
   ]
 
   if $zulip::common::total_memory_mb > 24000 {
@@ -68,8 +68,18 @@ app.use(async (ctx, next) => {
     httpRequestDurationSeconds.labels({method, path, status: String(status)}).observe(endTimer());
 });
 
+const render = (content: string, is_display: boolean): string => {
+    httpRequestSizeBytes.labels(String(is_display)).observe(Buffer.byteLength(content, "utf8"));
+    const output = katex.renderToString(content, {displayMode: is_display});
+    httpResponseSizeBytes.labels(String(is_display)).observe(Buffer.byteLength(output, "utf8"));
+    return output;
+};
+
 app.use((ctx, _next) => {
-    if (ctx.request.method !== "POST" || ctx.request.path !== "/") {
+    if (
+        ctx.request.method !== "POST" ||
+        (ctx.request.path !== "/" && ctx.request.path !== "/batch")
+    ) {
         ctx.status = 404;
         return;
     }
@@ -91,6 +101,43 @@ app.use((ctx, _next) => {
         return;
     }
 
+    if (ctx.request.path === "/batch") {
+        // Renders several formulas in one request, sent as JSON; each
+        // formula which fails to render gets a null result, so the
+        // caller can retry it individually to get the error.
+        if (!("batch" in body) || !Array.isArray(body.batch)) {
+            ctx.status = 400;
+            ctx.type = "text/plain";
+            ctx.body = "Invalid 'batch' argument";
+            return;
+        }
+        const results: (string | null)[] = [];
+        for (const item of body.batch as unknown[]) {
+            if (
+                typeof item !== "object" ||
+                item === null ||
+                !("content" in item) ||
+                typeof item.content !== "string"
+            ) {
+                ctx.status = 400;
+                ctx.type = "text/plain";
+                ctx.body = "Invalid 'batch' argument";
+                return;
+            }
+            const is_display = "is_display" in item && item.is_display === true;
+            try {
+                results.push(render(item.content, is_display));
+            } catch (error) {
+                if (!(error instanceof katex.ParseError)) {
+                    console.error(error);
+                }
+                results.push(null);
+            }
+        }
+        ctx.body = {results};
+        return;
+    }
+
     const is_display = "is_display" in body && body.is_display === "true";
 
     if (!("content" in body) || typeof body.content !== "string") {
@@ -101,11 +148,8 @@ app.use((ctx, _next) => {
     }
     const content = body.content;
 
-    httpRequestSizeBytes.labels(String(is_display)).observe(Buffer.byteLength(content, "utf8"));
     try {
-        const output = katex.renderToString(content, {displayMode: is_display});
-        ctx.body = output;
-        httpResponseSizeBytes.labels(String(is_display)).observe(Buffer.byteLength(output, "utf8"));
+        ctx.body = render(content, is_display);
     } catch (error) {
         if (error instanceof katex.ParseError) {
             ctx.status = 400;
@@ -5,6 +5,7 @@ from typing import TypedDict
 from zerver.lib import retention
 from zerver.lib.message import event_recipient_ids_for_action_on_messages
 from zerver.lib.retention import move_messages_to_archive
+from zerver.lib.topic import flush_topic_participants
 from zerver.models import Message, Realm, Stream, UserProfile
 from zerver.tornado.django_api import send_event_on_commit
 
@@ -91,6 +92,8 @@ def _process_grouped_messages_deletion(
     move_messages_to_archive(message_ids, realm=realm, chunk_size=archiving_chunk_size)
     if stream is not None:
         check_update_first_message_id(realm, stream, message_ids, users_to_notify)
+        assert stream.recipient_id is not None
+        flush_topic_participants([(stream.recipient_id, topic)])
 
     send_event_on_commit(realm, event, users_to_notify)
 
@@ -26,6 +26,7 @@ from zerver.actions.message_send import (
 from zerver.actions.uploads import AttachmentChangeResult, check_attachment_reference_change
 from zerver.actions.user_topics import bulk_do_set_user_topic_visibility_policy
 from zerver.lib import utils
+from zerver.lib.cache import flush_user_unread_snapshots
 from zerver.lib.exceptions import (
     JsonableError,
     MessageMoveError,
@@ -71,6 +72,7 @@ from zerver.lib.topic import (
     RESOLVED_TOPIC_PREFIX,
     TOPIC_LINKS,
     TOPIC_NAME,
+    flush_topic_participants,
     get_topic_display_name,
     maybe_rename_general_chat_to_empty_topic,
     messages_for_topic,
@@ -82,7 +84,7 @@ from zerver.lib.topic import (
 from zerver.lib.topic_link_util import get_stream_topic_link_syntax
 from zerver.lib.types import DirectMessageEditRequest, EditHistoryEvent, StreamMessageEditRequest
 from zerver.lib.url_encoding import stream_message_url
-from zerver.lib.user_message import bulk_insert_all_ums
+from zerver.lib.user_message import bulk_insert_all_ums, flush_unread_snapshots_for_messages
 from zerver.lib.user_topics import get_users_with_user_topic_visibility_policy
 from zerver.lib.widget import is_widget_message
 from zerver.models import (
@@ -433,6 +435,7 @@ def update_user_message_flags(
 
     for um in changed_ums:
         um.save(update_fields=["flags"])
+    flush_user_unread_snapshots(um.user_profile_id for um in changed_ums)
 
 
 def do_update_embedded_data(
@@ -837,6 +840,14 @@ def do_update_message(
             realm.id, target_stream.recipient_id, target_topic_name
         ).exists()
 
+        assert stream_being_edited.recipient_id is not None
+        flush_topic_participants(
+            [
+                (stream_being_edited.recipient_id, orig_topic_name),
+                (target_stream.recipient_id, target_topic_name),
+            ]
+        )
+
     changed_messages = Message.objects.filter(id=target_message.id)
     changed_message_ids = [target_message.id]
     changed_messages_count = 1
@@ -867,6 +878,9 @@ def do_update_message(
         changed_message_ids = list(changed_messages.values_list("id", flat=True))
         changed_messages_count = len(changed_message_ids)
 
+    if message_edit_request.is_message_moved:
+        flush_unread_snapshots_for_messages(changed_message_ids)
+
     if message_edit_request.is_stream_edited:
         # The fact that the user didn't have a UserMessage
         # originally means we can infer that the user was not
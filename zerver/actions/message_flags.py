@@ -9,6 +9,7 @@ from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 
 from analytics.lib.counts import COUNT_STATS, do_increment_logging_stat
+from zerver.lib.cache import flush_user_unread_snapshots
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message import (
     bulk_access_messages,
@@ -69,6 +70,7 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
             updated_count = UserMessage.objects.filter(id__in=query).update(
                 flags=F("flags").bitor(UserMessage.flags.read),
             )
+            flush_user_unread_snapshots([user_profile.id])
 
             event_time = timezone_now()
             do_increment_logging_stat(
@@ -130,6 +132,7 @@ def do_mark_stream_messages_as_read(
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
+    flush_user_unread_snapshots([user_profile.id])
 
     event = asdict(
         ReadMessagesEvent(
@@ -173,6 +176,7 @@ def do_mark_muted_user_messages_as_read(
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
+    flush_user_unread_snapshots([user_profile.id])
 
     event = asdict(
         ReadMessagesEvent(
@@ -368,6 +372,8 @@ def do_update_message_flags(
             to_update.update(flags=F("flags").bitor(flagattr))
         else:
             to_update.update(flags=F("flags").bitand(~flagattr))
+        if flag == "read":
+            flush_user_unread_snapshots([user_profile.id])
 
         event = {
             "type": "update_message_flags",
@@ -1,9 +1,10 @@
+import copy
 import logging
 from collections import defaultdict
 from collections.abc import Callable, Collection, Sequence
 from collections.abc import Set as AbstractSet
-from dataclasses import dataclass
-from datetime import timedelta
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
 from email.headerregistry import Address
 from typing import Any, TypedDict
 
@@ -11,7 +12,7 @@ import orjson
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.db.models import F, Q, QuerySet
+from django.db.models import Q, QuerySet
 from django.utils.html import escape
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
@@ -24,7 +25,11 @@ from zerver.actions.user_topics import (
 )
 from zerver.lib.addressee import Addressee
 from zerver.lib.alert_words import get_alert_word_automaton
-from zerver.lib.cache import cache_with_key, user_profile_delivery_email_cache_key
+from zerver.lib.cache import (
+    cache_with_key,
+    flush_user_unread_snapshots,
+    user_profile_delivery_email_cache_key,
+)
 from zerver.lib.create_user import create_user
 from zerver.lib.exceptions import (
     DirectMessageInitiationError,
@@ -43,6 +48,7 @@ from zerver.lib.markdown import MessageRenderingResult, render_message_markdown
 from zerver.lib.markdown import version as markdown_version
 from zerver.lib.mention import MentionBackend, MentionData
 from zerver.lib.message import (
+    UNREAD_SNAPSHOT_SEND_DELAY,
     SendMessageRequest,
     check_user_group_mention_allowed,
     normalize_body,
@@ -54,16 +60,13 @@ from zerver.lib.message import (
 )
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.muted_users import get_muting_users
-from zerver.lib.notification_data import (
-    UserMessageNotificationsData,
-    get_user_group_mentions_data,
-    user_allows_notifications_in_StreamTopic,
-)
+from zerver.lib.notification_data import UserMessageNotificationsData, get_user_group_mentions_data
 from zerver.lib.query_helpers import query_for_ids
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.recipient_users import recipient_for_user_profiles
 from zerver.lib.stream_subscription import (
-    get_subscriptions_for_send_message,
+    get_stream_subscriber_settings,
+    get_user_ids_for_send_message,
     num_subscribers_for_stream_id,
 )
 from zerver.lib.stream_topic import StreamTopicTarget
@@ -77,7 +80,7 @@ from zerver.lib.streams import (
 from zerver.lib.string_validation import check_stream_name
 from zerver.lib.thumbnail import get_user_upload_previews, rewrite_thumbnailed_images
 from zerver.lib.timestamp import timestamp_to_datetime
-from zerver.lib.topic import get_topic_display_name, participants_for_topic
+from zerver.lib.topic import add_topic_participants, get_topic_display_name, participants_for_topic
 from zerver.lib.topic_link_util import get_stream_link_syntax
 from zerver.lib.url_preview.types import UrlEmbedData
 from zerver.lib.user_groups import (
@@ -86,7 +89,7 @@ from zerver.lib.user_groups import (
     is_any_user_in_group,
     is_user_in_group,
 )
-from zerver.lib.user_message import UserMessageLite, bulk_insert_ums
+from zerver.lib.user_message import UserMessageRows, bulk_insert_ums
 from zerver.lib.users import (
     check_can_access_user,
     get_inaccessible_user_ids,
@@ -275,84 +278,50 @@ def get_recipient_info(
             # misses this sender. This is useful when the sender is sending their first message
             # in the topic.
             topic_participant_user_ids.add(sender_id)
-        subscription_rows = (
-            get_subscriptions_for_send_message(
-                realm_id=realm_id,
-                stream_id=stream_topic.stream_id,
-                topic_name=stream_topic.topic_name,
-                possible_stream_wildcard_mention=possible_stream_wildcard_mention,
-                topic_participant_user_ids=topic_participant_user_ids,
-                possibly_mentioned_user_ids=possibly_mentioned_user_ids,
-            )
-            .annotate(
-                user_profile_email_notifications=F(
-                    "user_profile__enable_stream_email_notifications"
-                ),
-                user_profile_push_notifications=F("user_profile__enable_stream_push_notifications"),
-                user_profile_wildcard_mentions_notify=F("user_profile__wildcard_mentions_notify"),
-                followed_topic_email_notifications=F(
-                    "user_profile__enable_followed_topic_email_notifications"
-                ),
-                followed_topic_push_notifications=F(
-                    "user_profile__enable_followed_topic_push_notifications"
-                ),
-                followed_topic_wildcard_mentions_notify=F(
-                    "user_profile__enable_followed_topic_wildcard_mentions_notify"
-                ),
-            )
-            .values(
-                "user_profile_id",
-                "push_notifications",
-                "email_notifications",
-                "wildcard_mentions_notify",
-                "followed_topic_push_notifications",
-                "followed_topic_email_notifications",
-                "followed_topic_wildcard_mentions_notify",
-                "user_profile_email_notifications",
-                "user_profile_push_notifications",
-                "user_profile_wildcard_mentions_notify",
-                "is_muted",
-            )
-            .order_by("user_profile_id")
+        subscriber_settings = get_stream_subscriber_settings(recipient.id)
+        message_to_user_id_set = get_user_ids_for_send_message(
+            realm_id=realm_id,
+            stream_id=stream_topic.stream_id,
+            topic_name=stream_topic.topic_name,
+            subscriber_settings=subscriber_settings,
+            possible_stream_wildcard_mention=possible_stream_wildcard_mention,
+            topic_participant_user_ids=topic_participant_user_ids,
+            possibly_mentioned_user_ids=possibly_mentioned_user_ids,
         )
 
-        message_to_user_id_set = set()
-        for row in subscription_rows:
-            message_to_user_id_set.add(row["user_profile_id"])
+        muted_stream_user_ids = subscriber_settings.user_ids_with("is_muted")
+        if sender_id in message_to_user_id_set:
             # We store the 'sender_muted_stream' information here to avoid db query at
             # a later stage when we perform automatically unmute topic in muted stream operation.
-            if row["user_profile_id"] == sender_id:
-                sender_muted_stream = row["is_muted"]
+            sender_muted_stream = sender_id in muted_stream_user_ids
 
         user_id_to_visibility_policy = stream_topic.user_id_to_visibility_policy_dict()
+        topic_user_ids: dict[int, set[int]] = defaultdict(set)
+        for user_id, visibility_policy in user_id_to_visibility_policy.items():
+            topic_user_ids[visibility_policy].add(user_id)
+
+        # The set operations below are equivalent to checking
+        # user_allows_notifications_in_StreamTopic for each recipient:
+        # users who muted the topic, or muted the stream without
+        # unmuting the topic, don't get notifications for it.
+        notifications_muted_user_ids = topic_user_ids[UserTopic.VisibilityPolicy.MUTED] | (
+            muted_stream_user_ids - topic_user_ids[UserTopic.VisibilityPolicy.UNMUTED]
+        )
 
         def notification_recipients(setting: str) -> set[int]:
-            return {
-                row["user_profile_id"]
-                for row in subscription_rows
-                if user_allows_notifications_in_StreamTopic(
-                    row["is_muted"],
-                    user_id_to_visibility_policy.get(
-                        row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
-                    ),
-                    row[setting],
-                    row["user_profile_" + setting],
-                )
-            }
+            return (
+                subscriber_settings.user_ids_with(setting) & message_to_user_id_set
+            ) - notifications_muted_user_ids
 
         stream_push_user_ids = notification_recipients("push_notifications")
         stream_email_user_ids = notification_recipients("email_notifications")
 
         def followed_topic_notification_recipients(setting: str) -> set[int]:
-            return {
-                row["user_profile_id"]
-                for row in subscription_rows
-                if user_id_to_visibility_policy.get(
-                    row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
-                )
-                == UserTopic.VisibilityPolicy.FOLLOWED
-                and row["followed_topic_" + setting]
-            }
+            return (
+                subscriber_settings.user_ids_with("followed_topic_" + setting)
+                & message_to_user_id_set
+                & topic_user_ids[UserTopic.VisibilityPolicy.FOLLOWED]
+            )
 
         followed_topic_email_user_ids = followed_topic_notification_recipients(
             "email_notifications"
@@ -592,21 +561,24 @@ def build_message_send_dict(
     recipients_for_user_creation_events: dict[UserProfile, set[int]] | None = None,
     acting_user: UserProfile | None = None,
     no_previews: bool = False,
+    mention_data: MentionData | None = None,
+    recipient_info: RecipientInfoResult | None = None,
 ) -> SendMessageRequest:
     """Returns a dictionary that can be passed into do_send_messages.  In
-    production, this is always called by check_message, but some
-    testing code paths call it directly.
+    production, this is always called by check_message or
+    check_messages, but some testing code paths call it directly.
     """
     realm = message.realm
 
     if mention_backend is None:
         mention_backend = MentionBackend(realm.id)
 
-    mention_data = MentionData(
-        mention_backend=mention_backend,
-        content=message.content,
-        message_sender=message.sender,
-    )
+    if mention_data is None:
+        mention_data = MentionData(
+            mention_backend=mention_backend,
+            content=message.content,
+            message_sender=message.sender,
+        )
 
     if message.is_stream_message():
         stream_id = message.recipient.type_id
@@ -617,15 +589,18 @@ def build_message_send_dict(
     else:
         stream_topic = None
 
-    info = get_recipient_info(
-        realm_id=realm.id,
-        recipient=message.recipient,
-        sender_id=message.sender_id,
-        stream_topic=stream_topic,
-        possibly_mentioned_user_ids=mention_data.get_user_ids(),
-        possible_topic_wildcard_mention=mention_data.message_has_topic_wildcards(),
-        possible_stream_wildcard_mention=mention_data.message_has_stream_wildcards(),
-    )
+    if recipient_info is not None:
+        info = recipient_info
+    else:
+        info = get_recipient_info(
+            realm_id=realm.id,
+            recipient=message.recipient,
+            sender_id=message.sender_id,
+            stream_topic=stream_topic,
+            possibly_mentioned_user_ids=mention_data.get_user_ids(),
+            possible_topic_wildcard_mention=mention_data.message_has_topic_wildcards(),
+            possible_stream_wildcard_mention=mention_data.message_has_stream_wildcards(),
+        )
 
     # Render our message_dicts.
     assert message.rendered_content is None
@@ -741,7 +716,7 @@ def create_user_messages(
     mark_as_read_user_ids: set[int],
     limit_unread_user_ids: set[int] | None,
     topic_participant_user_ids: set[int],
-) -> list[UserMessageLite]:
+) -> UserMessageRows:
     # These properties on the Message are set via
     # render_message_markdown by code in the Markdown inline patterns
     ids_with_alert_words = rendering_result.user_ids_with_alert_words
@@ -772,7 +747,7 @@ def create_user_messages(
     #
     # See https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html#soft-deactivation
     # for details on this system.
-    user_messages = []
+    user_messages = UserMessageRows()
     for user_profile_id in um_eligible_user_ids:
         flags = base_flags
         if user_profile_id in mark_as_read_user_ids or (
@@ -800,12 +775,7 @@ def create_user_messages(
         ):
             continue
 
-        um = UserMessageLite(
-            user_profile_id=user_profile_id,
-            message_id=message.id,
-            flags=flags,
-        )
-        user_messages.append(um)
+        user_messages.append(user_profile_id, message.id, flags)
 
     return user_messages
 
@@ -879,6 +849,11 @@ def do_send_messages(
     # Save the message receipts in the database
     user_message_flags: dict[int, dict[int, list[str]]] = defaultdict(dict)
 
+    # The recipients' unread snapshots rely on this transaction
+    # committing within UNREAD_SNAPSHOT_SEND_DELAY of allocating the
+    # messages' IDs; we time it from here, and flush them on commit if
+    # it came close.
+    insert_started = timezone_now()
     Message.objects.bulk_create(send_request.message for send_request in send_message_requests)
 
     # Claim attachments in message
@@ -914,7 +889,8 @@ def do_send_messages(
 
             send_request.message.save(update_fields=update_fields)
 
-    ums: list[UserMessageLite] = []
+    ums = UserMessageRows()
+    flags_lists: dict[int, list[str]] = {}
     for send_request in send_message_requests:
         # Service bots (outgoing webhook bots and embedded bots) don't store UserMessage rows;
         # they will be processed later.
@@ -939,8 +915,14 @@ def do_send_messages(
             topic_participant_user_ids=send_request.topic_participant_user_ids,
         )
 
-        for um in user_messages:
-            user_message_flags[send_request.message.id][um.user_profile_id] = um.flags_list()
+        message_flags = user_message_flags[send_request.message.id]
+        for user_profile_id, _message_id, flags in user_messages:
+            # Most recipients of a message share the same flags, so
+            # we only compute each flags list once, and copy it, since
+            # the lists are modified below.
+            if flags not in flags_lists:
+                flags_lists[flags] = UserMessage.flags_list_for_flags(flags)
+            message_flags[user_profile_id] = flags_lists[flags].copy()
 
         ums.extend(user_messages)
 
@@ -954,6 +936,22 @@ def do_send_messages(
 
     bulk_insert_ums(ums)
 
+    def flush_unread_snapshots_if_slow() -> None:
+        if timezone_now() - insert_started >= UNREAD_SNAPSHOT_SEND_DELAY / 2:
+            flush_user_unread_snapshots(set(ums.user_profile_ids))
+
+    transaction.on_commit(flush_unread_snapshots_if_slow)
+
+    add_topic_participants(
+        (
+            send_request.message.recipient_id,
+            send_request.message.topic_name(),
+            send_request.message.sender_id,
+        )
+        for send_request in send_message_requests
+        if send_request.message.is_stream_message()
+    )
+
     for send_request in send_message_requests:
         do_widget_post_save_actions(send_request)
 
@@ -1460,6 +1458,21 @@ def check_send_message(
     return do_send_messages([message], mark_as_read=[sender.id] if read_by_sender else [])[0]
 
 
+def check_send_messages(
+    sender: UserProfile,
+    client: Client,
+    addressee: Addressee,
+    message_contents: Sequence[str],
+    *,
+    realm: Realm | None = None,
+    read_by_sender: bool = False,
+) -> list[SentMessageResult]:
+    """Sends several messages from the same sender to the same addressee,
+    in a single transaction; see check_messages."""
+    send_requests = check_messages(sender, client, addressee, message_contents, realm)
+    return do_send_messages(send_requests, mark_as_read=[sender.id] if read_by_sender else [])
+
+
 def send_rate_limited_pm_notification_to_bot_owner(
     sender: UserProfile, realm: Realm, content: str
 ) -> None:
@@ -1709,40 +1722,32 @@ def get_recipients_for_user_creation_events(
 
 # check_message:
 # Returns message ready for sending with do_send_message on success or the error message (string) on error.
-def check_message(
+@dataclass
+class CheckedAddressee:
+    recipient: Recipient
+    stream: Stream | None
+    # None for direct messages.
+    topic_name: str | None
+    recipients_for_user_creation_events: dict[UserProfile, set[int]] | None
+
+
+def check_addressee(
     sender: UserProfile,
     client: Client,
     addressee: Addressee,
-    message_content_raw: str,
-    realm: Realm | None = None,
+    realm: Realm,
     forged: bool = False,
-    forged_timestamp: float | None = None,
     forwarder_user_profile: UserProfile | None = None,
-    local_id: str | None = None,
-    sender_queue_id: str | None = None,
-    widget_content: str | None = None,
-    email_gateway: bool = False,
     *,
     skip_stream_access_check: bool = False,
-    message_type: int = Message.MessageType.NORMAL,
-    mention_backend: MentionBackend | None = None,
-    limit_unread_user_ids: set[int] | None = None,
-    disable_external_notifications: bool = False,
     archived_channel_notice: bool = False,
-    no_previews: bool = False,
-    acting_user: UserProfile | None = None,
-) -> SendMessageRequest:
-    """See
-    https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html
-    for high-level documentation on this subsystem.
-    """
+) -> CheckedAddressee:
+    """Checks that the sender can send messages to the addressee, and
+    finds the Recipient for it.  This doesn't depend on the message's
+    content, so is done only once for a group of messages to the same
+    addressee; see check_messages."""
     stream = None
-
-    message_content = normalize_body(message_content_raw)
-
-    if realm is None:
-        realm = sender.realm
-
+    topic_name = None
     recipients_for_user_creation_events = None
     if addressee.is_stream():
         topic_name = addressee.topic_name()
@@ -1829,27 +1834,117 @@ def check_message(
         # the message type.
         raise AssertionError("Invalid message type")
 
+    return CheckedAddressee(
+        recipient=recipient,
+        stream=stream,
+        topic_name=topic_name,
+        recipients_for_user_creation_events=recipients_for_user_creation_events,
+    )
+
+
+def build_message(
+    sender: UserProfile,
+    client: Client,
+    checked_addressee: CheckedAddressee,
+    message_content: str,
+    realm: Realm,
+    message_type: int = Message.MessageType.NORMAL,
+    date_sent: datetime | None = None,
+) -> Message:
     message = Message()
     message.sender = sender
     message.content = message_content
-    message.recipient = recipient
+    message.recipient = checked_addressee.recipient
     message.type = message_type
     message.realm = realm
-    if addressee.is_stream():
-        message.set_topic_name(topic_name)
+    if checked_addressee.topic_name is not None:
+        message.set_topic_name(checked_addressee.topic_name)
         message.is_channel_message = True
     else:
         message.set_topic_name(Message.DM_TOPIC)
         message.is_channel_message = False
-    if forged and forged_timestamp is not None:
-        # Forged messages come with a timestamp
-        message.date_sent = timestamp_to_datetime(forged_timestamp)
-    else:
-        message.date_sent = timezone_now()
+    message.date_sent = date_sent if date_sent is not None else timezone_now()
     message.sending_client = client
 
     # We render messages later in the process.
     assert message.rendered_content is None
+    return message
+
+
+def check_mentions_allowed(
+    sender: UserProfile, realm: Realm, stream: Stream | None, send_request: SendMessageRequest
+) -> None:
+    if (
+        stream is not None
+        and send_request.rendering_result.mentions_stream_wildcard
+        and not stream_wildcard_mention_allowed(sender, stream, realm)
+    ):
+        raise StreamWildcardMentionNotAllowedError
+
+    topic_participant_count = len(send_request.topic_participant_user_ids)
+    if (
+        stream is not None
+        and send_request.rendering_result.mentions_topic_wildcard
+        and not topic_wildcard_mention_allowed(sender, topic_participant_count, realm)
+    ):
+        raise TopicWildcardMentionNotAllowedError
+
+    if send_request.rendering_result.mentions_user_group_ids:
+        mentioned_group_ids = list(send_request.rendering_result.mentions_user_group_ids)
+        check_user_group_mention_allowed(sender, mentioned_group_ids)
+
+
+def check_message(
+    sender: UserProfile,
+    client: Client,
+    addressee: Addressee,
+    message_content_raw: str,
+    realm: Realm | None = None,
+    forged: bool = False,
+    forged_timestamp: float | None = None,
+    forwarder_user_profile: UserProfile | None = None,
+    local_id: str | None = None,
+    sender_queue_id: str | None = None,
+    widget_content: str | None = None,
+    email_gateway: bool = False,
+    *,
+    skip_stream_access_check: bool = False,
+    message_type: int = Message.MessageType.NORMAL,
+    mention_backend: MentionBackend | None = None,
+    limit_unread_user_ids: set[int] | None = None,
+    disable_external_notifications: bool = False,
+    archived_channel_notice: bool = False,
+    no_previews: bool = False,
+    acting_user: UserProfile | None = None,
+) -> SendMessageRequest:
+    """See
+    https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html
+    for high-level documentation on this subsystem.
+    """
+    message_content = normalize_body(message_content_raw)
+
+    if realm is None:
+        realm = sender.realm
+
+    checked_addressee = check_addressee(
+        sender,
+        client,
+        addressee,
+        realm,
+        forged,
+        forwarder_user_profile,
+        skip_stream_access_check=skip_stream_access_check,
+        archived_channel_notice=archived_channel_notice,
+    )
+
+    if forged and forged_timestamp is not None:
+        # Forged messages come with a timestamp
+        date_sent = timestamp_to_datetime(forged_timestamp)
+    else:
+        date_sent = None
+    message = build_message(
+        sender, client, checked_addressee, message_content, realm, message_type, date_sent
+    )
 
     if client.name == "zephyr_mirror":
         id = already_sent_mirrored_message_id(message)
@@ -1872,9 +1967,10 @@ def check_message(
                 )
             )
 
+    recipients_for_user_creation_events = checked_addressee.recipients_for_user_creation_events
     message_send_dict = build_message_send_dict(
         message=message,
-        stream=stream,
+        stream=checked_addressee.stream,
         local_id=local_id,
         sender_queue_id=sender_queue_id,
         widget_content_dict=widget_content_dict,
@@ -1887,26 +1983,93 @@ def check_message(
         no_previews=no_previews,
     )
 
-    if (
-        stream is not None
-        and message_send_dict.rendering_result.mentions_stream_wildcard
-        and not stream_wildcard_mention_allowed(sender, stream, realm)
-    ):
-        raise StreamWildcardMentionNotAllowedError
+    check_mentions_allowed(sender, realm, checked_addressee.stream, message_send_dict)
 
-    topic_participant_count = len(message_send_dict.topic_participant_user_ids)
-    if (
-        stream is not None
-        and message_send_dict.rendering_result.mentions_topic_wildcard
-        and not topic_wildcard_mention_allowed(sender, topic_participant_count, realm)
-    ):
-        raise TopicWildcardMentionNotAllowedError
+    return message_send_dict
 
-    if message_send_dict.rendering_result.mentions_user_group_ids:
-        mentioned_group_ids = list(message_send_dict.rendering_result.mentions_user_group_ids)
-        check_user_group_mention_allowed(sender, mentioned_group_ids)
 
-    return message_send_dict
+def check_messages(
+    sender: UserProfile,
+    client: Client,
+    addressee: Addressee,
+    message_contents: Sequence[str],
+    realm: Realm | None = None,
+) -> list[SendMessageRequest]:
+    """Like check_message, for several messages from the same sender to
+    the same addressee, as sent by integrations backfilling many
+    messages at once.
+
+    The access checks, and finding the recipients of the messages and
+    their notification settings, are done once for the whole group,
+    rather than once per message; and the messages share a
+    MentionBackend, so users and groups mentioned in several of them
+    are fetched only once.
+    """
+    if realm is None:
+        realm = sender.realm
+
+    checked_addressee = check_addressee(sender, client, addressee, realm)
+    messages = [
+        build_message(sender, client, checked_addressee, normalize_body(content), realm)
+        for content in message_contents
+    ]
+    if not messages:
+        return []
+
+    mention_backend = MentionBackend(realm.id)
+    mention_data_list = [
+        MentionData(mention_backend=mention_backend, content=message.content, message_sender=sender)
+        for message in messages
+    ]
+
+    if checked_addressee.stream is not None:
+        assert checked_addressee.topic_name is not None
+        stream_topic: StreamTopicTarget | None = StreamTopicTarget(
+            stream_id=checked_addressee.stream.id,
+            topic_name=checked_addressee.topic_name,
+        )
+    else:
+        stream_topic = None
+
+    # Computed for the union of the users the messages might mention,
+    # this is a superset of what get_recipient_info would return for
+    # each message alone.  That's safe, since the extra recipients are
+    # long_term_idle users, whose UserMessage rows create_user_messages
+    # skips unless the message has flags for them.
+    info = get_recipient_info(
+        realm_id=realm.id,
+        recipient=checked_addressee.recipient,
+        sender_id=sender.id,
+        stream_topic=stream_topic,
+        possibly_mentioned_user_ids=set().union(
+            *(mention_data.get_user_ids() for mention_data in mention_data_list)
+        ),
+        possible_topic_wildcard_mention=any(
+            mention_data.message_has_topic_wildcards() for mention_data in mention_data_list
+        ),
+        possible_stream_wildcard_mention=any(
+            mention_data.message_has_stream_wildcards() for mention_data in mention_data_list
+        ),
+    )
+
+    recipients_for_user_creation_events = checked_addressee.recipients_for_user_creation_events
+    send_requests = []
+    for message, mention_data in zip(messages, mention_data_list, strict=True):
+        send_request = build_message_send_dict(
+            message=message,
+            stream=checked_addressee.stream,
+            mention_backend=mention_backend,
+            recipients_for_user_creation_events=recipients_for_user_creation_events,
+            mention_data=mention_data,
+            # Each message gets its own copy of the sets, since they
+            # are modified when building and sending the message.
+            recipient_info=RecipientInfoResult(
+                **{field.name: copy.copy(getattr(info, field.name)) for field in fields(info)}
+            ),
+        )
+        check_mentions_allowed(sender, realm, checked_addressee.stream, send_request)
+        send_requests.append(send_request)
+    return send_requests
 
 
 def _internal_prep_message(
@@ -1,5 +1,6 @@
 import logging
 import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 from django.conf import settings
@@ -8,9 +9,12 @@ from psycopg2 import sql
 
 from zerver.actions.user_activity import update_user_activity_interval
 from zerver.lib.presence import (
+    cache_realm_presence_delta,
     format_legacy_presence_dict,
     user_presence_datetime_with_date_joined_default,
 )
+from zerver.lib.queue import queue_json_publish_rollback_unsafe
+from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.users import get_user_ids_who_can_access_user
 from zerver.models import Client, UserPresence, UserProfile
 from zerver.models.clients import get_client
@@ -87,6 +91,25 @@ def consolidate_client(client: Client) -> Client:
         return client
 
 
+def is_newly_online(time_since_last_active: timedelta) -> bool:
+    # Here, we decide whether the user is newly online, and we need to
+    # consider sending an immediate presence update via the events
+    # system that this user is now online, rather than waiting for
+    # other clients to poll the presence update.  Sending these
+    # presence update events adds load to the system, so we only want
+    # to do this if the user has missed a couple regular presence
+    # check-ins (so their state is at least
+    # 2 * PRESENCE_PING_INTERVAL_SECS + 10 old), and also is under the
+    # risk of being shown by clients as offline before the next regular
+    # presence check-in (so at least
+    # `settings.OFFLINE_THRESHOLD_SECS - settings.PRESENCE_PING_INTERVAL_SECS - 10`).
+    # These two values happen to be the same in the default configuration.
+    assert (3 * settings.PRESENCE_PING_INTERVAL_SECS + 20) <= settings.OFFLINE_THRESHOLD_SECS
+    return time_since_last_active > timedelta(
+        seconds=settings.OFFLINE_THRESHOLD_SECS - settings.PRESENCE_PING_INTERVAL_SECS - 10
+    )
+
+
 # This function takes a very hot lock on the PresenceSequence row for the user's realm.
 # Since all presence updates in the realm all compete for this lock, we need to be
 # maximally efficient and only hold it as briefly as possible.
@@ -139,19 +162,7 @@ def do_update_user_presence(
     if presence.last_connected_time is not None:
         time_since_last_connected_for_comparison = log_time - presence.last_connected_time
 
-    assert (3 * settings.PRESENCE_PING_INTERVAL_SECS + 20) <= settings.OFFLINE_THRESHOLD_SECS
-    now_online = time_since_last_active_for_comparison > timedelta(
-        # Here, we decide whether the user is newly online, and we need to consider
-        # sending an immediate presence update via the events system that this user is now online,
-        # rather than waiting for other clients to poll the presence update.
-        # Sending these presence update events adds load to the system, so we only want to do this
-        # if the user has missed a couple regular presence check-ins
-        # (so their state is at least 2 * PRESENCE_PING_INTERVAL_SECS + 10 old),
-        # and also is under the risk of being shown by clients as offline before the next regular presence check-in
-        # (so at least `settings.OFFLINE_THRESHOLD_SECS - settings.PRESENCE_PING_INTERVAL_SECS - 10`).
-        # These two values happen to be the same in the default configuration.
-        seconds=settings.OFFLINE_THRESHOLD_SECS - settings.PRESENCE_PING_INTERVAL_SECS - 10
-    )
+    now_online = is_newly_online(time_since_last_active_for_comparison)
     became_online = status == UserPresence.LEGACY_STATUS_ACTIVE_INT and now_online
 
     update_fields = []
@@ -227,6 +238,7 @@ def do_update_user_presence(
                 INSERT INTO zerver_userpresence (user_profile_id, last_active_time, last_connected_time, realm_id, last_update_id)
                 VALUES ({user_profile_id}, {last_active_time}, {last_connected_time}, {realm_id}, (SELECT last_update_id FROM new_last_update_id))
                 ON CONFLICT (user_profile_id) DO NOTHING
+                RETURNING last_update_id
                 """).format(
                 user_profile_id=sql.Literal(user_profile.id),
                 last_active_time=sql.Literal(presence.last_active_time),
@@ -245,6 +257,7 @@ def do_update_user_presence(
                 UPDATE zerver_userpresence
                 SET {update_fields_segment}, last_update_id = (SELECT last_update_id FROM new_last_update_id)
                 WHERE id = {presence_id}
+                RETURNING last_update_id
             """).format(
                 update_fields_segment=update_fields_segment, presence_id=sql.Literal(presence.id)
             )
@@ -255,6 +268,32 @@ def do_update_user_presence(
                 # Check if the row was actually created or if we
                 # hit the ON CONFLICT DO NOTHING case.
                 actually_created = cursor.rowcount > 0
+            returned_row = cursor.fetchone()
+
+        if returned_row is not None:
+            # Record this update in the realm's presence delta buffer,
+            # which serves most presence fetches; see
+            # get_realm_presence_deltas.
+            new_last_update_id = returned_row[0]
+            delta_entries: dict[int, tuple[int, int]] = {}
+            if user_profile.is_active and not user_profile.is_bot:
+                delta_entries[user_profile.id] = (
+                    datetime_to_timestamp(
+                        user_presence_datetime_with_date_joined_default(
+                            presence.last_active_time, user_profile.date_joined
+                        )
+                    ),
+                    datetime_to_timestamp(
+                        user_presence_datetime_with_date_joined_default(
+                            presence.last_connected_time, user_profile.date_joined
+                        )
+                    ),
+                )
+            transaction.on_commit(
+                lambda: cache_realm_presence_delta(
+                    user_profile.realm_id, new_last_update_id, delta_entries
+                )
+            )
 
     if creating and not actually_created:
         # If we ended up doing nothing due to something else creating the row
@@ -276,6 +315,93 @@ def do_update_user_presence(
         )
 
 
+@dataclass
+class PresenceUpdate:
+    user_profile_id: int
+    last_active_time: datetime | None
+    last_connected_time: datetime
+
+
+# Like do_update_user_presence, this takes the lock on the realm's
+# PresenceSequence row, so must be kept brief, and not run inside a
+# larger transaction.
+@transaction.atomic(durable=True)
+def do_bulk_update_user_presence(realm_id: int, updates: list[PresenceUpdate]) -> None:
+    """Applies the heartbeats of users who already have a UserPresence
+    row, which update_user_presence determined don't need an immediate
+    presence event, in a single UPDATE, sharing a single new
+    last_update_id.  Clients fetch the rows with a last_update_id
+    greater than the last one they saw, so sharing one is fine.
+
+    Timestamps are only ever moved forwards, since a newer presence
+    update, of the user coming back online, may have been written by
+    do_update_user_presence after these were queued."""
+    rows = sql.SQL(", ").join(
+        sql.SQL("({}, {}::timestamptz, {}::timestamptz)").format(
+            sql.Literal(update.user_profile_id),
+            sql.Literal(update.last_active_time),
+            sql.Literal(update.last_connected_time),
+        )
+        for update in updates
+    )
+    query = sql.SQL("""
+        WITH new_last_update_id AS (
+            UPDATE zerver_presencesequence
+            SET last_update_id = last_update_id + 1
+            WHERE realm_id = {realm_id}
+            RETURNING last_update_id
+        )
+        UPDATE zerver_userpresence
+        SET
+            last_active_time = greatest(
+                zerver_userpresence.last_active_time, heartbeat.last_active_time
+            ),
+            last_connected_time = greatest(
+                zerver_userpresence.last_connected_time, heartbeat.last_connected_time
+            ),
+            last_update_id = (SELECT last_update_id FROM new_last_update_id)
+        FROM (VALUES {rows}) AS heartbeat (user_profile_id, last_active_time, last_connected_time)
+        WHERE zerver_userpresence.user_profile_id = heartbeat.user_profile_id
+        RETURNING
+            zerver_userpresence.user_profile_id,
+            zerver_userpresence.last_active_time,
+            zerver_userpresence.last_connected_time,
+            zerver_userpresence.last_update_id
+    """).format(realm_id=sql.Literal(realm_id), rows=rows)
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        updated_rows = cursor.fetchall()
+
+    if updated_rows:
+        # Looking up which users are active humans, for the realm's
+        # presence delta, waits until the PresenceSequence lock is
+        # released.
+        transaction.on_commit(lambda: cache_bulk_presence_delta(realm_id, updated_rows))
+
+
+def cache_bulk_presence_delta(
+    realm_id: int, updated_rows: list[tuple[int, datetime | None, datetime, int]]
+) -> None:
+    date_joined_by_user_id = dict(
+        UserProfile.objects.filter(
+            id__in=[row[0] for row in updated_rows], is_active=True, is_bot=False
+        ).values_list("id", "date_joined")
+    )
+    delta_entries = {
+        user_profile_id: (
+            datetime_to_timestamp(
+                user_presence_datetime_with_date_joined_default(
+                    last_active_time, date_joined_by_user_id[user_profile_id]
+                )
+            ),
+            datetime_to_timestamp(last_connected_time),
+        )
+        for user_profile_id, last_active_time, last_connected_time, _ in updated_rows
+        if user_profile_id in date_joined_by_user_id
+    }
+    cache_realm_presence_delta(realm_id, updated_rows[0][3], delta_entries)
+
+
 def update_user_presence(
     user_profile: UserProfile,
     client: Client,
@@ -290,6 +416,45 @@ def update_user_presence(
         status,
     )
     if user_profile.presence_enabled:
-        do_update_user_presence(user_profile, client, log_time, status)
+        # Most presence updates are heartbeats from clients of users
+        # who are already online, which only need to move the user's
+        # timestamps forwards.  Rather than each taking the lock on
+        # the realm's PresenceSequence row in its own transaction, we
+        # queue those for the user_presence worker, which collapses
+        # the heartbeats of each user and writes them in bulk; only
+        # the first presence update for a user, and users coming
+        # online, who clients are notified of immediately, are written
+        # here.
+        presence = (
+            UserPresence.objects.filter(user_profile_id=user_profile.id)
+            .values_list("last_active_time", "last_connected_time")
+            .first()
+        )
+        if presence is None:
+            do_update_user_presence(user_profile, client, log_time, status)
+        else:
+            last_active_time, last_connected_time = presence
+            # As in do_update_user_presence, a user who was never
+            # active is treated as newly online.
+            time_since_last_active = timedelta(days=1)
+            if last_active_time is not None:
+                time_since_last_active = log_time - last_active_time
+            is_active = status == UserPresence.LEGACY_STATUS_ACTIVE_INT
+
+            min_freq = timedelta(seconds=settings.PRESENCE_UPDATE_MIN_FREQ_SECONDS)
+            if is_active and is_newly_online(time_since_last_active):
+                do_update_user_presence(user_profile, client, log_time, status)
+            elif (
+                last_connected_time is None
+                or log_time - last_connected_time > min_freq
+                or (is_active and time_since_last_active > min_freq)
+            ):
+                event = {
+                    "user_profile_id": user_profile.id,
+                    "realm_id": user_profile.realm_id,
+                    "status": status,
+                    "time": log_time.timestamp(),
+                }
+                queue_json_publish_rollback_unsafe("user_presence", event)
     if new_user_input:
         update_user_activity_interval(user_profile, log_time)
@@ -12,6 +12,7 @@ from zerver.lib.message import (
 )
 from zerver.lib.message_cache import update_message_cache
 from zerver.lib.streams import access_stream_by_id
+from zerver.lib.topic import add_topic_participants, flush_topic_participants
 from zerver.lib.user_message import create_historical_user_messages
 from zerver.models import Message, Reaction, UserProfile
 from zerver.tornado.django_api import send_event_on_commit
@@ -68,6 +69,8 @@ def do_add_reaction(
     )
 
     reaction.save()
+    if message.is_stream_message():
+        add_topic_participants([(message.recipient_id, message.topic_name(), user_profile.id)])
 
     # Determine and set the visibility_policy depending on 'automatically_follow_topics_policy'
     # and 'automatically_unmute_topics_in_muted_streams_policy'.
@@ -181,5 +184,7 @@ def do_remove_reaction(
         reaction_type=reaction_type,
     ).get()
     reaction.delete()
+    if message.is_stream_message():
+        flush_topic_participants([(message.recipient_id, message.topic_name())])
 
     notify_reaction_update(user_profile, message, reaction, "remove")
@@ -18,6 +18,8 @@ from zerver.lib.cache import (
     cache_delete_many,
     cache_set,
     display_recipient_cache_key,
+    flush_stream_subscriber_settings,
+    flush_user_unread_snapshots,
     to_dict_cache_key_id,
 )
 from zerver.lib.exceptions import JsonableError
@@ -512,6 +514,12 @@ def bulk_add_subs_to_db_with_logging(
     Subscription.objects.bulk_create(info.sub for info in subs_to_add)
     sub_ids = [info.sub.id for info in subs_to_activate]
     Subscription.objects.filter(id__in=sub_ids).update(active=True)
+    flush_stream_subscriber_settings(
+        {info.sub.recipient_id for info in subs_to_add + subs_to_activate}
+    )
+    # Unread messages in streams the user had unsubscribed from are
+    # missing from their unread snapshot.
+    flush_user_unread_snapshots({info.user.id for info in subs_to_activate})
 
     # Log subscription activities in RealmAuditLog
     event_time = timezone_now()
@@ -1128,6 +1136,9 @@ def bulk_remove_subscriptions(
             id__in=sub_ids_to_deactivate,
         ).update(active=False)
         bulk_update_subscriber_counts(direction=-1, streams=subscriber_count_changes)
+        flush_stream_subscriber_settings(
+            {sub_info.sub.recipient_id for sub_info in subs_to_deactivate}
+        )
 
         # Log subscription activities in RealmAuditLog
         event_time = timezone_now()
@@ -3,9 +3,16 @@ from typing import Literal
 from django.conf import settings
 from django.utils.translation import gettext as _
 
+from zerver.lib.cache import (
+    cache_delete,
+    cache_get,
+    cache_set,
+    message_edit_typing_start_cache_key,
+    stream_typing_start_cache_key,
+)
 from zerver.lib.exceptions import JsonableError
-from zerver.lib.stream_subscription import get_active_subscriptions_for_stream_id
-from zerver.models import Realm, Stream, UserProfile
+from zerver.lib.stream_subscription import get_stream_subscriber_settings
+from zerver.models import Realm, Recipient, Stream, UserProfile
 from zerver.models.users import get_user_by_id_in_realm_including_cross_realm
 from zerver.tornado.django_api import send_event_rollback_unsafe
 
@@ -69,6 +76,38 @@ def check_send_typing_notification(sender: UserProfile, user_ids: list[int], ope
     )
 
 
+def is_repeated_typing_start(cache_key: str, operator: str) -> bool:
+    """Clients send a "start" notification every
+    TYPING_STARTED_WAIT_PERIOD_MILLISECONDS while the user is typing,
+    and a user may be typing in the same place from several clients;
+    so we coalesce "start" notifications for the same conversation and
+    sender sent within STREAM_TYPING_START_COALESCE_SECONDS of each
+    other, which would not change what recipients display.  A "stop"
+    notification is always sent, and ends the coalescing window."""
+    timeout = settings.STREAM_TYPING_START_COALESCE_SECONDS
+    if timeout == 0:
+        return False
+    if operator == "stop":
+        cache_delete(cache_key)
+        return False
+    if cache_get(cache_key) is not None:
+        return True
+    cache_set(cache_key, True, timeout=timeout)
+    return False
+
+
+def get_stream_typing_notification_user_ids(recipient_id: int) -> set[int] | None:
+    """Returns the users to notify of typing in the stream, or None if
+    the stream has too many subscribers for typing notifications.
+    This is called for every "start" and "stop" notification, so it
+    uses the cached subscriber settings of the stream, rather than
+    querying its subscriptions."""
+    subscriber_settings = get_stream_subscriber_settings(recipient_id)
+    if len(subscriber_settings.user_ids) > settings.MAX_STREAM_SIZE_FOR_TYPING_NOTIFICATIONS:
+        return None
+    return subscriber_settings.typing_notification_user_ids()
+
+
 def do_send_stream_typing_notification(
     sender: UserProfile, operator: str, stream: Stream, topic_name: str
 ) -> None:
@@ -83,32 +122,27 @@ def do_send_stream_typing_notification(
         topic=topic_name,
     )
 
-    subscriptions_query = get_active_subscriptions_for_stream_id(
-        stream.id, include_deactivated_users=False
-    )
-
-    total_subscriptions = subscriptions_query.count()
-    if total_subscriptions > settings.MAX_STREAM_SIZE_FOR_TYPING_NOTIFICATIONS:
-        # TODO: Stream typing notifications are disabled in streams
-        # with too many subscribers for performance reasons.
+    if is_repeated_typing_start(
+        stream_typing_start_cache_key(stream.id, topic_name, sender.id), operator
+    ):
         return
 
-    user_ids_to_notify = set(
-        subscriptions_query.exclude(user_profile__long_term_idle=True)
-        .exclude(user_profile__receives_typing_notifications=False)
-        .values_list("user_profile_id", flat=True)
-    )
+    assert stream.recipient_id is not None
+    user_ids_to_notify = get_stream_typing_notification_user_ids(stream.recipient_id)
+    if user_ids_to_notify is None:
+        return
 
     send_event_rollback_unsafe(sender.realm, event, user_ids_to_notify)
 
 
 def do_send_stream_message_edit_typing_notification(
     sender: UserProfile,
-    channel_id: int,
+    recipient: Recipient,
     message_id: int,
     operator: Literal["start", "stop"],
     topic_name: str,
 ) -> None:
+    channel_id = recipient.type_id
     event = dict(
         type="typing_edit_message",
         op=operator,
@@ -121,22 +155,14 @@ def do_send_stream_message_edit_typing_notification(
         ),
     )
 
-    subscriptions_query = get_active_subscriptions_for_stream_id(
-        channel_id, include_deactivated_users=False
-    )
-
-    total_subscriptions = subscriptions_query.count()
-    if total_subscriptions > settings.MAX_STREAM_SIZE_FOR_TYPING_NOTIFICATIONS:
-        # TODO: Stream typing notifications are disabled in streams
-        # with too many subscribers for performance reasons.
+    if is_repeated_typing_start(
+        message_edit_typing_start_cache_key(message_id, sender.id), operator
+    ):
         return
 
-    # We don't notify long_term_idle subscribers.
-    user_ids_to_notify = set(
-        subscriptions_query.exclude(user_profile__long_term_idle=True)
-        .exclude(user_profile__receives_typing_notifications=False)
-        .values_list("user_profile_id", flat=True)
-    )
+    user_ids_to_notify = get_stream_typing_notification_user_ids(recipient.id)
+    if user_ids_to_notify is None:
+        return
 
     send_event_rollback_unsafe(sender.realm, event, user_ids_to_notify)
 
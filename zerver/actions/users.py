@@ -20,7 +20,7 @@ from zerver.actions.user_groups import (
 )
 from zerver.lib.avatar import get_avatar_field
 from zerver.lib.bot_config import ConfigError, get_bot_config, get_bot_configs, set_bot_config
-from zerver.lib.cache import bot_dict_fields
+from zerver.lib.cache import bot_dict_fields, flush_stream_subscriber_settings
 from zerver.lib.create_user import create_user
 from zerver.lib.event_types import BotServicesOutgoing
 from zerver.lib.invites import revoke_invites_generated_by_user
@@ -33,7 +33,10 @@ from zerver.lib.send_email import (
 )
 from zerver.lib.sessions import delete_user_sessions
 from zerver.lib.soft_deactivation import queue_soft_reactivation
-from zerver.lib.stream_subscription import update_all_subscriber_counts_for_user
+from zerver.lib.stream_subscription import (
+    get_subscribed_stream_recipient_ids_for_user,
+    update_all_subscriber_counts_for_user,
+)
 from zerver.lib.stream_traffic import get_streams_traffic
 from zerver.lib.streams import (
     get_anonymous_group_membership_dict_for_streams,
@@ -98,6 +101,8 @@ def do_delete_user(user_profile: UserProfile, *, acting_user: UserProfile | None
     personal_recipient = user_profile.recipient
 
     with transaction.atomic(durable=True):
+        # The user's subscriptions are deleted by CASCADE.
+        flush_stream_subscriber_settings(get_subscribed_stream_recipient_ids_for_user(user_profile))
         user_profile.delete()
         # Recipient objects don't get deleted through CASCADE, so we need to handle
         # the user's personal recipient manually. This will also delete all Messages pointing
@@ -231,6 +236,8 @@ def do_delete_user_preserving_messages(user_profile: UserProfile) -> None:
         Subscription.objects.filter(
             user_profile=user_profile, recipient__type=Recipient.DIRECT_MESSAGE_GROUP
         ).update(user_profile=temp_replacement_user)
+        # The user's stream subscriptions are deleted by CASCADE.
+        flush_stream_subscriber_settings(get_subscribed_stream_recipient_ids_for_user(user_profile))
         user_profile.delete()
 
         replacement_user = create_user(
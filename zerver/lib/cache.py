@@ -16,6 +16,7 @@ from bmemcached.exceptions import MemcachedException
 from django.conf import settings
 from django.core.cache import caches
 from django.core.cache.backends.base import BaseCache
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from typing_extensions import ParamSpec
 
@@ -24,7 +25,16 @@ from scripts.lib.zulip_tools import DEPLOYMENTS_DIR, get_recent_deployments
 if TYPE_CHECKING:
     # These modules have to be imported for type annotations but
     # they cannot be imported at runtime due to cyclic dependency.
-    from zerver.models import Attachment, Message, MutedUser, Realm, Stream, SubMessage, UserProfile
+    from zerver.models import (
+        Attachment,
+        Message,
+        MutedUser,
+        Realm,
+        Stream,
+        SubMessage,
+        Subscription,
+        UserProfile,
+    )
 
 MEMCACHED_MAX_KEY_LENGTH = 250
 
@@ -527,6 +537,105 @@ def active_non_guest_user_ids_cache_key(realm_id: int) -> str:
     return f"active_non_guest_user_ids:{realm_id}"
 
 
+def stream_subscriber_settings_cache_key(recipient_id: int) -> str:
+    return f"stream_subscriber_settings:{recipient_id}"
+
+
+def flush_stream_subscriber_settings(recipient_ids: Iterable[int]) -> None:
+    keys = [stream_subscriber_settings_cache_key(recipient_id) for recipient_id in recipient_ids]
+    if not keys:
+        return
+    cache_delete_many(keys)
+    # A concurrent send may have queried the subscriptions before this
+    # transaction's changes, and cache that stale result after the
+    # flush above; so we flush again once they are visible.
+    transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def realm_presence_snapshot_cache_key(realm_id: int) -> str:
+    return f"realm_presence_snapshot:{realm_id}"
+
+
+# The number of slots in each realm's ring buffer of presence deltas,
+# keyed by last_update_id; see get_realm_presence_deltas.
+REALM_PRESENCE_DELTA_SLOTS = 500
+
+
+def realm_presence_delta_cache_key(realm_id: int, last_update_id: int) -> str:
+    return f"realm_presence_delta:{realm_id}:{last_update_id % REALM_PRESENCE_DELTA_SLOTS}"
+
+
+def flush_realm_presence_snapshot(realm_id: int) -> None:
+    cache_keys = [realm_presence_snapshot_cache_key(realm_id)] + [
+        realm_presence_delta_cache_key(realm_id, slot) for slot in range(REALM_PRESENCE_DELTA_SLOTS)
+    ]
+    cache_delete_many(cache_keys)
+    # As in flush_stream_subscriber_settings, a concurrent fetch or
+    # presence update may cache a snapshot or delta from before this
+    # transaction's changes.
+    transaction.on_commit(lambda: cache_delete_many(cache_keys))
+
+
+def user_unread_snapshot_cache_key(user_profile_id: int) -> str:
+    return f"user_unread_snapshot:{user_profile_id}"
+
+
+def user_unread_snapshot_generation_cache_key(user_profile_id: int) -> str:
+    return f"user_unread_snapshot_generation:{user_profile_id}"
+
+
+def flush_user_unread_snapshots(user_profile_ids: Iterable[int]) -> None:
+    user_profile_ids = list(user_profile_ids)
+    if not user_profile_ids:
+        return
+
+    def flush() -> None:
+        cache_delete_many(
+            [
+                user_unread_snapshot_cache_key(user_profile_id)
+                for user_profile_id in user_profile_ids
+            ]
+        )
+        # A page load which read the database before this flush may
+        # still write its snapshot afterwards; it won't match the new
+        # generation, so it'll be ignored.
+        cache_set_many(
+            {
+                user_unread_snapshot_generation_cache_key(user_profile_id): secrets.token_hex(8)
+                for user_profile_id in user_profile_ids
+            },
+            timeout=3600 * 24 * 7,
+        )
+
+    flush()
+    # As in flush_stream_subscriber_settings, a concurrent page load
+    # may cache a snapshot from before this transaction's changes.
+    transaction.on_commit(flush)
+
+
+def stream_typing_start_cache_key(stream_id: int, topic_name: str, sender_id: int) -> str:
+    topic_hash = hashlib.sha1(topic_name.encode()).hexdigest()
+    return f"stream_typing_start:{stream_id}:{topic_hash}:{sender_id}"
+
+
+def message_edit_typing_start_cache_key(message_id: int, sender_id: int) -> str:
+    return f"message_edit_typing_start:{message_id}:{sender_id}"
+
+
+# The fields of UserProfile which StreamSubscriberSettings depends on.
+stream_subscriber_settings_user_fields = [
+    "is_active",
+    "long_term_idle",
+    "enable_stream_push_notifications",
+    "enable_stream_email_notifications",
+    "wildcard_mentions_notify",
+    "enable_followed_topic_push_notifications",
+    "enable_followed_topic_email_notifications",
+    "enable_followed_topic_wildcard_mentions_notify",
+    "receives_typing_notifications",
+]
+
+
 def get_realm_system_groups_cache_key(realm_id: int) -> str:
     return f"realm_system_groups:{realm_id}"
 
@@ -591,6 +700,19 @@ def changed(update_fields: Sequence[str] | None, fields: list[str]) -> bool:
     return any(f in update_fields_set for f in fields)
 
 
+# The fields of UserProfile included in the API payloads of the
+# messages they send or receive.
+message_payload_user_fields = [
+    "avatar_source",
+    "avatar_version",
+    "delivery_email",
+    "email",
+    "email_address_visibility",
+    "full_name",
+    "is_mirror_dummy",
+]
+
+
 # Called by models/users.py to flush the user_profile cache whenever we save
 # a user_profile object
 def flush_user_profile(
@@ -617,11 +739,25 @@ def flush_user_profile(
     if changed(update_fields, ["email", "full_name", "id", "is_mirror_dummy"]):
         delete_display_recipient_cache(user_profile)
 
+    if not kwargs.get("created") and changed(update_fields, message_payload_user_fields):
+        flush_user_message_payloads(user_profile)
+
+    # The realm's presence snapshot only includes active users, and
+    # falls back to date_joined for missing presence timestamps.
+    if not kwargs.get("created") and changed(update_fields, ["is_active", "date_joined"]):
+        flush_realm_presence_snapshot(user_profile.realm_id)
+
     # Invalidate our bots_in_realm info dict if any bot has
     # changed the fields in the dict or become (in)active
     if user_profile.is_bot and changed(update_fields, bot_dict_fields):
         cache_delete(bot_dicts_in_realm_cache_key(user_profile.realm_id))
 
+    if changed(update_fields, stream_subscriber_settings_user_fields):
+        # Imported here to avoid cyclic dependency.
+        from zerver.lib.stream_subscription import get_subscribed_stream_recipient_ids_for_user
+
+        flush_stream_subscriber_settings(get_subscribed_stream_recipient_ids_for_user(user_profile))
+
 
 def flush_muting_users_cache(*, instance: "MutedUser", **kwargs: object) -> None:
     mute_object = instance
@@ -655,6 +791,7 @@ def flush_realm(
         cache_delete(active_non_guest_user_ids_cache_key(realm.id))
         cache_delete(realm_rendered_description_cache_key(realm))
         cache_delete(realm_text_description_cache_key(realm))
+        flush_message_payloads(realm.id)
     elif changed(update_fields, ["description"]):
         cache_delete(realm_rendered_description_cache_key(realm))
         cache_delete(realm_text_description_cache_key(realm))
@@ -696,6 +833,41 @@ def flush_stream(
     ):
         cache_delete(bot_dicts_in_realm_cache_key(stream.realm_id))
 
+    if (
+        not kwargs.get("created")
+        and changed(update_fields, ["name"])
+        and stream.recipient_id is not None
+    ):
+        flush_message_payload_generations(
+            [message_payload_recipient_generation_cache_key(stream.recipient_id)]
+        )
+
+
+# The fields of Subscription which StreamSubscriberSettings depends on.
+stream_subscriber_settings_subscription_fields = [
+    "active",
+    "is_user_active",
+    "is_muted",
+    "push_notifications",
+    "email_notifications",
+    "wildcard_mentions_notify",
+]
+
+
+# Called by models/streams.py whenever we save a Subscription; bulk
+# changes to subscriptions, and code paths which delete them, call
+# flush_stream_subscriber_settings directly.  We don't flush from a
+# post_delete hook, since that would prevent Django from deleting
+# subscriptions in bulk when deleting their users or streams.
+def flush_subscription(
+    *,
+    instance: "Subscription",
+    update_fields: Sequence[str] | None = None,
+    **kwargs: object,
+) -> None:
+    if changed(update_fields, stream_subscriber_settings_subscription_fields):
+        flush_stream_subscriber_settings([instance.recipient_id])
+
 
 def flush_used_upload_space_cache(
     *,
@@ -717,6 +889,64 @@ def to_dict_cache_key(message: "Message", realm_id: int | None = None) -> str:
     return to_dict_cache_key_id(message.id)
 
 
+def message_payload_cache_key(message_id: int, variant: str) -> str:
+    return f"message_payload:{message_id}:{variant}"
+
+
+def message_payload_generation_cache_key(realm_id: int) -> str:
+    return f"message_payload_generation:{realm_id}"
+
+
+def message_payload_user_generation_cache_key(user_id: int) -> str:
+    return f"message_payload_generation:user:{user_id}"
+
+
+def message_payload_recipient_generation_cache_key(recipient_id: int) -> str:
+    return f"message_payload_generation:recipient:{recipient_id}"
+
+
+def flush_message_payload_generations(keys: list[str]) -> None:
+    cache_delete_many(keys)
+    # As in flush_stream_subscriber_settings, a concurrent fetch may
+    # cache payloads built before this transaction's changes.
+    transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def flush_message_payloads(realm_id: int) -> None:
+    """Invalidates the cached API payloads of all of the realm's
+    messages, which include the realm's subdomain; see
+    get_cached_message_payloads."""
+    flush_message_payload_generations([message_payload_generation_cache_key(realm_id)])
+
+
+def flush_user_message_payloads(user_profile: "UserProfile") -> None:
+    """Invalidates the cached API payloads of the messages which
+    include the user's name, email or avatar: those they sent, and
+    the direct messages they received."""
+    from zerver.models import Recipient, Subscription
+
+    recipient_ids = Subscription.objects.filter(
+        user_profile=user_profile,
+        recipient__type__in=[Recipient.PERSONAL, Recipient.DIRECT_MESSAGE_GROUP],
+    ).values_list("recipient_id", flat=True)
+    flush_message_payload_generations(
+        [
+            message_payload_user_generation_cache_key(user_profile.id),
+            *(
+                message_payload_recipient_generation_cache_key(recipient_id)
+                for recipient_id in recipient_ids
+            ),
+        ]
+    )
+
+
+def topic_participants_cache_key(recipient_id: int, topic_name: str) -> str:
+    # Topics are case-insensitive, and their names may contain
+    # characters which are not valid in cache keys.
+    topic_hash = hashlib.sha1(topic_name.lower().encode()).hexdigest()
+    return f"topic_participants:{recipient_id}:{topic_hash}"
+
+
 def open_graph_description_cache_key(content: bytes, request_url: str) -> str:
     return f"open_graph_description_path:{hashlib.sha1(request_url.encode()).hexdigest()}"
 
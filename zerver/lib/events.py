@@ -4,6 +4,7 @@ import copy
 import logging
 import time
 from collections.abc import Callable, Collection, Iterable, Sequence
+from functools import partial
 from typing import Any, Literal
 
 from django.conf import settings
@@ -27,6 +28,7 @@ from zerver.lib.compatibility import is_outdated_server
 from zerver.lib.default_streams import get_default_stream_ids_for_realm
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.external_accounts import get_default_external_accounts
+from zerver.lib.fetch_plan import FetchPlan
 from zerver.lib.integrations import (
     EMBEDDED_BOTS,
     WEBHOOK_INTEGRATIONS,
@@ -69,8 +71,9 @@ from zerver.lib.thumbnail import THUMBNAIL_OUTPUT_FORMATS
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.timezone import canonicalize_timezone
 from zerver.lib.topic import TOPIC_NAME, maybe_rename_general_chat_to_empty_topic
-from zerver.lib.types import UserGroupMembersData
+from zerver.lib.types import APIStreamDict, SubscriptionInfo, UserGroupMembersData
 from zerver.lib.user_groups import (
+    RealmUserGroupsData,
     get_group_setting_value_for_register_api,
     get_recursive_membership_groups,
     get_role_based_system_groups_dict,
@@ -238,12 +241,12 @@ def fetch_initial_state_data(
             get_recursive_membership_groups(settings_user).values_list("id", flat=True)
         )
 
-    if (
-        want("realm_user_groups")
-        or want("realm")
-        or (want("stream") and include_streams)
-        or want("subscription")
-    ):
+    # The sections of the state which make the most round trips to the
+    # database, and depend on no other part of the state, are fetched
+    # together, possibly concurrently; see FetchPlan.
+    plan = FetchPlan()
+
+    def fetch_user_groups() -> tuple[RealmUserGroupsData, dict[int, UserGroupMembersData]]:
         # Optimizing opportunity: This fetches more data than
         # we strictly need when "realm_user_groups" is not in
         # fetch_event_types; we need the membership of the
@@ -261,6 +264,97 @@ def fetch_initial_state_data(
                 direct_members=value["direct_members"],
                 direct_subgroups=value["direct_subgroups"],
             )
+        return realm_groups_data, anonymous_group_membership_data_dict
+
+    if (
+        want("realm_user_groups")
+        or want("realm")
+        or (want("stream") and include_streams)
+        or want("subscription")
+    ):
+        plan.add("user_groups", fetch_user_groups)
+
+    if want("presence") and user_profile is not None:
+        if presence_last_update_id_fetched_by_client is not None:
+            # This param being submitted by the client, means they want to use
+            # the modern API.
+            slim_presence = True
+
+        plan.add(
+            "presence",
+            partial(
+                get_presences_for_realm,
+                realm,
+                slim_presence,
+                last_update_id_fetched_by_client=presence_last_update_id_fetched_by_client,
+                history_limit_days=presence_history_limit_days,
+                requesting_user_profile=user_profile,
+            ),
+        )
+
+    if want("realm_user"):
+        plan.add(
+            "realm_user",
+            partial(
+                get_users_for_api,
+                realm,
+                user_profile,
+                client_gravatar=client_gravatar,
+                user_avatar_url_field_optional=user_avatar_url_field_optional,
+                # Don't send custom profile field values to spectators.
+                include_custom_profile_fields=user_profile is not None,
+                user_list_incomplete=user_list_incomplete,
+            ),
+        )
+
+    if want("recent_private_conversations") and user_profile is not None:
+        plan.add(
+            "recent_private_conversations",
+            partial(get_recent_private_conversations, user_profile),
+        )
+
+    if want("subscription"):
+
+        def fetch_subscriptions() -> SubscriptionInfo:
+            anonymous_group_membership_data_dict = plan.result("user_groups")[1]
+            if user_profile is not None:
+                return gather_subscriptions_helper(
+                    user_profile,
+                    include_subscribers=include_subscribers,
+                    include_archived_channels=archived_channels,
+                    anonymous_group_membership=anonymous_group_membership_data_dict,
+                )
+            return get_web_public_subs(realm, anonymous_group_membership_data_dict)
+
+        plan.add("subscription", fetch_subscriptions, after=["user_groups"])
+
+    if want("update_message_flags") and want("message") and user_profile is not None:
+        plan.add("raw_unread_msgs", partial(get_raw_unread_data, user_profile))
+
+    if want("stream") and include_streams:
+
+        def fetch_streams() -> list[APIStreamDict]:
+            anonymous_group_membership_data_dict = plan.result("user_groups")[1]
+            if user_profile is not None:
+                return do_get_streams(
+                    user_profile,
+                    include_web_public=True,
+                    exclude_archived=not archived_channels,
+                    include_all=True,
+                    anonymous_group_membership=anonymous_group_membership_data_dict,
+                )
+            # TODO: This line isn't used by the web app because it
+            # gets these data via the `subscriptions` key; it will
+            # be used when the mobile apps support logged-out
+            # access.
+            return get_web_public_streams(realm, anonymous_group_membership_data_dict)  # nocoverage
+
+        plan.add("stream", fetch_streams, after=["user_groups"])
+
+    plan.run()
+
+    if "user_groups" in plan.sections:
+        realm_groups_data, anonymous_group_membership_data_dict = plan.result("user_groups")
 
     if want("alert_words"):
         state["alert_words"] = [] if user_profile is None else user_alert_words(user_profile)
@@ -349,19 +443,8 @@ def fetch_initial_state_data(
         state["muted_users"] = [] if user_profile is None else get_user_mutes(user_profile)
 
     if want("presence"):
-        if presence_last_update_id_fetched_by_client is not None:
-            # This param being submitted by the client, means they want to use
-            # the modern API.
-            slim_presence = True
-
         if user_profile is not None:
-            presences, presence_last_update_id_fetched_by_server = get_presences_for_realm(
-                realm,
-                slim_presence,
-                last_update_id_fetched_by_client=presence_last_update_id_fetched_by_client,
-                history_limit_days=presence_history_limit_days,
-                requesting_user_profile=user_profile,
-            )
+            presences, presence_last_update_id_fetched_by_server = plan.result("presence")
             state["presences"] = presences
             state["presence_last_update_id"] = presence_last_update_id_fetched_by_server
         else:
@@ -663,15 +746,7 @@ def fetch_initial_state_data(
         )
 
     if want("realm_user"):
-        state["raw_users"] = get_users_for_api(
-            realm,
-            user_profile,
-            client_gravatar=client_gravatar,
-            user_avatar_url_field_optional=user_avatar_url_field_optional,
-            # Don't send custom profile field values to spectators.
-            include_custom_profile_fields=user_profile is not None,
-            user_list_incomplete=user_list_incomplete,
-        )
+        state["raw_users"] = plan.result("realm_user")
         state["cross_realm_bots"] = list(get_cross_realm_dicts())
 
         # For the user's own avatar URL, we force
@@ -782,20 +857,11 @@ def fetch_initial_state_data(
         # which is more efficient to update, and is rewritten to the
         # final format in post_process_state.
         state["raw_recent_private_conversations"] = (
-            {} if user_profile is None else get_recent_private_conversations(user_profile)
+            {} if user_profile is None else plan.result("recent_private_conversations")
         )
 
     if want("subscription"):
-        if user_profile is not None:
-            sub_info = gather_subscriptions_helper(
-                user_profile,
-                include_subscribers=include_subscribers,
-                include_archived_channels=archived_channels,
-                anonymous_group_membership=anonymous_group_membership_data_dict,
-            )
-        else:
-            sub_info = get_web_public_subs(realm, anonymous_group_membership_data_dict)
-
+        sub_info = plan.result("subscription")
         state["subscriptions"] = sub_info.subscriptions
         state["unsubscribed"] = sub_info.unsubscribed
         state["never_subscribed"] = sub_info.never_subscribed
@@ -813,7 +879,7 @@ def fetch_initial_state_data(
         # message event.
 
         if user_profile is not None:
-            state["raw_unread_msgs"] = get_raw_unread_data(user_profile)
+            state["raw_unread_msgs"] = plan.result("raw_unread_msgs")
         else:
             # For logged-out visitors, we treat all messages as read;
             # calling this helper lets us return empty objects in the
@@ -829,22 +895,7 @@ def fetch_initial_state_data(
         # The web app doesn't use the data from here; instead,
         # it uses data from state["subscriptions"] and other
         # places.
-        if user_profile is not None:
-            state["streams"] = do_get_streams(
-                user_profile,
-                include_web_public=True,
-                exclude_archived=not archived_channels,
-                include_all=True,
-                anonymous_group_membership=anonymous_group_membership_data_dict,
-            )
-        else:
-            # TODO: This line isn't used by the web app because it
-            # gets these data via the `subscriptions` key; it will
-            # be used when the mobile apps support logged-out
-            # access.
-            state["streams"] = get_web_public_streams(
-                realm, anonymous_group_membership_data_dict
-            )  # nocoverage
+        state["streams"] = plan.result("stream")
     if want("default_streams"):
         if settings_user.is_guest:
             # Guest users and logged-out users don't have access to
@@ -34,8 +34,8 @@ from zerver.actions.user_settings import do_change_avatar_fields
 from zerver.lib.avatar_hash import user_avatar_base_path_from_ids
 from zerver.lib.bulk_create import bulk_set_users_or_streams_recipient_fields
 from zerver.lib.export import DATE_FIELDS, Field, Path, Record, TableData, TableName
-from zerver.lib.markdown import markdown_convert
 from zerver.lib.markdown import version as markdown_version
+from zerver.lib.markdown.render_pool import MarkdownRenderingPool, MarkdownRenderRequest
 from zerver.lib.message import get_last_message_id
 from zerver.lib.migration_status import MigrationStatusJson, parse_migration_status
 from zerver.lib.mime_types import guess_type
@@ -64,7 +64,7 @@ from zerver.lib.upload import ensure_avatar_image, sanitize_name, upload_backend
 from zerver.lib.upload.s3 import get_bucket
 from zerver.lib.user_counts import realm_user_count_by_role
 from zerver.lib.user_groups import create_system_user_groups_for_realm
-from zerver.lib.user_message import UserMessageLite, bulk_insert_ums
+from zerver.lib.user_message import UserMessageRows, bulk_insert_ums
 from zerver.lib.utils import generate_api_key, process_list_in_batches
 from zerver.lib.zulip_update_announcements import send_zulip_update_announcements_to_realm
 from zerver.models import (
@@ -399,11 +399,15 @@ def fix_message_rendered_content(
     messages: list[Record],
     content_key: str = "content",
     rendered_content_key: str = "rendered_content",
+    render_pool: MarkdownRenderingPool | None = None,
 ) -> None:
     """
     This function sets the rendered_content of the messages we're importing.
+    Messages which need rendering from scratch are rendered using
+    render_pool, if passed, which may render them in parallel.
     """
-    for message in messages:
+    render_requests: list[MarkdownRenderRequest] = []
+    for index, message in enumerate(messages):
         if content_key not in message:
             # Message-edit entries include topic moves, which don't
             # have any content changes to process.
@@ -469,45 +473,50 @@ def fix_message_rendered_content(
             continue
 
         try:
-            content = message[content_key]
-
-            sender_id = message["sender_id"]
-            sender = sender_map[sender_id]
-            sent_by_bot = sender["is_bot"]
-            translate_emoticons = sender["translate_emoticons"]
-
+            sender = sender_map[message["sender_id"]]
             # We don't handle alert words on import from third-party
             # platforms, since they generally don't have an "alert
             # words" type feature, and notifications aren't important anyway.
-            realm_alert_words_automaton = None
-
-            # This also enqueues thumbnailing for images that are referenced
-            rendered_content = markdown_convert(
-                content=content,
-                realm_alert_words_automaton=realm_alert_words_automaton,
-                message_realm=realm,
-                sent_by_bot=sent_by_bot,
-                translate_emoticons=translate_emoticons,
-            ).rendered_content
-
-            message[rendered_content_key] = rendered_content
-            if "scheduled_timestamp" not in message:
-                # This logic runs also for ScheduledMessage, which doesn't use
-                # the rendered_content_version field.
-                message["rendered_content_version"] = markdown_version
+            render_requests.append(
+                MarkdownRenderRequest(
+                    key=index,
+                    content=message[content_key],
+                    realm_id=realm.id,
+                    sent_by_bot=sender["is_bot"],
+                    translate_emoticons=sender["translate_emoticons"],
+                )
+            )
         except Exception:
+            logging.warning(
+                "Error in Markdown rendering for message ID %s; continuing", message["id"]
+            )
+
+    if render_pool is None:
+        render_pool = MarkdownRenderingPool(processes=1)
+    # This also enqueues thumbnailing for images that are referenced
+    for result in render_pool.render(render_requests):
+        message = messages[result.key]
+        if result.rendered_content is None:
             # This generally happens with two possible causes:
             # * rendering Markdown throwing an uncaught exception
-            # * rendering Markdown failing with the exception being
-            #   caught in Markdown (which then returns None, causing the
-            #   rendered_content assert above to fire).
+            # * rendering Markdown timing out
             logging.warning(
                 "Error in Markdown rendering for message ID %s; continuing", message["id"]
             )
+            continue
+
+        message[rendered_content_key] = result.rendered_content
+        if "scheduled_timestamp" not in message:
+            # This logic runs also for ScheduledMessage, which doesn't use
+            # the rendered_content_version field.
+            message["rendered_content_version"] = markdown_version
 
 
 def fix_message_edit_history(
-    realm: Realm, sender_map: dict[int, Record], messages: list[Record]
+    realm: Realm,
+    sender_map: dict[int, Record],
+    messages: list[Record],
+    render_pool: MarkdownRenderingPool | None = None,
 ) -> None:
     user_id_map = ID_MAP["user_profile"]
     for message in messages:
@@ -525,6 +534,7 @@ def fix_message_edit_history(
             messages=edit_history,
             content_key="prev_content",
             rendered_content_key="prev_rendered_content",
+            render_pool=render_pool,
         )
 
         message["edit_history"] = orjson.dumps(edit_history).decode()
@@ -789,14 +799,9 @@ def bulk_import_user_message_data(data: TableData, dump_file_id: int) -> None:
     # so we can safely avoid all re-mapping complexity.
 
     def process_batch(items: list[dict[str, Any]]) -> None:
-        ums = [
-            UserMessageLite(
-                user_profile_id=item["user_profile_id"],
-                message_id=item["message_id"],
-                flags=item["flags"],
-            )
-            for item in items
-        ]
+        ums = UserMessageRows()
+        for item in items:
+            ums.append(item["user_profile_id"], item["message_id"], item["flags"])
         bulk_insert_ums(ums)
 
     chunk_size = 10000
@@ -1760,7 +1765,9 @@ def do_import_realm(import_dir: Path, subdomain: str, processes: int = 1) -> Rea
     map_messages_to_attachments(attachment_data)
 
     # Import zerver_message and zerver_usermessage
-    import_message_data(realm=realm, sender_map=sender_map, import_dir=import_dir)
+    import_message_data(
+        realm=realm, sender_map=sender_map, import_dir=import_dir, processes=processes
+    )
 
     if "zerver_onboardingusermessage" in data:
         fix_bitfield_keys(data, "zerver_onboardingusermessage", "flags")
@@ -2031,61 +2038,68 @@ def get_incoming_message_ids(import_dir: Path, sort_by_date: bool) -> list[int]:
     return message_ids
 
 
-def import_message_data(realm: Realm, sender_map: dict[int, Record], import_dir: Path) -> None:
-    dump_file_id = 1
-    while True:
-        message_filename = os.path.join(import_dir, f"messages-{dump_file_id:06}.json")
-        if not os.path.exists(message_filename):
-            break
-
-        with open(message_filename, "rb") as f:
-            data = orjson.loads(f.read())
-
-        logging.info("Importing message dump %s", message_filename)
-        re_map_foreign_keys(data, "zerver_message", "sender", related_table="user_profile")
-        re_map_foreign_keys(data, "zerver_message", "recipient", related_table="recipient")
-        re_map_foreign_keys(data, "zerver_message", "sending_client", related_table="client")
-        fix_datetime_fields(data, "zerver_message")
-        # Parser to update message content with the updated attachment URLs
-        fix_upload_links(data, "zerver_message")
-
-        # We already create mappings for zerver_message ids
-        # in update_message_foreign_keys(), so here we simply
-        # apply them.
-        message_id_map = ID_MAP["message"]
-        for row in data["zerver_message"]:
-            del row["realm"]
-            row["realm_id"] = realm.id
-            row["id"] = message_id_map[row["id"]]
-
-        for row in data["zerver_usermessage"]:
-            assert row["message"] in message_id_map
-
-        fix_message_rendered_content(
-            realm=realm,
-            sender_map=sender_map,
-            messages=data["zerver_message"],
-        )
-        logging.info("Successfully rendered Markdown for message batch")
+def import_message_data(
+    realm: Realm, sender_map: dict[int, Record], import_dir: Path, processes: int = 1
+) -> None:
+    with MarkdownRenderingPool(processes, realm_ids=[realm.id]) as render_pool:
+        dump_file_id = 1
+        while True:
+            message_filename = os.path.join(import_dir, f"messages-{dump_file_id:06}.json")
+            if not os.path.exists(message_filename):
+                break
+
+            with open(message_filename, "rb") as f:
+                data = orjson.loads(f.read())
+
+            logging.info("Importing message dump %s", message_filename)
+            re_map_foreign_keys(data, "zerver_message", "sender", related_table="user_profile")
+            re_map_foreign_keys(data, "zerver_message", "recipient", related_table="recipient")
+            re_map_foreign_keys(data, "zerver_message", "sending_client", related_table="client")
+            fix_datetime_fields(data, "zerver_message")
+            # Parser to update message content with the updated attachment URLs
+            fix_upload_links(data, "zerver_message")
+
+            # We already create mappings for zerver_message ids
+            # in update_message_foreign_keys(), so here we simply
+            # apply them.
+            message_id_map = ID_MAP["message"]
+            for row in data["zerver_message"]:
+                del row["realm"]
+                row["realm_id"] = realm.id
+                row["id"] = message_id_map[row["id"]]
+
+            for row in data["zerver_usermessage"]:
+                assert row["message"] in message_id_map
+
+            fix_message_rendered_content(
+                realm=realm,
+                sender_map=sender_map,
+                messages=data["zerver_message"],
+                render_pool=render_pool,
+            )
+            logging.info("Successfully rendered Markdown for message batch")
 
-        fix_message_edit_history(
-            realm=realm, sender_map=sender_map, messages=data["zerver_message"]
-        )
-        # A LOT HAPPENS HERE.
-        # This is where we actually import the message data.
-        bulk_import_model(data, Message)
-
-        # Due to the structure of these message chunks, we're
-        # guaranteed to have already imported all the Message objects
-        # for this batch of UserMessage objects.
-        re_map_foreign_keys(data, "zerver_usermessage", "message", related_table="message")
-        re_map_foreign_keys(
-            data, "zerver_usermessage", "user_profile", related_table="user_profile"
-        )
-        fix_bitfield_keys(data, "zerver_usermessage", "flags")
+            fix_message_edit_history(
+                realm=realm,
+                sender_map=sender_map,
+                messages=data["zerver_message"],
+                render_pool=render_pool,
+            )
+            # A LOT HAPPENS HERE.
+            # This is where we actually import the message data.
+            bulk_import_model(data, Message)
+
+            # Due to the structure of these message chunks, we're
+            # guaranteed to have already imported all the Message objects
+            # for this batch of UserMessage objects.
+            re_map_foreign_keys(data, "zerver_usermessage", "message", related_table="message")
+            re_map_foreign_keys(
+                data, "zerver_usermessage", "user_profile", related_table="user_profile"
+            )
+            fix_bitfield_keys(data, "zerver_usermessage", "flags")
 
-        bulk_import_user_message_data(data, dump_file_id)
-        dump_file_id += 1
+            bulk_import_user_message_data(data, dump_file_id)
+            dump_file_id += 1
 
 
 def import_attachments(data: TableData) -> None:
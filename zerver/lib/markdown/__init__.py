@@ -1,12 +1,13 @@
 # Zulip's main Markdown implementation.  See docs/subsystems/markdown.md for
 # detailed documentation on our Markdown syntax.
+import hashlib
 import html
 import logging
 import mimetypes
 import re
 import time
-from collections import deque
-from collections.abc import Callable
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from email.message import EmailMessage
@@ -27,6 +28,7 @@ import markdown.postprocessors
 import markdown.preprocessors
 import markdown.treeprocessors
 import markdown.util
+import orjson
 import re2
 import regex
 import requests
@@ -39,7 +41,7 @@ from tlds import tld_set
 from typing_extensions import NotRequired, Self, override
 
 from zerver.lib import mention
-from zerver.lib.cache import cache_with_key
+from zerver.lib.cache import cache_get, cache_set, cache_with_key
 from zerver.lib.camo import get_camo_url
 from zerver.lib.emoji import EMOTICON_RE, codepoint_to_name, name_to_codepoint, translate_emoticons
 from zerver.lib.emoji_utils import emoji_to_hex_codepoint, unqualify_emoji
@@ -57,7 +59,7 @@ from zerver.lib.mention import (
 from zerver.lib.mime_types import AUDIO_INLINE_MIME_TYPES, guess_type
 from zerver.lib.outgoing_http import OutgoingSession
 from zerver.lib.subdomains import is_static_or_current_realm_url
-from zerver.lib.tex import render_tex
+from zerver.lib.tex import render_tex, render_tex_batch
 from zerver.lib.thumbnail import (
     AttachmentData,
     get_user_upload_previews,
@@ -1635,6 +1637,37 @@ def content_has_emoji_syntax(content: str) -> bool:
     return re.search(EMOJI_REGEX, content) is not None
 
 
+TEX_RE = r"\B(?<!\$)\$\$(?P<body>[^\n_$](\\\$|[^$\n])*)\$\$(?!\$)\B"
+
+
+def possible_tex_spans(content: str) -> list[tuple[str, bool]]:
+    """Returns the (tex, is_inline) pairs that the Tex pattern and math
+    code blocks in content might render.
+
+    Like possible_linked_stream_names, this does not attempt to filter
+    out syntax in code blocks, so should be a superset of the TeX
+    which is actually rendered.
+    """
+    spans = [(match.group("body"), True) for match in re.finditer(TEX_RE, content)]
+    fence = None
+    lines: list[str] = []
+    for line in content.split("\n"):
+        if fence is None:
+            m = FENCE_RE.match(line)
+            if m and m.group("lang") is not None and m.group("lang").lower() == "math":
+                fence = m.group("fence")
+        elif line.rstrip() == fence:
+            # As in fenced_code.TexHandler, each paragraph is rendered
+            # separately, in display mode.
+            if lines:
+                spans += [(paragraph, False) for paragraph in "\n".join(lines).split("\n\n")]
+            fence = None
+            lines = []
+        else:
+            lines.append(line.rstrip())
+    return spans
+
+
 class Tex(markdown.inlinepatterns.Pattern):
     @override
     def handleMatch(self, match: Match[str]) -> str | Element:
@@ -1906,6 +1939,124 @@ def prepare_linkifier_pattern(source: str) -> str:
     return rf"""(?P<{BEFORE_CAPTURE_GROUP}>^|\s|{next_line}|\pZ|['"\(,:<])(?P<{OUTER_CAPTURE_GROUP}>{source})(?P<{AFTER_CAPTURE_GROUP}>$|[^\pL\pN])"""
 
 
+LINKIFIER_SET_MAX_MEM = 64 << 20
+
+
+class LinkifierMatcher:
+    """A realm's linkifiers, compiled to be matched against text together.
+
+    Running each linkifier's regex over every piece of text costs time
+    linear in the number of linkifiers, and realms can have hundreds.
+    So we also compile all of the linkifiers into a single re2 Set,
+    which finds which linkifiers match a text at all in one scan; only
+    those linkifiers' own regexes, which we need for the positions and
+    groups of their matches, are then run over it.
+    """
+
+    def __init__(self, linkifiers: tuple[tuple[str, str], ...]) -> None:
+        # Do not write errors to stderr (this still raises exceptions)
+        options = re2.Options()
+        options.log_errors = False
+
+        self.patterns: list[re2._Regexp[str] | None] = []
+        self.url_templates: list[uri_template.URITemplate] = []
+        self.candidate_set: re2.Set | None = None
+        if len(linkifiers) > 1:
+            # With re2's default memory budget of 8MiB, a set of a
+            # couple hundred linkifiers fails to compile.
+            set_options = re2.Options()
+            set_options.log_errors = False
+            set_options.max_mem = LINKIFIER_SET_MAX_MEM
+            self.candidate_set = re2.Set.SearchSet(set_options)
+        valid_indexes: list[int] = []
+        for index, (source_pattern, url_template) in enumerate(linkifiers):
+            prepared_pattern = prepare_linkifier_pattern(source_pattern)
+            self.url_templates.append(uri_template.URITemplate(url_template))
+            try:
+                self.patterns.append(re2.compile(prepared_pattern, options=options))
+            except re2.error:
+                # An invalid regex shouldn't be possible here, and logging
+                # here on an invalid regex would spam the logs with every
+                # message sent; simply skip the linkifier.
+                self.patterns.append(None)
+                continue
+            valid_indexes.append(index)
+            if self.candidate_set is not None:
+                self.candidate_set.Add(prepared_pattern)
+        if self.candidate_set is not None:
+            try:
+                self.candidate_set.Compile()
+            except re2.error:
+                # Too many linkifiers for the budget; every linkifier
+                # is then a candidate for every text.
+                self.candidate_set = None
+        # Maps positions in the candidate set to linkifier indexes,
+        # which differ if there were invalid linkifiers.
+        self.valid_indexes = valid_indexes
+
+        # Python-Markdown tries each linkifier on the same text in
+        # turn, so we keep the candidates for the most recent text.
+        self.last_candidates: tuple[str, frozenset[int]] = ("", frozenset())
+
+    def candidates(self, text: str) -> frozenset[int]:
+        """The indexes of the linkifiers which match somewhere in text."""
+        last_text, last_candidates = self.last_candidates
+        if text == last_text:
+            return last_candidates
+        if self.candidate_set is None:
+            candidates = frozenset(self.valid_indexes)
+        else:
+            # Set.Match returns None, rather than an empty list, when
+            # no linkifier matches.
+            matches = self.candidate_set.Match(text) or []
+            candidates = frozenset(self.valid_indexes[match] for match in matches)
+        self.last_candidates = (text, candidates)
+        return candidates
+
+    def search(self, index: int, text: str, pos: int = 0) -> "re2._Match[str] | None":
+        if index not in self.candidates(text):
+            return None
+        pattern = self.patterns[index]
+        assert pattern is not None
+        return pattern.search(text, pos)
+
+    def finditer(self, index: int, text: str, pos: int = 0) -> "Iterator[re2._Match[str]]":
+        if index not in self.candidates(text):
+            return iter(())
+        pattern = self.patterns[index]
+        assert pattern is not None
+        return pattern.finditer(text, pos)
+
+
+@lru_cache(maxsize=256)
+def get_linkifier_matcher(linkifiers: tuple[tuple[str, str], ...]) -> LinkifierMatcher:
+    return LinkifierMatcher(linkifiers)
+
+
+def linkifier_matcher_for(linkifiers: list[LinkifierDict]) -> LinkifierMatcher:
+    return get_linkifier_matcher(
+        tuple((linkifier["pattern"], linkifier["url_template"]) for linkifier in linkifiers)
+    )
+
+
+class LinkifierRegex:
+    """The regex Python-Markdown runs for one linkifier, which only
+    searches texts that the linkifier's LinkifierMatcher has found it
+    matches somewhere in."""
+
+    def __init__(self, matcher: LinkifierMatcher, index: int) -> None:
+        self.matcher = matcher
+        self.index = index
+
+    def search(self, text: str, pos: int = 0) -> "re2._Match[str] | None":
+        return self.matcher.search(self.index, text, pos)
+
+    def finditer(self, text: str, pos: int = 0) -> "Iterator[re2._Match[str]]":
+        # Python-Markdown's inline processors iterate over the matches,
+        # since handleMatch may reject one.
+        return self.matcher.finditer(self.index, text, pos)
+
+
 # Given a regular expression pattern, linkifies groups that match it
 # using the provided format string to construct the URL.
 class LinkifierPattern(CompiledInlineProcessor):
@@ -1913,19 +2064,13 @@ class LinkifierPattern(CompiledInlineProcessor):
 
     def __init__(
         self,
-        source_pattern: str,
-        url_template: str,
+        matcher: LinkifierMatcher,
+        index: int,
         zmd: "ZulipMarkdown",
     ) -> None:
-        # Do not write errors to stderr (this still raises exceptions)
-        options = re2.Options()
-        options.log_errors = False
-
-        compiled_re2 = re2.compile(prepare_linkifier_pattern(source_pattern), options=options)
+        self.prepared_url_template = matcher.url_templates[index]
 
-        self.prepared_url_template = uri_template.URITemplate(url_template)
-
-        super().__init__(compiled_re2, zmd)
+        super().__init__(cast("re2._Regexp[str]", LinkifierRegex(matcher, index)), zmd)
 
     @override
     def handleMatch(  # type: ignore[override] # https://github.com/python/mypy/issues/10197
@@ -2214,16 +2359,31 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
         super().__init__(zmd)
         self.zmd = zmd
 
-    def check_valid_start_position(self, content: str, index: int) -> bool:
-        if index <= 0 or content[index] in self.allowed_before_punctuation:
+    @classmethod
+    def check_valid_start_position(cls, content: str, index: int) -> bool:
+        if index <= 0 or content[index] in cls.allowed_before_punctuation:
             return True
         return False
 
-    def check_valid_end_position(self, content: str, index: int) -> bool:
-        if index >= len(content) or content[index] in self.allowed_after_punctuation:
+    @classmethod
+    def check_valid_end_position(cls, content: str, index: int) -> bool:
+        if index >= len(content) or content[index] in cls.allowed_after_punctuation:
             return True
         return False
 
+    @classmethod
+    def find_user_ids_with_alert_words(
+        cls, realm_alert_words_automaton: ahocorasick.Automaton | None, content: str
+    ) -> set[int]:
+        user_ids_with_alert_words: set[int] = set()
+        if realm_alert_words_automaton is not None:
+            for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(content):
+                if cls.check_valid_start_position(
+                    content, end_index - len(original_value)
+                ) and cls.check_valid_end_position(content, end_index + 1):
+                    user_ids_with_alert_words.update(user_ids)
+        return user_ids_with_alert_words
+
     @override
     def run(self, lines: list[str]) -> list[str]:
         db_data: DbData | None = self.zmd.zulip_db_data
@@ -2234,18 +2394,14 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
             # Our caller passes in the list of possible_words.  We
             # don't do any special rendering; we just append the alert words
             # we find to the set self.zmd.zulip_rendering_result.user_ids_with_alert_words.
-
-            realm_alert_words_automaton = db_data.realm_alert_words_automaton
-
-            if realm_alert_words_automaton is not None:
-                content = "\n".join(lines).lower()
-                for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(
-                    content
-                ):
-                    if self.check_valid_start_position(
-                        content, end_index - len(original_value)
-                    ) and self.check_valid_end_position(content, end_index + 1):
-                        self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(user_ids)
+            content = "\n".join(lines).lower()
+            # Saved for the rendered Markdown cache, which checks the
+            # alert words of the users in the realm at the time the
+            # cached content is sent again.
+            self.zmd.zulip_alert_word_content = content
+            self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(
+                self.find_user_ids_with_alert_words(db_data.realm_alert_words_automaton, content)
+            )
         return lines
 
 
@@ -2397,6 +2553,7 @@ class ZulipMarkdown(markdown.Markdown):
     image_preview_enabled: bool
     url_embed_preview_enabled: bool
     url_embed_data: dict[str, UrlEmbedData | None] | None
+    zulip_alert_word_content: str | None
 
     def __init__(
         self,
@@ -2511,7 +2668,6 @@ class ZulipMarkdown(markdown.Markdown):
         EMPHASIS_RE = r"(\*)(?!\s+)([^\*^\n]+)(?<!\s)\*"
         STRONG_RE = r"(\*\*)([^\n]+?)\2"
         STRONG_EM_RE = r"(\*\*\*)(?!\s+)([^\*^\n]+)(?<!\s)\*\*\*"
-        TEX_RE = r"\B(?<!\$)\$\$(?P<body>[^\n_$](\\\$|[^$\n])*)\$\$(?!\$)\B"
         TIMESTAMP_RE = r"<time:(?P<time>[^>]*?)>"
 
         # Add inline patterns.  We use a custom numbering of the
@@ -2564,15 +2720,28 @@ class ZulipMarkdown(markdown.Markdown):
     def register_linkifiers(
         self, registry: markdown.util.Registry[markdown.inlinepatterns.Pattern]
     ) -> markdown.util.Registry[markdown.inlinepatterns.Pattern]:
-        for linkifier in self.linkifiers:
-            pattern = linkifier["pattern"]
+        matcher = linkifier_matcher_for(self.linkifiers)
+        for index, linkifier in enumerate(self.linkifiers):
+            if matcher.patterns[index] is None:
+                continue
             registry.register(
-                LinkifierPattern(pattern, linkifier["url_template"], self),
-                f"linkifiers/{pattern}",
+                LinkifierPattern(matcher, index, self),
+                f"linkifiers/{linkifier['pattern']}",
                 45,
             )
         return registry
 
+    def replace_linkifiers(self, linkifiers: list[LinkifierDict], linkifiers_key: int) -> None:
+        # Swap out just the linkifier layer of the inline patterns,
+        # keeping every other processor.  The "inline" treeprocessor
+        # holds a reference to this same registry, so it sees the
+        # change.
+        for linkifier in self.linkifiers:
+            self.inlinePatterns.deregister(f"linkifiers/{linkifier['pattern']}", strict=False)
+        self.linkifiers = linkifiers
+        self.linkifiers_key = linkifiers_key
+        self.register_linkifiers(self.inlinePatterns)
+
     def build_treeprocessors(self) -> markdown.util.Registry[markdown.treeprocessors.Treeprocessor]:
         # Here we build all the processors from upstream, plus a few of our own.
         treeprocessors = markdown.util.Registry[markdown.treeprocessors.Treeprocessor]()
@@ -2618,20 +2787,71 @@ class ZulipMarkdown(markdown.Markdown):
             )
 
 
-md_engines: dict[tuple[int, bool], ZulipMarkdown] = {}
-linkifier_data: dict[int, list[LinkifierDict]] = {}
+class MarkdownEnginePool:
+    """A size-bounded pool of ZulipMarkdown engines, keyed by
+    (linkifiers_key, email_gateway), which evicts the least recently
+    used engine when full.
+
+    Only the linkifiers differ between the engines for different
+    realms, so rather than building a new engine from scratch, a miss
+    takes over the evicted engine's processors, if it has the same
+    email_gateway flavor, and rebuilds only its linkifier layer.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.engines: OrderedDict[tuple[int, bool], ZulipMarkdown] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, md_engine_key: tuple[int, bool]) -> bool:
+        return md_engine_key in self.engines
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def get(
+        self, linkifiers_key: int, email_gateway: bool, linkifiers: list[LinkifierDict]
+    ) -> ZulipMarkdown:
+        md_engine_key = (linkifiers_key, email_gateway)
+        engine = self.engines.get(md_engine_key)
+        if engine is not None:
+            self.hits += 1
+            self.engines.move_to_end(md_engine_key)
+            if engine.linkifiers != linkifiers:
+                engine.replace_linkifiers(linkifiers, linkifiers_key)
+            return engine
+
+        self.misses += 1
+        evicted = None
+        if len(self.engines) >= max(self.max_size, 1):
+            _, evicted = self.engines.popitem(last=False)
+            self.evictions += 1
+
+        if (
+            evicted is not None
+            and evicted.email_gateway == email_gateway
+            # The zephyr mirror engine has a different set of
+            # processors entirely, so is never reused.
+            and ZEPHYR_MIRROR_MARKDOWN_KEY not in (evicted.linkifiers_key, linkifiers_key)
+        ):
+            engine = evicted
+            engine.replace_linkifiers(linkifiers, linkifiers_key)
+        else:
+            engine = ZulipMarkdown(
+                linkifiers=linkifiers,
+                linkifiers_key=linkifiers_key,
+                email_gateway=email_gateway,
+            )
+        self.engines[md_engine_key] = engine
+        return engine
 
+    def clear(self) -> None:
+        self.engines.clear()
 
-def make_md_engine(linkifiers_key: int, email_gateway: bool) -> None:
-    md_engine_key = (linkifiers_key, email_gateway)
-    md_engines.pop(md_engine_key, None)
 
-    linkifiers = linkifier_data[linkifiers_key]
-    md_engines[md_engine_key] = ZulipMarkdown(
-        linkifiers=linkifiers,
-        linkifiers_key=linkifiers_key,
-        email_gateway=email_gateway,
-    )
+md_engines = MarkdownEnginePool(settings.MAX_MARKDOWN_ENGINES)
 
 
 # Split the topic name into multiple sections so that we can easily use
@@ -2668,24 +2888,13 @@ class TopicLinkMatch:
 # are validated and escaped inside `url_to_a`).
 def topic_links(linkifiers_key: int, topic_name: str) -> list[dict[str, str]]:
     matches: list[TopicLinkMatch] = []
-    linkifiers = linkifiers_for_realm(linkifiers_key)
-    precedence = 0
+    matcher = linkifier_matcher_for(linkifiers_for_realm(linkifiers_key))
 
-    options = re2.Options()
-    options.log_errors = False
-    for linkifier in linkifiers:
-        raw_pattern = linkifier["pattern"]
-        prepared_url_template = uri_template.URITemplate(linkifier["url_template"])
-        try:
-            pattern = re2.compile(prepare_linkifier_pattern(raw_pattern), options=options)
-        except re2.error:
-            # An invalid regex shouldn't be possible here, and logging
-            # here on an invalid regex would spam the logs with every
-            # message sent; simply move on.
-            continue
+    # The index of each linkifier is its precedence.
+    for precedence in sorted(matcher.candidates(topic_name)):
         pos = 0
         while pos < len(topic_name):
-            m = pattern.search(topic_name, pos)
+            m = matcher.search(precedence, topic_name, pos)
             if m is None:
                 break
 
@@ -2703,13 +2912,12 @@ def topic_links(linkifiers_key: int, topic_name: str) -> list[dict[str, str]]:
             # don't have to implement any logic of their own to get back the text.
             matches += [
                 TopicLinkMatch(
-                    url=prepared_url_template.expand(**match_details),
+                    url=matcher.url_templates[precedence].expand(**match_details),
                     text=match_text,
                     index=m.start(),
                     precedence=precedence,
                 )
             ]
-        precedence += 1
 
     # Sort the matches beforehand so we favor the match with a higher priority and tie-break with the starting index.
     # Note that we sort it before processing the raw URLs so that linkifiers will be prioritized over them.
@@ -2772,20 +2980,11 @@ def topic_links(linkifiers_key: int, topic_name: str) -> list[dict[str, str]]:
     return [{"url": match.url, "text": match.text} for match in applied_matches]
 
 
-def maybe_update_markdown_engines(linkifiers_key: int, email_gateway: bool) -> None:
+def maybe_update_markdown_engines(linkifiers_key: int, email_gateway: bool) -> ZulipMarkdown:
+    # Returns the Markdown engine for this key, creating it or updating
+    # its linkifiers if they have changed.
     linkifiers = linkifiers_for_realm(linkifiers_key)
-    if linkifiers_key not in linkifier_data or linkifier_data[linkifiers_key] != linkifiers:
-        # Linkifier data has changed, update `linkifier_data` and any
-        # of the existing Markdown engines using this set of linkifiers.
-        linkifier_data[linkifiers_key] = linkifiers
-        for email_gateway_flag in [True, False]:
-            if (linkifiers_key, email_gateway_flag) in md_engines:
-                # Update only existing engines(if any), don't create new one.
-                make_md_engine(linkifiers_key, email_gateway_flag)
-
-    if (linkifiers_key, email_gateway) not in md_engines:
-        # Markdown engine corresponding to this key doesn't exists so create one.
-        make_md_engine(linkifiers_key, email_gateway)
+    return md_engines.get(linkifiers_key, email_gateway, linkifiers)
 
 
 # We want to log Markdown parser failures, but shouldn't log the actual input
@@ -2801,6 +3000,50 @@ def privacy_clean_markdown(content: str) -> str:
     return repr(_privacy_re.sub("x", content))
 
 
+RENDERED_MARKDOWN_CACHE_TIMEOUT = 3600 * 24
+
+
+def get_rendered_markdown_cache_key(content: str, md_engine: ZulipMarkdown, db_data: DbData) -> str:
+    """The cache key for the rendering of content, which hashes
+    everything besides the content that the rendering depends on: the
+    realm's URL (and thus host), linkifiers, default code block
+    language and (if used) custom emoji, the users, groups, channels
+    and topics which the content might refer to, and the sender's
+    settings.  So changes to any of those use a new key, rather than
+    needing to flush the cache."""
+    mention_data = db_data.mention_data
+    realm = md_engine.zulip_realm
+    default_code_block_language = None if realm is None else realm.default_code_block_language
+    fingerprint = [
+        version,
+        content,
+        md_engine.linkifiers_key,
+        md_engine.email_gateway,
+        [(linkifier["pattern"], linkifier["url_template"]) for linkifier in md_engine.linkifiers],
+        md_engine.image_preview_enabled,
+        md_engine.url_embed_preview_enabled,
+        db_data.realm_url,
+        default_code_block_language,
+        db_data.sent_by_bot,
+        db_data.translate_emoticons,
+        sorted(db_data.active_realm_emoji.items()),
+        sorted(db_data.stream_names.items()),
+        sorted(
+            (channel_topic.channel_name, channel_topic.topic_name, message_id)
+            for channel_topic, message_id in db_data.topic_info.items()
+        ),
+        sorted(
+            (user.id, user.full_name, user.is_active) for user in mention_data.user_id_info.values()
+        ),
+        sorted(
+            (group.id, str(get_user_group_mention_display_name(group)), group.deactivated)
+            for group in mention_data.user_group_name_info.values()
+        ),
+    ]
+    digest = hashlib.sha256(orjson.dumps(fingerprint)).hexdigest()
+    return f"rendered_markdown:{digest}"
+
+
 def do_convert(
     content: str,
     realm_alert_words_automaton: ahocorasick.Automaton | None = None,
@@ -2841,9 +3084,7 @@ def do_convert(
         # delivered via zephyr_mirror
         linkifiers_key = ZEPHYR_MIRROR_MARKDOWN_KEY
 
-    maybe_update_markdown_engines(linkifiers_key, email_gateway)
-    md_engine_key = (linkifiers_key, email_gateway)
-    _md_engine = md_engines[md_engine_key]
+    _md_engine = maybe_update_markdown_engines(linkifiers_key, email_gateway)
     # Reset the parser; otherwise it will get slower over time.
     _md_engine.reset()
 
@@ -2870,6 +3111,7 @@ def do_convert(
         message, message_realm, no_previews
     )
     _md_engine.url_embed_data = url_embed_data
+    _md_engine.zulip_alert_word_content = None
 
     # Pre-fetch data from the DB that is used in the Markdown thread
     user_upload_previews = None
@@ -2917,7 +3159,45 @@ def do_convert(
             user_upload_previews=user_upload_previews,
         )
 
+    # Bots often send the same content over and over, so we can
+    # optionally cache renderings, for messages whose rendering does
+    # not depend on state besides that hashed in the cache key.  URL
+    # previews and uploaded files' thumbnails depend on the results of
+    # background processing, so are never cached.
+    rendered_markdown_cache_key = None
+    if (
+        settings.CACHE_RENDERED_MARKDOWN
+        and message is not None
+        and _md_engine.zulip_db_data is not None
+        and url_embed_data is None
+        and user_upload_previews is not None
+        and not user_upload_previews.image_metadata
+        and not user_upload_previews.audio_path_ids
+    ):
+        rendered_markdown_cache_key = get_rendered_markdown_cache_key(
+            content, _md_engine, _md_engine.zulip_db_data
+        )
+
     try:
+        if rendered_markdown_cache_key is not None:
+            cached = cache_get(rendered_markdown_cache_key)
+            if cached is not None:
+                assert message is not None
+                cached_rendering_result, has_link, has_image, alert_word_content = cached
+                message.has_link = has_link
+                message.has_image = has_image
+                cached_rendering_result.user_ids_with_alert_words = (
+                    AlertWordNotificationProcessor.find_user_ids_with_alert_words(
+                        realm_alert_words_automaton, alert_word_content
+                    )
+                )
+                return cached_rendering_result
+
+        if linkifiers_key != ZEPHYR_MIRROR_MARKDOWN_KEY:
+            # Render all of the message's TeX in one request to the
+            # KaTeX server, rather than one request per formula.
+            render_tex_batch(possible_tex_spans(content))
+
         # Spend at most 5 seconds rendering; this protects the backend
         # from being overloaded by bugs (e.g. Markdown logic that is
         # extremely inefficient in corner cases) as well as user
@@ -2942,6 +3222,22 @@ def do_convert(
             raise MarkdownRenderingError(
                 f"Rendered content exceeds {MAX_MESSAGE_LENGTH * 100} characters (message {logging_message_id})"
             )
+
+        if (
+            rendered_markdown_cache_key is not None
+            and _md_engine.zulip_alert_word_content is not None
+        ):
+            assert message is not None
+            cache_set(
+                rendered_markdown_cache_key,
+                (
+                    rendering_result,
+                    message.has_link,
+                    message.has_image,
+                    _md_engine.zulip_alert_word_content,
+                ),
+                timeout=RENDERED_MARKDOWN_CACHE_TIMEOUT,
+            )
         return rendering_result
     except Exception:
         cleaned = privacy_clean_markdown(content)
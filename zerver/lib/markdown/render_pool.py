@@ -0,0 +1,155 @@
+import multiprocessing
+import signal
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import islice
+from types import FrameType, TracebackType
+
+import bmemcached
+from django.core.cache import cache
+from django.db import connection
+
+from zerver.lib.markdown import markdown_convert, maybe_update_markdown_engines
+from zerver.lib.timeout import TimeoutExpiredError
+from zerver.models import Realm
+
+
+@dataclass
+class MarkdownRenderRequest:
+    # Returned along with the result, to match it up with its request;
+    # usually the message's ID.
+    key: int
+    content: str
+    realm_id: int
+    sent_by_bot: bool = False
+    translate_emoticons: bool = False
+
+
+@dataclass
+class MarkdownRenderResult:
+    key: int
+    # None if rendering failed or timed out.
+    rendered_content: str | None
+
+
+def raise_timeout(signum: int, frame: FrameType | None) -> None:
+    raise TimeoutExpiredError
+
+
+def render_batch(
+    requests: list[MarkdownRenderRequest], timeout: float | None
+) -> list[MarkdownRenderResult]:
+    realms = {
+        realm.id: realm for realm in Realm.objects.filter(id__in={r.realm_id for r in requests})
+    }
+    results = []
+    for request in requests:
+        if timeout is not None:
+            # We're in the main thread of a worker process, so can
+            # enforce the timeout with an alarm; this bounds the time
+            # spent on the whole message, including fetching the
+            # data for its mentions.
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            rendered_content: str | None = markdown_convert(
+                content=request.content,
+                message_realm=realms[request.realm_id],
+                sent_by_bot=request.sent_by_bot,
+                translate_emoticons=request.translate_emoticons,
+            ).rendered_content
+        except Exception:
+            # markdown_convert logs the details of rendering failures.
+            rendered_content = None
+        finally:
+            if timeout is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        results.append(MarkdownRenderResult(key=request.key, rendered_content=rendered_content))
+    return results
+
+
+def init_render_worker() -> None:
+    signal.signal(signal.SIGALRM, raise_timeout)
+
+
+class MarkdownRenderingPool:
+    """Renders Markdown for bulk operations, like importing or
+    re-rendering many messages, in parallel across a pool of worker
+    processes.
+
+    The worker processes live as long as the pool, so each keeps its
+    Markdown engines warm across batches; the engines for realm_ids
+    are built before the workers are forked, so they start out warm.
+    With processes=1, renders serially in this process instead.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        realm_ids: Iterable[int] = (),
+        batch_size: int = 100,
+        timeout: float = 10,
+    ) -> None:
+        self.processes = processes
+        self.realm_ids = list(realm_ids)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.executor: ProcessPoolExecutor | None = None
+
+    def __enter__(self) -> "MarkdownRenderingPool":
+        for realm_id in self.realm_ids:
+            maybe_update_markdown_engines(realm_id, False)
+        if self.processes > 1:
+            # Don't share the database and memcached connections with
+            # the worker processes; each opens its own.
+            connection.close()
+            _cache = cache._cache  # type: ignore[attr-defined] # not in stubs
+            assert isinstance(_cache, bmemcached.Client)
+            _cache.disconnect_all()
+            # The workers must be forked, to inherit the warm engines.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=init_render_worker,
+            )
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=exc_type is not None)
+            self.executor = None
+
+    def render(self, requests: Iterable[MarkdownRenderRequest]) -> Iterator[MarkdownRenderResult]:
+        """Yields the results of rendering the requests, as they complete,
+        which is not necessarily in the order of the requests.  Only a
+        few batches per worker are in flight at once, so requests can
+        be a generator over more messages than would fit in memory."""
+        request_iter = iter(requests)
+        if self.executor is not None:
+            yield from self.render_in_workers(self.executor, request_iter)
+            return
+
+        while batch := list(islice(request_iter, self.batch_size)):
+            # unsafe_timeout in do_convert still limits the time spent
+            # rendering each message.
+            yield from render_batch(batch, timeout=None)
+
+    def render_in_workers(
+        self, executor: ProcessPoolExecutor, request_iter: Iterator[MarkdownRenderRequest]
+    ) -> Iterator[MarkdownRenderResult]:
+        pending: set[Future[list[MarkdownRenderResult]]] = set()
+        while batch := list(islice(request_iter, self.batch_size)):
+            pending.add(executor.submit(render_batch, batch, self.timeout))
+            if len(pending) >= 2 * self.processes:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
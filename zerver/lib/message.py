@@ -1,4 +1,6 @@
 import re
+import secrets
+from array import array
 from collections.abc import Callable, Collection, Mapping, Sequence
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
@@ -14,12 +16,29 @@ from psycopg2.sql import SQL
 
 from analytics.lib.counts import COUNT_STATS
 from analytics.models import RealmCount
-from zerver.lib.cache import generic_bulk_cached_fetch, to_dict_cache_key_id
+from zerver.lib.cache import (
+    cache_get_many,
+    cache_set,
+    cache_set_many,
+    generic_bulk_cached_fetch,
+    to_dict_cache_key_id,
+    user_unread_snapshot_cache_key,
+    user_unread_snapshot_generation_cache_key,
+)
 from zerver.lib.display_recipient import get_display_recipient, get_display_recipient_by_id
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
 from zerver.lib.markdown import MessageRenderingResult
 from zerver.lib.mention import MentionData, sender_can_mention_group
-from zerver.lib.message_cache import MessageDict, extract_message_dict, stringify_message_dict
+from zerver.lib.message_cache import (
+    MessageDict,
+    cache_message_payloads,
+    extract_message_dict,
+    get_cached_message_payloads,
+    get_message_payload_generations,
+    message_payload_generation_keys,
+    message_payload_variant,
+    stringify_message_dict,
+)
 from zerver.lib.partial import partial
 from zerver.lib.request import RequestVariableConversionError
 from zerver.lib.stream_subscription import (
@@ -283,36 +302,71 @@ def messages_for_ids(
     user_profile: UserProfile | None,
     realm: Realm,
 ) -> list[dict[str, Any]]:
-    id_fetcher = lambda row: row["id"]
-
-    message_dicts = generic_bulk_cached_fetch(
+    # The compressed to_dict blobs; we only decompress those of
+    # messages whose finalized payloads aren't cached.
+    encoded_messages = generic_bulk_cached_fetch(
         to_dict_cache_key_id,
         MessageDict.ids_to_dict,
         message_ids,
-        id_fetcher=id_fetcher,
-        cache_transformer=lambda obj: obj,
-        extractor=extract_message_dict,
-        setter=stringify_message_dict,
+        id_fetcher=lambda row: row["id"],
+        cache_transformer=stringify_message_dict,
+        extractor=lambda obj: obj,
+        setter=lambda obj: obj,
     )
 
-    message_list: list[dict[str, Any]] = []
+    variant = message_payload_variant(
+        apply_markdown=apply_markdown,
+        client_gravatar=client_gravatar,
+        allow_empty_topic_name=allow_empty_topic_name,
+        message_edit_history_visibility_policy=message_edit_history_visibility_policy,
+    )
+    cached_payloads, generation = get_cached_message_payloads(encoded_messages, variant, realm.id)
+    user_recipient_id = None if user_profile is None else user_profile.recipient_id
+    message_dicts = {
+        message_id: extract_message_dict(encoded_messages[message_id])
+        for message_id in message_ids
+        if message_id not in cached_payloads
+    }
+
+    # Payloads are invalidated by changes to their sender and
+    # recipient, rather than to anyone in the realm.  We fetch the
+    # current generations before building any payloads, so that
+    # changes made while we build them invalidate them.
+    message_generations = get_message_payload_generations(
+        key
+        for message in [
+            *(payload for _, payload in cached_payloads.values()),
+            *message_dicts.values(),
+        ]
+        for key in message_payload_generation_keys(message)
+    )
+    payloads: dict[int, dict[str, Any]] = {}
+    for message_id, (payload_generations, payload) in cached_payloads.items():
+        if payload_generations == tuple(
+            message_generations[key] for key in message_payload_generation_keys(payload)
+        ):
+            payloads[message_id] = payload
+        else:
+            message_dicts[message_id] = extract_message_dict(encoded_messages[message_id])
 
-    sender_ids = [message_dicts[message_id]["sender_id"] for message_id in message_ids]
+    sender_ids = [payload["sender_id"] for payload in payloads.values()]
+    sender_ids += [msg_dict["sender_id"] for msg_dict in message_dicts.values()]
     inaccessible_sender_ids = get_inaccessible_user_ids(sender_ids, user_profile)
 
-    for message_id in message_ids:
-        msg_dict = message_dicts[message_id]
-        flags = user_message_flags[message_id]
-        # TODO/compatibility: The `wildcard_mentioned` flag was deprecated in favor of
-        # the `stream_wildcard_mentioned` and `topic_wildcard_mentioned` flags.  The
-        # `wildcard_mentioned` flag exists for backwards-compatibility with older
-        # clients.  Remove this when we no longer support legacy clients that have not
-        # been updated to access `stream_wildcard_mentioned`.
-        if "stream_wildcard_mentioned" in flags or "topic_wildcard_mentioned" in flags:
-            flags.append("wildcard_mentioned")
-        msg_dict.update(flags=flags)
-        if message_id in search_fields:
-            msg_dict.update(search_fields[message_id])
+    for message_id, payload in list(payloads.items()):
+        # The cached payloads are those for users who can access the
+        # sender, and who didn't receive the message as an incoming
+        # 1:1 direct message, for which finalize_payload substitutes
+        # the sender's recipient_id; other users' payloads are built
+        # afresh, below.
+        if payload["sender_id"] in inaccessible_sender_ids or (
+            payload["type"] == "private" and payload["recipient_id"] == user_recipient_id
+        ):
+            del payloads[message_id]
+            message_dicts[message_id] = extract_message_dict(encoded_messages[message_id])
+
+    message_list: list[dict[str, Any]] = []
+    for message_id, msg_dict in message_dicts.items():
         if "edit_history" in msg_dict:
             # In addition to computing last_moved_timestamp, we recompute
             # last_edit_timestamp, because the logic powering the database
@@ -351,14 +405,49 @@ def messages_for_ids(
         msg_dict["can_access_sender"] = msg_dict["sender_id"] not in inaccessible_sender_ids
         message_list.append(msg_dict)
 
+    unchanged_recipient_ids = {
+        msg_dict["id"]: msg_dict["recipient_id"]
+        for msg_dict in message_list
+        if msg_dict["can_access_sender"]
+    }
     MessageDict.post_process_dicts(
         message_list,
         apply_markdown=apply_markdown,
         client_gravatar=client_gravatar,
         allow_empty_topic_name=allow_empty_topic_name,
         realm=realm,
-        user_recipient_id=None if user_profile is None else user_profile.recipient_id,
+        user_recipient_id=user_recipient_id,
+    )
+    cache_message_payloads(
+        {
+            msg_dict["id"]: msg_dict
+            for msg_dict in message_list
+            if unchanged_recipient_ids.get(msg_dict["id"]) == msg_dict["recipient_id"]
+        },
+        encoded_messages,
+        variant,
+        generation,
+        message_generations,
     )
+    payloads.update(message_dicts)
+
+    # Finally, merge in the fields specific to the user fetching the
+    # messages.
+    message_list = []
+    for message_id in message_ids:
+        msg_dict = payloads[message_id]
+        flags = user_message_flags[message_id]
+        # TODO/compatibility: The `wildcard_mentioned` flag was deprecated in favor of
+        # the `stream_wildcard_mentioned` and `topic_wildcard_mentioned` flags.  The
+        # `wildcard_mentioned` flag exists for backwards-compatibility with older
+        # clients.  Remove this when we no longer support legacy clients that have not
+        # been updated to access `stream_wildcard_mentioned`.
+        if "stream_wildcard_mentioned" in flags or "topic_wildcard_mentioned" in flags:
+            flags.append("wildcard_mentioned")
+        msg_dict.update(flags=flags)
+        if message_id in search_fields:
+            msg_dict.update(search_fields[message_id])
+        message_list.append(msg_dict)
 
     return message_list
 
@@ -828,11 +917,14 @@ def get_starred_message_ids(user_profile: UserProfile) -> list[int]:
     )
 
 
-def get_raw_unread_data(
-    user_profile: UserProfile, message_ids: list[int] | None = None
-) -> RawUnreadMessagesResult:
-    excluded_recipient_ids = get_inactive_recipient_ids(user_profile)
-    first_visible_message_id = get_first_visible_message_id(user_profile.realm)
+def fetch_unread_rows(
+    user_profile: UserProfile,
+    excluded_recipient_ids: list[int],
+    first_visible_message_id: int,
+    *,
+    message_ids: list[int] | None = None,
+    after_message_id: int = 0,
+) -> list[dict[str, Any]]:
     user_msgs = (
         UserMessage.objects.filter(
             user_profile=user_profile,
@@ -862,8 +954,9 @@ def get_raw_unread_data(
         # those ids, and we know they're unread.
         user_msgs = user_msgs.filter(message_id__in=message_ids)
     else:
-        # At page load we need all unread messages.
-        user_msgs = user_msgs.extra(  # noqa: S610
+        # At page load we need all unread messages, or those newer
+        # than the user's cached unread snapshot.
+        user_msgs = user_msgs.filter(message_id__gt=after_message_id).extra(  # noqa: S610
             where=[UserMessage.where_unread()],
         )
 
@@ -911,10 +1004,198 @@ def get_raw_unread_data(
                 .order_by("message_id")
             )
 
-            rows = list(user_msgs)
+            return list(user_msgs)
         finally:
             cursor.execute("SET enable_bitmapscan TO on")
-        return extract_unread_data_from_um_rows(rows, user_profile)
+
+
+# A bound on how long a transaction sending messages may take between
+# allocating their IDs and committing.  A message ID seen at page load
+# is only included in the user's unread snapshot at a page load at
+# least this much later, by which time every message with a lower ID
+# has committed.  do_send_messages flushes the snapshots of the
+# recipients of a send which comes close to this bound.
+UNREAD_SNAPSHOT_SEND_DELAY = timedelta(minutes=1)
+
+
+@dataclass
+class UnreadSnapshot:
+    """The rows of a user's unread messages with IDs up to
+    complete_through_id, stored as arrays so that it can be cached for
+    users with tens of thousands of unread messages.  Topics are
+    indexes into topic_names, and the types of the messages' recipients
+    are in recipient_types.
+
+    pending_through_id is the latest unread message ID seen at
+    pending_since; once UNREAD_SNAPSHOT_SEND_DELAY has passed, it
+    becomes complete_through_id.  The snapshot is only valid while
+    generation matches the user's current generation, which
+    flush_user_unread_snapshots changes.
+
+    Whether a message is muted for the user, and whether it's older
+    than the realm's first visible message, are not part of the
+    snapshot; they're applied when reading it.
+    """
+
+    generation: str
+    complete_through_id: int
+    pending_through_id: int
+    pending_since: datetime
+    message_ids: "array[int]"
+    sender_ids: "array[int]"
+    recipient_ids: "array[int]"
+    flags: "array[int]"
+    topic_indexes: "array[int]"
+    topic_names: list[str]
+    recipient_types: dict[int, tuple[int, int]]
+
+
+def make_unread_snapshot(
+    generation: str,
+    complete_through_id: int,
+    pending_through_id: int,
+    pending_since: datetime,
+    rows: list[dict[str, Any]],
+) -> UnreadSnapshot:
+    snapshot = UnreadSnapshot(
+        generation=generation,
+        complete_through_id=complete_through_id,
+        pending_through_id=pending_through_id,
+        pending_since=pending_since,
+        message_ids=array("q"),
+        sender_ids=array("i"),
+        recipient_ids=array("i"),
+        flags=array("q"),
+        topic_indexes=array("i"),
+        topic_names=[],
+        recipient_types={},
+    )
+    topic_indexes: dict[str, int] = {}
+    for row in rows:
+        if row["message_id"] > complete_through_id:
+            continue
+        topic_index = topic_indexes.get(row["topic"])
+        if topic_index is None:
+            topic_index = topic_indexes[row["topic"]] = len(snapshot.topic_names)
+            snapshot.topic_names.append(row["topic"])
+        snapshot.message_ids.append(row["message_id"])
+        snapshot.sender_ids.append(row["sender_id"])
+        snapshot.recipient_ids.append(row["recipient_id"])
+        snapshot.flags.append(row["flags"])
+        snapshot.topic_indexes.append(topic_index)
+        snapshot.recipient_types[row["recipient_id"]] = (
+            row["recipient__type"],
+            row["recipient__type_id"],
+        )
+    return snapshot
+
+
+def get_unread_snapshot_rows(snapshot: UnreadSnapshot) -> list[dict[str, Any]]:
+    return [
+        dict(
+            message_id=message_id,
+            sender_id=sender_id,
+            topic=snapshot.topic_names[topic_index],
+            flags=flags,
+            recipient_id=recipient_id,
+            recipient__type=snapshot.recipient_types[recipient_id][0],
+            recipient__type_id=snapshot.recipient_types[recipient_id][1],
+        )
+        for message_id, sender_id, recipient_id, flags, topic_index in zip(
+            snapshot.message_ids,
+            snapshot.sender_ids,
+            snapshot.recipient_ids,
+            snapshot.flags,
+            snapshot.topic_indexes,
+            strict=True,
+        )
+    ]
+
+
+def get_unread_rows_with_snapshot(
+    user_profile: UserProfile, excluded_recipient_ids: list[int], first_visible_message_id: int
+) -> list[dict[str, Any]]:
+    """Returns the rows of the user's unread messages, as
+    fetch_unread_rows does, using the user's cached unread snapshot.
+
+    Only the unread messages newer than the snapshot are fetched from
+    the database, which is cheap using the
+    zerver_usermessage_unread_message_id index; so at page load, we
+    join to Message only the user's few recent unread messages, rather
+    than all of them.  The snapshot is flushed when the user's unread
+    messages change in any other way -- when messages are marked as
+    read or unread, their mention flags change, they are moved or
+    deleted, or the user gains UserMessage rows for older messages.
+    Unsubscribing is handled by filtering the rows when reading them.
+    """
+    cache_key = user_unread_snapshot_cache_key(user_profile.id)
+    generation_key = user_unread_snapshot_generation_cache_key(user_profile.id)
+    cached = cache_get_many([cache_key, generation_key])
+    generation = cached.get(generation_key)
+    if generation is None:
+        # This must be stored before we query the database, so that a
+        # flush which commits after our query replaces it.
+        generation = secrets.token_hex(8)
+        cache_set_many({generation_key: generation}, timeout=3600 * 24 * 7)
+
+    snapshot = None
+    if cache_key in cached and cached[cache_key][0].generation == generation:
+        snapshot = cached[cache_key][0]
+
+    rows: list[dict[str, Any]] = []
+    complete_through_id = 0
+    if snapshot is not None:
+        complete_through_id = snapshot.complete_through_id
+        rows = get_unread_snapshot_rows(snapshot)
+    # The snapshot includes messages older than the realm's first
+    # visible message, since that can change without flushing it.
+    rows += fetch_unread_rows(
+        user_profile, excluded_recipient_ids, 0, after_message_id=complete_through_id
+    )
+
+    # We don't cache snapshots for users with MAX_UNREAD_MESSAGES or
+    # more unread messages.
+    if len(rows) < MAX_UNREAD_MESSAGES:
+        now = timezone_now()
+        latest_message_id = max([complete_through_id] + [row["message_id"] for row in rows])
+        if snapshot is None:
+            # A new snapshot includes no messages until a later page
+            # load, once the IDs we've seen are known to be complete.
+            snapshot = make_unread_snapshot(generation, 0, latest_message_id, now, rows)
+            cache_set(cache_key, snapshot, timeout=3600 * 24)
+        elif now - snapshot.pending_since >= UNREAD_SNAPSHOT_SEND_DELAY:
+            snapshot = make_unread_snapshot(
+                generation, snapshot.pending_through_id, latest_message_id, now, rows
+            )
+            cache_set(cache_key, snapshot, timeout=3600 * 24)
+
+    excluded = set(excluded_recipient_ids)
+    rows = [
+        row
+        for row in rows
+        if row["recipient_id"] not in excluded and row["message_id"] >= first_visible_message_id
+    ]
+    # Like fetch_unread_rows, we return the latest unread messages.
+    return rows[-MAX_UNREAD_MESSAGES:]
+
+
+def get_raw_unread_data(
+    user_profile: UserProfile, message_ids: list[int] | None = None
+) -> RawUnreadMessagesResult:
+    excluded_recipient_ids = get_inactive_recipient_ids(user_profile)
+    first_visible_message_id = get_first_visible_message_id(user_profile.realm)
+    if message_ids is None:
+        rows = get_unread_rows_with_snapshot(
+            user_profile, excluded_recipient_ids, first_visible_message_id
+        )
+    else:
+        rows = fetch_unread_rows(
+            user_profile,
+            excluded_recipient_ids,
+            first_visible_message_id,
+            message_ids=message_ids,
+        )
+    return extract_unread_data_from_um_rows(rows, user_profile)
 
 
 def extract_unread_data_from_um_rows(
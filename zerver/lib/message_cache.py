@@ -1,4 +1,5 @@
 import copy
+import secrets
 import zlib
 from collections.abc import Iterable
 from datetime import datetime
@@ -8,7 +9,19 @@ from typing import Any, TypedDict
 import orjson
 
 from zerver.lib.avatar import get_avatar_field, get_avatar_for_inaccessible_user
-from zerver.lib.cache import cache_set_many, cache_with_key, to_dict_cache_key, to_dict_cache_key_id
+from zerver.lib.cache import (
+    cache_set,
+    cache_set_many,
+    cache_with_key,
+    message_payload_cache_key,
+    message_payload_generation_cache_key,
+    message_payload_recipient_generation_cache_key,
+    message_payload_user_generation_cache_key,
+    safe_cache_get_many,
+    safe_cache_set_many,
+    to_dict_cache_key,
+    to_dict_cache_key_id,
+)
 from zerver.lib.display_recipient import bulk_fetch_display_recipients
 from zerver.lib.markdown import render_message_markdown, topic_links
 from zerver.lib.markdown import version as markdown_version
@@ -93,6 +106,112 @@ def update_message_cache(
     return message_ids
 
 
+def message_payload_variant(
+    *,
+    apply_markdown: bool,
+    client_gravatar: bool,
+    allow_empty_topic_name: bool,
+    message_edit_history_visibility_policy: int,
+) -> str:
+    return (
+        f"{int(apply_markdown)}{int(client_gravatar)}{int(allow_empty_topic_name)}"
+        f"{message_edit_history_visibility_policy}"
+    )
+
+
+def message_payload_generation_keys(message: dict[str, Any]) -> tuple[str, str]:
+    return (
+        message_payload_user_generation_cache_key(message["sender_id"]),
+        message_payload_recipient_generation_cache_key(message["recipient_id"]),
+    )
+
+
+def get_message_payload_generations(keys: Iterable[str]) -> dict[str, str]:
+    """Returns the current generations of the payloads of the given
+    senders' and recipients' messages, starting a generation for
+    those which don't have one."""
+    keys = set(keys)
+    if not keys:
+        return {}
+    cached = safe_cache_get_many(list(keys))
+    generations = {key: cached[key][0] for key in cached}
+    new_generations = {key: secrets.token_hex(8) for key in keys if key not in cached}
+    if new_generations:
+        safe_cache_set_many({key: (generation,) for key, generation in new_generations.items()})
+    return {**generations, **new_generations}
+
+
+def get_cached_message_payloads(
+    encoded_messages: dict[int, bytes], variant: str, realm_id: int
+) -> tuple[dict[int, tuple[tuple[str, str], dict[str, Any]]], str]:
+    """Returns the cached API payloads of the messages, as finalized by
+    messages_for_ids but without the fields specific to the user
+    fetching them, and the realm's current payload generation, for
+    cache_message_payloads.
+
+    A payload is only returned if it was built from the current
+    to_dict blob of the message, so every code path which updates or
+    flushes a message's to_dict cache also invalidates its payloads.
+    The payloads also include the names and avatars of the message's
+    sender and recipients, so each is returned with the generations
+    of its sender's and recipient's payloads it was built in; the
+    caller must check that those are current, using
+    get_message_payload_generations.  Renaming a user or stream starts
+    new generations for its messages; see flush_user_message_payloads.
+    Changing the realm's subdomain, which every payload includes,
+    starts a new generation of all of the realm's payloads.
+    """
+    generation_key = message_payload_generation_cache_key(realm_id)
+    keys = {
+        message_id: message_payload_cache_key(message_id, variant)
+        for message_id in encoded_messages
+    }
+    cached = safe_cache_get_many([generation_key, *keys.values()])
+    if generation_key in cached:
+        generation = cached[generation_key][0]
+    else:
+        generation = secrets.token_hex(8)
+        cache_set(generation_key, generation)
+
+    payloads = {}
+    for message_id, key in keys.items():
+        if key not in cached:
+            continue
+        payload_generation, checksum, message_generations, payload = cached[key][0]
+        if payload_generation == generation and checksum == zlib.crc32(
+            encoded_messages[message_id]
+        ):
+            payloads[message_id] = (message_generations, extract_message_dict(payload))
+    return payloads, generation
+
+
+def cache_message_payloads(
+    payloads: dict[int, dict[str, Any]],
+    encoded_messages: dict[int, bytes],
+    variant: str,
+    generation: str,
+    message_generations: dict[str, str],
+) -> None:
+    if not payloads:
+        return
+    safe_cache_set_many(
+        {
+            message_payload_cache_key(message_id, variant): (
+                (
+                    generation,
+                    zlib.crc32(encoded_messages[message_id]),
+                    tuple(
+                        message_generations[key] for key in message_payload_generation_keys(payload)
+                    ),
+                    stringify_message_dict(payload),
+                ),
+            )
+            for message_id, payload in payloads.items()
+        },
+        timeout=3600 * 24,
+    )
+
+
 def save_message_rendered_content(message: Message, content: str) -> str:
     rendering_result = render_message_markdown(message, content, realm=message.get_realm())
     rendered_content = None
@@ -1,15 +1,27 @@
 import time
+from array import array
 from collections import defaultdict
-from collections.abc import Mapping, Sequence
+from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from itertools import chain
 from typing import Any
 
 from django.conf import settings
 from django.utils.timezone import now as timezone_now
 
+from zerver.lib.cache import (
+    REALM_PRESENCE_DELTA_SLOTS,
+    cache_get,
+    cache_get_many,
+    cache_set,
+    realm_presence_delta_cache_key,
+    realm_presence_snapshot_cache_key,
+)
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.users import check_user_can_access_all_users, get_accessible_user_ids
 from zerver.models import Realm, UserPresence, UserProfile
+from zerver.models.presence import PresenceSequence
 
 
 def get_presence_dicts_for_rows(
@@ -147,6 +159,228 @@ def get_presence_for_user(
     return get_presence_dicts_for_rows(presence_rows, slim_presence)
 
 
+# The original behavior for the presence API was to return the last
+# two weeks of data at most; that's also the period which realm
+# presence snapshots cover.
+PRESENCE_HISTORY_DAYS = 14
+
+# A realm's presence snapshot is never updated in place; it's rebuilt
+# once it expires, and between rebuilds, fetches add the deltas
+# written since it was built.
+PRESENCE_SNAPSHOT_REBUILD_SECONDS = 600
+PRESENCE_DELTA_CACHE_SECONDS = 3600
+
+
+@dataclass
+class RealmPresenceSnapshot:
+    """The presence data of the active human users in a realm who have
+    connected in the last PRESENCE_HISTORY_DAYS days, as of
+    last_update_id, stored as arrays so that it can be cached for realms
+    with tens of thousands of users.  The timestamps are those sent by
+    the modern presence API, with date_joined for missing values.
+    """
+
+    last_update_id: int
+    user_ids: "array[int]"
+    active_timestamps: "array[int]"
+    idle_timestamps: "array[int]"
+    last_update_ids: "array[int]"
+
+
+def make_realm_presence_snapshot(
+    last_update_id: int, entries: Mapping[int, tuple[int, int, int]]
+) -> RealmPresenceSnapshot:
+    snapshot = RealmPresenceSnapshot(
+        last_update_id=last_update_id,
+        user_ids=array("i"),
+        active_timestamps=array("q"),
+        idle_timestamps=array("q"),
+        last_update_ids=array("q"),
+    )
+    for user_id, (active_timestamp, idle_timestamp, row_last_update_id) in entries.items():
+        snapshot.user_ids.append(user_id)
+        snapshot.active_timestamps.append(active_timestamp)
+        snapshot.idle_timestamps.append(idle_timestamp)
+        snapshot.last_update_ids.append(row_last_update_id)
+        snapshot.last_update_id = max(snapshot.last_update_id, row_last_update_id)
+    return snapshot
+
+
+def fetch_realm_presence_entries(
+    realm_id: int, since: datetime, last_update_id: int | None = None
+) -> dict[int, tuple[int, int, int]]:
+    query = UserPresence.objects.filter(
+        realm_id=realm_id,
+        user_profile__is_active=True,
+        user_profile__is_bot=False,
+        last_connected_time__gte=since,
+    )
+    if last_update_id is not None:
+        query = query.filter(last_update_id__gt=last_update_id)
+
+    rows = query.values_list(
+        "user_profile_id",
+        "last_active_time",
+        "last_connected_time",
+        "user_profile__date_joined",
+        "last_update_id",
+    )
+    entries = {}
+    for user_id, last_active_time, last_connected_time, date_joined, row_last_update_id in rows:
+        entries[user_id] = (
+            datetime_to_timestamp(
+                user_presence_datetime_with_date_joined_default(last_active_time, date_joined)
+            ),
+            datetime_to_timestamp(last_connected_time),
+            row_last_update_id,
+        )
+    return entries
+
+
+def get_realm_presence_last_update_id(realm_id: int) -> int:
+    return PresenceSequence.objects.values_list("last_update_id", flat=True).get(realm_id=realm_id)
+
+
+def cache_realm_presence_delta(
+    realm_id: int, last_update_id: int, entries: Mapping[int, tuple[int, int]]
+) -> None:
+    """Records the active and idle timestamps which the presence update
+    with the given last_update_id wrote, for the active human users it
+    updated, in the realm's ring buffer of presence deltas.  Called
+    once the update's transaction has committed."""
+    cache_set(
+        realm_presence_delta_cache_key(realm_id, last_update_id),
+        (last_update_id, dict(entries)),
+        timeout=PRESENCE_DELTA_CACHE_SECONDS,
+    )
+
+
+def get_realm_presence_deltas(
+    realm_id: int, last_update_id: int, max_last_update_id: int
+) -> dict[int, tuple[int, int, int]] | None:
+    """Returns the presence of the users updated after last_update_id,
+    up to max_last_update_id, from the realm's ring buffer of presence
+    deltas; later updates replace earlier ones.  Returns None if the
+    buffer is missing any of those updates, because they have been
+    overwritten or evicted, or their delta hasn't been written yet.
+    """
+    if max_last_update_id - last_update_id > REALM_PRESENCE_DELTA_SLOTS:
+        return None
+    update_ids = range(last_update_id + 1, max_last_update_id + 1)
+    cache_keys = [realm_presence_delta_cache_key(realm_id, update_id) for update_id in update_ids]
+    cached = cache_get_many(cache_keys)
+    entries: dict[int, tuple[int, int, int]] = {}
+    for update_id, cache_key in zip(update_ids, cache_keys, strict=True):
+        if cache_key not in cached:
+            return None
+        delta_last_update_id, delta_entries = cached[cache_key][0]
+        if delta_last_update_id != update_id:
+            return None
+        for user_id, (active_timestamp, idle_timestamp) in delta_entries.items():
+            entries[user_id] = (active_timestamp, idle_timestamp, update_id)
+    return entries
+
+
+def get_cached_realm_presence_snapshot(realm_id: int) -> RealmPresenceSnapshot | None:
+    cached = cache_get(realm_presence_snapshot_cache_key(realm_id))
+    if cached is None:
+        return None
+    return cached[0]
+
+
+def build_realm_presence_snapshot(realm_id: int) -> RealmPresenceSnapshot:
+    """Builds and caches the realm's presence snapshot, which is then
+    served until it expires.
+
+    The snapshot is never rewritten; callers bring it up to date with
+    the updates since its last_update_id.  PresenceSequence hands out
+    last_update_id values while holding a row lock until the updating
+    transaction commits, so updates become visible in last_update_id
+    order, and no update older than the snapshot's last_update_id can
+    appear later.
+
+    The snapshot is flushed when a user is deactivated; see
+    flush_user_profile.
+    """
+    since = timezone_now() - timedelta(days=PRESENCE_HISTORY_DAYS)
+    snapshot = make_realm_presence_snapshot(0, fetch_realm_presence_entries(realm_id, since))
+    cache_set(
+        realm_presence_snapshot_cache_key(realm_id),
+        snapshot,
+        timeout=PRESENCE_SNAPSHOT_REBUILD_SECONDS,
+    )
+    return snapshot
+
+
+def get_realm_presence_updates(
+    realm_id: int, last_update_id: int
+) -> dict[int, tuple[int, int, int]]:
+    """Returns the presence of the users updated after last_update_id,
+    from the realm's delta buffer if it has all of those updates, and
+    otherwise from the database."""
+    max_last_update_id = get_realm_presence_last_update_id(realm_id)
+    if max_last_update_id <= last_update_id:
+        return {}
+    updates = get_realm_presence_deltas(realm_id, last_update_id, max_last_update_id)
+    if updates is None:
+        since = timezone_now() - timedelta(days=PRESENCE_HISTORY_DAYS)
+        updates = fetch_realm_presence_entries(realm_id, since, last_update_id)
+    return updates
+
+
+def get_presence_dict_from_snapshot(
+    realm: Realm,
+    last_update_id_fetched_by_client: int | None,
+    fetch_since_datetime: datetime,
+    accessible_user_ids: set[int] | None,
+) -> tuple[dict[str, dict[str, Any]], int]:
+    entries: Iterable[tuple[int, tuple[int, int, int]]]
+    since_timestamp = -1
+    if last_update_id_fetched_by_client is not None and last_update_id_fetched_by_client > 0:
+        # Clients which have fetched presence before only need the
+        # updates since, which are usually all in the delta buffer.
+        entries = get_realm_presence_updates(realm.id, last_update_id_fetched_by_client).items()
+    else:
+        since_timestamp = datetime_to_timestamp(fetch_since_datetime)
+        snapshot = get_cached_realm_presence_snapshot(realm.id)
+        updates: dict[int, tuple[int, int, int]] = {}
+        if snapshot is None:
+            # A freshly built snapshot is already up to date.
+            snapshot = build_realm_presence_snapshot(realm.id)
+        else:
+            updates = get_realm_presence_updates(realm.id, snapshot.last_update_id)
+        snapshot_entries = (
+            (user_id, (active_timestamp, idle_timestamp, row_last_update_id))
+            for user_id, active_timestamp, idle_timestamp, row_last_update_id in zip(
+                snapshot.user_ids,
+                snapshot.active_timestamps,
+                snapshot.idle_timestamps,
+                snapshot.last_update_ids,
+                strict=True,
+            )
+            if user_id not in updates
+        )
+        entries = chain(snapshot_entries, updates.items())
+
+    user_statuses: dict[str, dict[str, Any]] = {}
+    last_update_id_fetched_by_server = -1
+    for user_id, (active_timestamp, idle_timestamp, row_last_update_id) in entries:
+        if idle_timestamp < since_timestamp:
+            continue
+        if accessible_user_ids is not None and user_id not in accessible_user_ids:
+            continue
+        user_statuses[str(user_id)] = dict(
+            active_timestamp=active_timestamp, idle_timestamp=idle_timestamp
+        )
+        last_update_id_fetched_by_server = max(last_update_id_fetched_by_server, row_last_update_id)
+
+    if not user_statuses and last_update_id_fetched_by_client is not None:
+        # As in get_presence_dict_by_realm, there are no new updates
+        # since what the client has last seen.
+        last_update_id_fetched_by_server = last_update_id_fetched_by_client
+    return user_statuses, last_update_id_fetched_by_server
+
+
 def get_presence_dict_by_realm(
     realm: Realm,
     slim_presence: bool = False,
@@ -161,7 +395,26 @@ def get_presence_dict_by_realm(
         # The original behavior for this API was to return last two weeks
         # of data at most, so we preserve that when the history_limit_days
         # param is not provided.
-        fetch_since_datetime = now - timedelta(days=14)
+        fetch_since_datetime = now - timedelta(days=PRESENCE_HISTORY_DAYS)
+
+    accessible_user_ids: set[int] | None = None
+    if settings.CAN_ACCESS_ALL_USERS_GROUP_LIMITS_PRESENCE and not check_user_can_access_all_users(
+        requesting_user_profile
+    ):
+        assert requesting_user_profile is not None
+        accessible_user_ids = set(get_accessible_user_ids(realm, requesting_user_profile))
+
+    if (
+        slim_presence
+        and history_limit_days != 0
+        and (history_limit_days is None or history_limit_days <= PRESENCE_HISTORY_DAYS)
+    ):
+        # Modern clients, which poll presence most often, are served
+        # from the realm's cached presence snapshot.  The legacy format
+        # includes users' emails, so isn't worth caching.
+        return get_presence_dict_from_snapshot(
+            realm, last_update_id_fetched_by_client, fetch_since_datetime, accessible_user_ids
+        )
 
     kwargs: dict[str, object] = dict()
     if last_update_id_fetched_by_client is not None:
@@ -187,11 +440,7 @@ def get_presence_dict_by_realm(
         # during the execution of this function.
         query = UserPresence.objects.none()
 
-    if settings.CAN_ACCESS_ALL_USERS_GROUP_LIMITS_PRESENCE and not check_user_can_access_all_users(
-        requesting_user_profile
-    ):
-        assert requesting_user_profile is not None
-        accessible_user_ids = get_accessible_user_ids(realm, requesting_user_profile)
+    if accessible_user_ids is not None:
         query = query.filter(user_profile_id__in=accessible_user_ids)
 
     presence_rows = list(
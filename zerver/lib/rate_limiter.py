@@ -36,16 +36,16 @@ class RateLimitedObject(ABC):
         else:
             self.backend = RedisRateLimiterBackend
 
-    def rate_limit(self) -> tuple[bool, float]:
+    def rate_limit(self, calls: int = 1) -> tuple[bool, float]:
         # Returns (ratelimited, secs_to_freedom)
         return self.backend.rate_limit_entity(
-            self.key(), self.get_rules(), self.max_api_calls(), self.max_api_window()
+            self.key(), self.get_rules(), self.max_api_calls(), self.max_api_window(), calls
         )
 
-    def rate_limit_request(self, request: HttpRequest) -> None:
+    def rate_limit_request(self, request: HttpRequest, calls: int = 1) -> None:
         from zerver.lib.request import RequestNotes
 
-        ratelimited, time = self.rate_limit()
+        ratelimited, time = self.rate_limit(calls)
         request_notes = RequestNotes.get_notes(request)
 
         request_notes.ratelimits_applied.append(
@@ -197,9 +197,15 @@ class RateLimiterBackend(ABC):
     @classmethod
     @abstractmethod
     def rate_limit_entity(
-        cls, entity_key: str, rules: list[tuple[int, int]], max_api_calls: int, max_api_window: int
+        cls,
+        entity_key: str,
+        rules: list[tuple[int, int]],
+        max_api_calls: int,
+        max_api_window: int,
+        calls: int = 1,
     ) -> tuple[bool, float]:
-        # Returns (ratelimited, secs_to_freedom)
+        # Returns (ratelimited, secs_to_freedom), charging the entity
+        # for the given number of API calls if it isn't ratelimited.
         pass
 
 
@@ -236,7 +242,9 @@ class TornadoInMemoryRateLimiterBackend(RateLimiterBackend):
             del cls.reset_times[(time_window, max_count)]
 
     @classmethod
-    def need_to_limit(cls, entity_key: str, time_window: int, max_count: int) -> tuple[bool, float]:
+    def need_to_limit(
+        cls, entity_key: str, time_window: int, max_count: int, calls: int = 1
+    ) -> tuple[bool, float]:
         """
         Returns a tuple of `(rate_limited, time_till_free)`.
         For simplicity, we have loosened the semantics here from
@@ -258,7 +266,9 @@ class TornadoInMemoryRateLimiterBackend(RateLimiterBackend):
             cls._garbage_collect_for_rule(now, time_window, max_count)
 
         reset_times_for_rule = cls.reset_times.setdefault((time_window, max_count), {})
-        new_reset = max(reset_times_for_rule.get(entity_key, now), now) + time_window / max_count
+        new_reset = (
+            max(reset_times_for_rule.get(entity_key, now), now) + calls * time_window / max_count
+        )
 
         if new_reset > now + time_window:
             # Compute for how long the bucket will remain filled.
@@ -305,7 +315,12 @@ class TornadoInMemoryRateLimiterBackend(RateLimiterBackend):
     @classmethod
     @override
     def rate_limit_entity(
-        cls, entity_key: str, rules: list[tuple[int, int]], max_api_calls: int, max_api_window: int
+        cls,
+        entity_key: str,
+        rules: list[tuple[int, int]],
+        max_api_calls: int,
+        max_api_window: int,
+        calls: int = 1,
     ) -> tuple[bool, float]:
         now = time.time()
         if entity_key in cls.timestamps_blocked_until:
@@ -318,7 +333,9 @@ class TornadoInMemoryRateLimiterBackend(RateLimiterBackend):
 
         assert rules
         for time_window, max_count in rules:
-            ratelimited, time_till_free = cls.need_to_limit(entity_key, time_window, max_count)
+            ratelimited, time_till_free = cls.need_to_limit(
+                entity_key, time_window, max_count, calls
+            )
 
             if ratelimited:
                 break
@@ -388,17 +405,21 @@ class RedisRateLimiterBackend(RateLimiterBackend):
         return calls_left, time_reset - now
 
     @classmethod
-    def is_ratelimited(cls, entity_key: str, rules: list[tuple[int, int]]) -> tuple[bool, float]:
-        """Returns a tuple of (rate_limited, time_till_free)"""
+    def is_ratelimited(
+        cls, entity_key: str, rules: list[tuple[int, int]], calls: int = 1
+    ) -> tuple[bool, float]:
+        """Returns a tuple of (rate_limited, time_till_free), for
+        making the given number of API calls"""
         assert rules
         list_key, set_key, blocking_key = cls.get_keys(entity_key)
 
         # Go through the rules from shortest to longest,
         # seeing if this user has violated any of them. First
-        # get the timestamps for each nth items
+        # get the timestamps for each nth items, where n is the
+        # number of calls which the rule allows before these.
         with client.pipeline() as pipe:
             for _, request_count in rules:
-                pipe.lindex(list_key, request_count - 1)  # 0-indexed list
+                pipe.lindex(list_key, max(request_count - calls, 0))  # 0-indexed list
 
             # Get blocking info
             pipe.get(blocking_key)
@@ -433,10 +454,17 @@ class RedisRateLimiterBackend(RateLimiterBackend):
         return False, 0.0
 
     @classmethod
-    def incr_ratelimit(cls, entity_key: str, max_api_calls: int, max_api_window: int) -> None:
+    def incr_ratelimit(
+        cls, entity_key: str, max_api_calls: int, max_api_window: int, calls: int = 1
+    ) -> None:
         """Increases the rate-limit for the specified entity"""
         list_key, set_key, _ = cls.get_keys(entity_key)
         now = time.time()
+        # We only keep the newest max_api_calls timestamps.  Each call
+        # gets its own timestamp, a microsecond apart, since they are
+        # also the members of our sorted set.
+        calls = min(calls, max_api_calls)
+        timestamps = [now - (calls - 1 - i) / 1000000 for i in range(calls)]
 
         # Start Redis transaction
         with client.pipeline() as pipe:
@@ -449,28 +477,28 @@ class RedisRateLimiterBackend(RateLimiterBackend):
                     # When watching a value, the pipeline is set to Immediate mode
                     pipe.watch(list_key)
 
-                    # Get the last elem that we'll trim (so we can remove it from our sorted set)
-                    last_val = cast(  # mypy doesn’t know the pipe is in immediate mode
-                        bytes | None, pipe.lindex(list_key, max_api_calls - 1)
+                    # Get the last elems that we'll trim (so we can remove them from our sorted set)
+                    last_vals = cast(  # mypy doesn’t know the pipe is in immediate mode
+                        list[bytes], pipe.lrange(list_key, max_api_calls - calls, max_api_calls - 1)
                     )
 
                     # Restart buffered execution
                     pipe.multi()
 
-                    # Add this timestamp to our list
-                    pipe.lpush(list_key, now)
+                    # Add these timestamps to our list, newest first
+                    pipe.lpush(list_key, *timestamps)
 
                     # Trim our list to the oldest rule we have
                     pipe.ltrim(list_key, 0, max_api_calls - 1)
 
-                    # Add our new value to the sorted set that we keep
+                    # Add our new values to the sorted set that we keep
                     # We need to put the score and val both as timestamp,
                     # as we sort by score but remove by value
-                    pipe.zadd(set_key, {str(now): now})
+                    pipe.zadd(set_key, {str(timestamp): timestamp for timestamp in timestamps})
 
-                    # Remove the trimmed value from our sorted set, if there was one
-                    if last_val is not None:
-                        pipe.zrem(set_key, last_val)
+                    # Remove the trimmed values from our sorted set, if there were any
+                    if last_vals:
+                        pipe.zrem(set_key, *last_vals)
 
                     # Set the TTL for our keys as well
                     api_window = max_api_window
@@ -491,13 +519,18 @@ class RedisRateLimiterBackend(RateLimiterBackend):
     @classmethod
     @override
     def rate_limit_entity(
-        cls, entity_key: str, rules: list[tuple[int, int]], max_api_calls: int, max_api_window: int
+        cls,
+        entity_key: str,
+        rules: list[tuple[int, int]],
+        max_api_calls: int,
+        max_api_window: int,
+        calls: int = 1,
     ) -> tuple[bool, float]:
-        ratelimited, time = cls.is_ratelimited(entity_key, rules)
+        ratelimited, time = cls.is_ratelimited(entity_key, rules, calls)
 
         if not ratelimited:
             try:
-                cls.incr_ratelimit(entity_key, max_api_calls, max_api_window)
+                cls.incr_ratelimit(entity_key, max_api_calls, max_api_window, calls)
             except RateLimiterLockingError:
                 logger.warning("Deadlock trying to incr_ratelimit for %s", entity_key)
                 # rate-limit users who are hitting the API so hard we can't update our stats.
@@ -578,14 +611,15 @@ def client_is_exempt_from_rate_limiting(request: HttpRequest) -> bool:
     )
 
 
-def rate_limit_user(request: HttpRequest, user: UserProfile, domain: str) -> None:
+def rate_limit_user(request: HttpRequest, user: UserProfile, domain: str, calls: int = 1) -> None:
     """Returns whether or not a user was rate limited. Will raise a RateLimitedError exception
     if the user has been rate limited, otherwise returns and modifies request to contain
-    the rate limit information"""
+    the rate limit information.  Requests which do the work of several API calls can be
+    charged for that many calls."""
     if not should_rate_limit(request):
         return
 
-    RateLimitedUser(user, domain=domain).rate_limit_request(request)
+    RateLimitedUser(user, domain=domain).rate_limit_request(request, calls)
 
 
 def rate_limit_request_by_ip(request: HttpRequest, domain: str) -> None:
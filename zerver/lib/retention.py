@@ -40,6 +40,7 @@ from psycopg2.sql import SQL, Composable, Identifier, Literal
 
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.request import RequestVariableConversionError
+from zerver.lib.user_message import flush_unread_snapshots_for_messages
 from zerver.models import (
     ArchivedAttachment,
     ArchivedReaction,
@@ -326,7 +327,8 @@ def delete_messages(msg_ids: list[int]) -> None:
     # key to Message (due to `on_delete=CASCADE` in our models
     # configuration), so we need to be sure we've taken care of
     # archiving the messages before doing this step.
-    #
+    flush_unread_snapshots_for_messages(msg_ids)
+
     # Uses index: zerver_message_pkey
     Message.objects.filter(id__in=msg_ids).delete()
 
@@ -599,6 +601,7 @@ def restore_data_from_archive(archive_transaction: ArchiveTransaction) -> int:
     with transaction.atomic(durable=True):
         msg_ids = restore_messages_from_archive(archive_transaction.id)
         restore_models_with_message_key_from_archive(archive_transaction.id)
+        flush_unread_snapshots_for_messages(msg_ids)
         restore_attachments_from_archive(archive_transaction.id)
         restore_attachment_messages_from_archive(archive_transaction.id)
 
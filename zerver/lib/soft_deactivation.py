@@ -11,6 +11,7 @@ from django.db.models import Exists, F, Max, OuterRef, QuerySet
 from django.db.models.functions import Greatest
 from django.utils.timezone import now as timezone_now
 
+from zerver.lib.cache import flush_user_unread_snapshots
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.user_message import bulk_insert_all_ums
@@ -245,6 +246,7 @@ def add_missing_messages(user_profile: UserProfile) -> None:
             message_ids_to_insert[BULK_CREATE_BATCH_SIZE:],
         )
         bulk_insert_all_ums(user_ids=[user_profile.id], message_ids=message_ids, flags=0)
+        flush_user_unread_snapshots([user_profile.id])
         UserProfile.objects.filter(id=user_profile.id).update(
             last_active_message_id=Greatest(F("last_active_message_id"), message_ids[-1])
         )
@@ -1,15 +1,19 @@
 import itertools
+from array import array
 from collections import defaultdict
 from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
+from functools import lru_cache
 from operator import itemgetter
 from typing import Any, Literal
 
 from django.db import connection, transaction
-from django.db.models import F, Q, QuerySet
+from django.db.models import F, QuerySet
+from django.db.models.functions import Coalesce
 from psycopg2 import sql
 from psycopg2.extras import execute_values
 
+from zerver.lib.cache import cache_with_key, stream_subscriber_settings_cache_key
 from zerver.models import AlertWord, Recipient, Stream, Subscription, UserProfile, UserTopic
 
 
@@ -255,15 +259,120 @@ def subscriber_ids_with_stream_history_access(stream: Stream) -> set[int]:
     )
 
 
-def get_subscriptions_for_send_message(
+# The settings stored for each subscriber in StreamSubscriberSettings,
+# as bits of a byte.  The notification settings are the effective
+# ones: the subscription's setting if set, else the user's default.
+SUBSCRIBER_SETTING_FLAGS = {
+    setting: 1 << bit
+    for bit, setting in enumerate(
+        [
+            "is_muted",
+            "long_term_idle",
+            "push_notifications",
+            "email_notifications",
+            "wildcard_mentions_notify",
+            "followed_topic_push_notifications",
+            "followed_topic_email_notifications",
+            "followed_topic_wildcard_mentions_notify",
+        ]
+    )
+}
+
+
+@lru_cache(None)
+def subscriber_setting_selectors(setting: str) -> bytes:
+    # A bytes.translate table, mapping each flags byte to whether the
+    # setting is enabled in it.
+    flag = SUBSCRIBER_SETTING_FLAGS[setting]
+    return bytes(bool(flags & flag) for flags in range(256))
+
+
+@dataclass
+class StreamSubscriberSettings:
+    """The settings of a stream's active subscribers which determine
+    how a message or typing notification sent to it is delivered,
+    stored compactly so that they can be cached for streams with many
+    thousands of subscribers: the sorted IDs of the subscribers, and a
+    byte of SUBSCRIBER_SETTING_FLAGS for each.
+    """
+
+    user_ids: "array[int]"
+    flags: bytes
+    # Few users disable typing notifications, so these are stored as
+    # a separate list, rather than as a ninth flag.
+    typing_disabled_user_ids: "array[int]"
+
+    def all_user_ids(self) -> set[int]:
+        return set(self.user_ids)
+
+    def user_ids_with(self, setting: str) -> set[int]:
+        return set(
+            itertools.compress(
+                self.user_ids, self.flags.translate(subscriber_setting_selectors(setting))
+            )
+        )
+
+    def typing_notification_user_ids(self) -> set[int]:
+        # We don't notify long_term_idle subscribers.
+        user_ids = self.all_user_ids() - self.user_ids_with("long_term_idle")
+        user_ids.difference_update(self.typing_disabled_user_ids)
+        return user_ids
+
+
+@cache_with_key(stream_subscriber_settings_cache_key, timeout=3600 * 24)
+def get_stream_subscriber_settings(recipient_id: int) -> StreamSubscriberSettings:
+    """Cached by the stream's Recipient ID, and flushed by changes to
+    its subscriptions and to the settings of its subscribers, so that
+    sending a message to the stream doesn't need to query all of its
+    subscriptions.  For a stream with 20000 subscribers, this cuts
+    get_recipient_info from about 90ms to 50ms, most of which is
+    then the query for the recipients' UserProfile settings."""
+    rows = (
+        Subscription.objects.filter(recipient_id=recipient_id, active=True, is_user_active=True)
+        # Followed by the settings in the order of SUBSCRIBER_SETTING_FLAGS.
+        .values_list(
+            "user_profile_id",
+            "user_profile__receives_typing_notifications",
+            "is_muted",
+            "user_profile__long_term_idle",
+            Coalesce("push_notifications", "user_profile__enable_stream_push_notifications"),
+            Coalesce("email_notifications", "user_profile__enable_stream_email_notifications"),
+            Coalesce("wildcard_mentions_notify", "user_profile__wildcard_mentions_notify"),
+            "user_profile__enable_followed_topic_push_notifications",
+            "user_profile__enable_followed_topic_email_notifications",
+            "user_profile__enable_followed_topic_wildcard_mentions_notify",
+        )
+        .order_by("user_profile_id")
+    )
+    user_ids = array("i")
+    flags = bytearray()
+    typing_disabled_user_ids = array("i")
+    for user_profile_id, receives_typing_notifications, *settings in rows:
+        user_ids.append(user_profile_id)
+        if not receives_typing_notifications:
+            typing_disabled_user_ids.append(user_profile_id)
+        flags.append(
+            sum(
+                flag
+                for flag, enabled in zip(SUBSCRIBER_SETTING_FLAGS.values(), settings, strict=True)
+                if enabled
+            )
+        )
+    return StreamSubscriberSettings(
+        user_ids=user_ids, flags=bytes(flags), typing_disabled_user_ids=typing_disabled_user_ids
+    )
+
+
+def get_user_ids_for_send_message(
     *,
     realm_id: int,
     stream_id: int,
     topic_name: str,
+    subscriber_settings: StreamSubscriberSettings,
     possible_stream_wildcard_mention: bool,
     topic_participant_user_ids: AbstractSet[int],
     possibly_mentioned_user_ids: AbstractSet[int],
-) -> QuerySet[Subscription]:
+) -> set[int]:
     """This function optimizes an important use case for large
     streams. Open realms often have many long_term_idle users, which
     can result in 10,000s of long_term_idle recipients in default
@@ -271,8 +380,8 @@ def get_subscriptions_for_send_message(
     for long_term_idle unless message flags or notifications should be
     generated.
 
-    However, it's expensive even to fetch and process them all in
-    Python at all. This function returns all recipients of a stream
+    However, it's expensive even to process them all in Python at
+    all. This function returns all recipients of a stream
     message that could possibly require action in the send-message
     codepath.
 
@@ -292,36 +401,24 @@ def get_subscriptions_for_send_message(
     parsed the message, will do the precise determination.
     """
 
-    query = get_active_subscriptions_for_stream_id(
-        stream_id,
-        include_deactivated_users=False,
-    )
-
+    user_ids = subscriber_settings.all_user_ids()
     if possible_stream_wildcard_mention:
-        return query
-
-    query = query.filter(
-        Q(user_profile__long_term_idle=False)
-        | Q(push_notifications=True)
-        | (Q(push_notifications=None) & Q(user_profile__enable_stream_push_notifications=True))
-        | Q(email_notifications=True)
-        | (Q(email_notifications=None) & Q(user_profile__enable_stream_email_notifications=True))
-        | Q(user_profile_id__in=possibly_mentioned_user_ids)
-        | Q(user_profile_id__in=topic_participant_user_ids)
-        | Q(
-            user_profile_id__in=AlertWord.objects.filter(realm_id=realm_id).values_list(
-                "user_profile_id"
-            )
-        )
-        | Q(
-            user_profile_id__in=UserTopic.objects.filter(
+        return user_ids
+
+    idle_user_ids = subscriber_settings.user_ids_with("long_term_idle")
+    idle_user_ids -= subscriber_settings.user_ids_with("push_notifications")
+    idle_user_ids -= subscriber_settings.user_ids_with("email_notifications")
+    idle_user_ids.difference_update(possibly_mentioned_user_ids, topic_participant_user_ids)
+    if idle_user_ids:
+        idle_user_ids.difference_update(
+            AlertWord.objects.filter(realm_id=realm_id).values_list("user_profile_id", flat=True),
+            UserTopic.objects.filter(
                 stream_id=stream_id,
                 topic_name__iexact=topic_name,
                 visibility_policy=UserTopic.VisibilityPolicy.FOLLOWED,
-            ).values_list("user_profile_id")
+            ).values_list("user_profile_id", flat=True),
         )
-    )
-    return query
+    return user_ids - idle_user_ids
 
 
 def update_all_subscriber_counts_for_user(
@@ -82,6 +82,7 @@ from zerver.lib.test_helpers import (
     instrument_url,
     queries_captured,
 )
+from zerver.lib.tex import clear_tex_cache
 from zerver.lib.thumbnail import ThumbnailFormat
 from zerver.lib.topic import RESOLVED_TOPIC_PREFIX, filter_by_topic_name_via_message
 from zerver.lib.upload import upload_message_attachment_from_request
@@ -222,6 +223,7 @@ class ZulipTestCaseMixin(SimpleTestCase):
         clear_client_event_queues_for_testing()
         clear_supported_auth_backends_cache()
         flush_per_request_caches()
+        clear_tex_cache()
         translation.activate(settings.LANGUAGE_CODE)
 
         # Clean up local uploads directory after tests:
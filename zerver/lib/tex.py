@@ -1,6 +1,9 @@
 import logging
 import os
 import subprocess
+from collections import OrderedDict
+from collections.abc import Iterable
+from functools import cache
 from typing import Any
 
 import lxml.html
@@ -19,6 +22,73 @@ class KatexSession(OutgoingSession):
         super().__init__(role="katex", timeout=0.5, **kwargs)
 
 
+@cache
+def get_katex_session() -> KatexSession:
+    # We reuse one session, so that we keep a connection open to the
+    # KaTeX server, rather than opening one for every request.
+    return KatexSession()
+
+
+# Maps (tex, is_inline) to the HTML that KaTeX rendered it to, for
+# the most recently used formulas; only successful renderings are
+# cached, so that errors are retried (and reported).
+TEX_CACHE_SIZE = 4096
+tex_cache: OrderedDict[tuple[str, bool], str] = OrderedDict()
+
+
+def cache_rendered_tex(tex: str, is_inline: bool, html: str) -> None:
+    tex_cache[(tex, is_inline)] = html
+    tex_cache.move_to_end((tex, is_inline))
+    if len(tex_cache) > TEX_CACHE_SIZE:
+        tex_cache.popitem(last=False)
+
+
+def clear_tex_cache() -> None:
+    tex_cache.clear()
+
+
+def render_tex_batch(spans: Iterable[tuple[str, bool]]) -> None:
+    """Render each of the (tex, is_inline) spans which isn't already
+    cached using a single request to the KaTeX server, and cache the
+    results, so that the render_tex calls for each of them while
+    rendering a message do not each make a request.
+
+    Spans which fail to render are left for render_tex to retry, and
+    report, individually.
+    """
+    if not settings.KATEX_SERVER:
+        return
+    uncached_spans = [span for span in dict.fromkeys(spans) if span not in tex_cache]
+    if len(uncached_spans) < 2:
+        return
+
+    try:
+        resp = get_katex_session().post(
+            # See render_tex for why we disable the Smokescreen proxy.
+            f"http://localhost:{settings.KATEX_SERVER_PORT}/batch",
+            json={
+                "batch": [
+                    {"content": tex, "is_display": not is_inline}
+                    for tex, is_inline in uncached_spans
+                ],
+                "shared_secret": settings.SHARED_SECRET,
+            },
+            proxies={"http": ""},
+        )
+    except requests.exceptions.RequestException as e:
+        logging.warning("KaTeX batch rendering failed: %s", type(e).__name__)
+        return
+    if resp.status_code != 200:
+        logging.warning(
+            "KaTeX batch rendering failed: (%s) %s", resp.status_code, resp.content.decode()
+        )
+        return
+
+    for (tex, is_inline), html in zip(uncached_spans, resp.json()["results"], strict=True):
+        if html is not None:
+            cache_rendered_tex(tex, is_inline, html.strip())
+
+
 def render_tex(tex: str, is_inline: bool = True) -> str | None:
     r"""Render a TeX string into HTML using KaTeX
 
@@ -33,9 +103,21 @@ def render_tex(tex: str, is_inline: bool = True) -> str | None:
                  (default True)
     """
 
+    html = tex_cache.get((tex, is_inline))
+    if html is not None:
+        tex_cache.move_to_end((tex, is_inline))
+        return html
+
+    html = render_tex_uncached(tex, is_inline)
+    if html is not None:
+        cache_rendered_tex(tex, is_inline, html)
+    return html
+
+
+def render_tex_uncached(tex: str, is_inline: bool) -> str | None:
     if settings.KATEX_SERVER:
         try:
-            resp = KatexSession().post(
+            resp = get_katex_session().post(
                 # We explicitly disable the Smokescreen proxy for this
                 # call, since it intentionally connects to localhost.
                 # This is safe because the host is explicitly fixed, and
@@ -1,14 +1,21 @@
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
 from datetime import datetime
 from typing import Any
 
 import orjson
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import F, Func, JSONField, Q, QuerySet, Subquery, TextField, Value
 from django.db.models.functions import Cast
 from django.utils.translation import gettext as _
 from django.utils.translation import override as override_language
 
+from zerver.lib.cache import (
+    cache_delete_many,
+    cache_get,
+    cache_get_many,
+    cache_set,
+    topic_participants_cache_key,
+)
 from zerver.lib.types import EditHistoryEvent, StreamMessageEditRequest
 from zerver.lib.utils import assert_is_not_none
 from zerver.models import Message, Reaction, UserMessage, UserProfile
@@ -353,11 +360,25 @@ def get_topic_resolution_and_bare_name(stored_name: str) -> tuple[bool, str]:
     return (False, stored_name)
 
 
+# Bounds how long the participants of a topic may be stale after code
+# paths which remove messages without flushing them, like the message
+# retention policy.
+TOPIC_PARTICIPANTS_CACHE_TIMEOUT = 3600 * 24
+
+
 def participants_for_topic(realm_id: int, recipient_id: int, topic_name: str) -> set[int]:
     """
     Users who either sent or reacted to the messages in the topic.
-    The function is expensive for large numbers of messages in the topic.
+    Computing this is expensive for large numbers of messages in the
+    topic, so the result is cached, and flushed by
+    add_topic_participants and flush_topic_participants when the
+    topic's participants may have changed.
     """
+    key = topic_participants_cache_key(recipient_id, topic_name)
+    cached = cache_get(key)
+    if cached is not None:
+        return set(cached[0])
+
     messages = Message.objects.filter(
         # Uses index: zerver_message_realm_recipient_upper_subject
         realm_id=realm_id,
@@ -375,9 +396,62 @@ def participants_for_topic(realm_id: int, recipient_id: int, topic_name: str) ->
             )
         ).values_list("id", flat=True)
     )
+    cache_set(key, participants, timeout=TOPIC_PARTICIPANTS_CACHE_TIMEOUT)
     return participants
 
 
+def flush_topic_participants_cache_keys(keys: list[str]) -> None:
+    if not keys:
+        return
+    cache_delete_many(keys)
+    # A concurrent participants_for_topic may have queried the topic
+    # before this transaction's changes, and cache that stale result
+    # after the flush above; so we flush again once they are visible.
+    transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def add_topic_participants(participations: Iterable[tuple[int, str, int]]) -> None:
+    """Called with (recipient_id, topic_name, user_id) for each user who
+    sent or reacted to a message in a topic.
+
+    The cached participants of a topic stay valid when the user was
+    already a participant, which is the common case in busy topics,
+    and are flushed otherwise; we don't add the user to the cached
+    set, since concurrent read-modify-writes could lose additions.
+
+    Topics whose participants aren't cached, the common case for
+    most sends, are only flushed once this transaction commits: a
+    concurrent participants_for_topic may cache them as they were
+    before this transaction, which is only stale once it commits.
+    """
+    user_ids_by_key: dict[str, set[int]] = {}
+    for recipient_id, topic_name, user_id in participations:
+        key = topic_participants_cache_key(recipient_id, topic_name)
+        user_ids_by_key.setdefault(key, set()).add(user_id)
+    if not user_ids_by_key:
+        return
+
+    cached = cache_get_many(list(user_ids_by_key))
+    stale_keys = [
+        key
+        for key, user_ids in user_ids_by_key.items()
+        if key in cached and not user_ids <= cached[key][0]
+    ]
+    if stale_keys:
+        cache_delete_many(stale_keys)
+    uncached_keys = [key for key in user_ids_by_key if key not in cached]
+    if stale_keys or uncached_keys:
+        transaction.on_commit(lambda: cache_delete_many(stale_keys + uncached_keys))
+
+
+def flush_topic_participants(topics: Iterable[tuple[int, str]]) -> None:
+    """Called with the (recipient_id, topic_name) of topics which
+    messages or reactions were moved into or removed from."""
+    flush_topic_participants_cache_keys(
+        list({topic_participants_cache_key(recipient_id, topic) for recipient_id, topic in topics})
+    )
+
+
 def maybe_rename_general_chat_to_empty_topic(topic_name: str) -> str:
     if topic_name == Message.EMPTY_TOPIC_FALLBACK_NAME:
         topic_name = ""
@@ -1,24 +1,49 @@
+from array import array
+from collections.abc import Collection, Iterable, Iterator
+
 from django.db import connection
-from psycopg2.extras import execute_values
 from psycopg2.sql import SQL, Composable, Literal
 
+from zerver.lib.cache import flush_user_unread_snapshots
 from zerver.models import UserMessage
 
 
-class UserMessageLite:
+class UserMessageRows:
     """
     The Django ORM is too slow for bulk operations.  This class
     is optimized for the simple use case of inserting a bunch of
-    rows into zerver_usermessage.
+    rows into zerver_usermessage: a message sent to a large stream
+    can have tens of thousands of them, so rather than a Python
+    object per row, we store them as a compact array per column,
+    which bulk_insert_ums sends to the database as a whole.
     """
 
-    def __init__(self, user_profile_id: int, message_id: int, flags: int) -> None:
-        self.user_profile_id = user_profile_id
-        self.message_id = message_id
-        self.flags = flags
+    def __init__(self) -> None:
+        self.user_profile_ids = array("i")
+        self.message_ids = array("i")
+        self.flags = array("q")
+
+    def append(self, user_profile_id: int, message_id: int, flags: int) -> None:
+        self.user_profile_ids.append(user_profile_id)
+        self.message_ids.append(message_id)
+        self.flags.append(flags)
+
+    def extend(self, rows: "UserMessageRows") -> None:
+        self.user_profile_ids.extend(rows.user_profile_ids)
+        self.message_ids.extend(rows.message_ids)
+        self.flags.extend(rows.flags)
+
+    def __len__(self) -> int:
+        return len(self.user_profile_ids)
 
-    def flags_list(self) -> list[str]:
-        return UserMessage.flags_list_for_flags(self.flags)
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        return zip(self.user_profile_ids, self.message_ids, self.flags, strict=True)
+
+
+def postgres_int_array(values: Iterable[int]) -> str:
+    # Formatting the array literal ourselves is much faster than
+    # psycopg2's adaptation of a list, which quotes each element.
+    return "{" + ",".join(map(str, values)) + "}"
 
 
 DEFAULT_HISTORICAL_FLAGS = UserMessage.flags.historical | UserMessage.flags.read
@@ -49,28 +74,39 @@ def create_historical_user_messages(
     bulk_insert_all_ums([user_id], message_ids, flags, conflict)
 
 
-def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
+def bulk_insert_ums(rows: UserMessageRows) -> None:
     """
     Doing bulk inserts this way is much faster than using Django,
     since we don't have any ORM overhead.  Profiling with 1000
     users shows a speedup of 0.436 -> 0.027 seconds, so we're
     talking about a 15x speedup.
+
+    Sending each column as a single array parameter, which UNNEST
+    turns back into rows, also avoids building a VALUES list with a
+    tuple per row.  With 10000 recipients, building and inserting
+    the rows inside the send-message transaction takes 65ms, rather
+    than 100ms with a VALUES list.
     """
-    if not ums:
+    if not rows:
         return
 
-    vals = [(um.user_profile_id, um.message_id, um.flags) for um in ums]
     query = SQL(
         """
-        INSERT into
-            zerver_usermessage (user_profile_id, message_id, flags)
-        VALUES %s
+        INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+        SELECT * FROM UNNEST(%s::integer[], %s::integer[], %s::bigint[])
         ON CONFLICT DO NOTHING
-    """
+        """
     )
 
     with connection.cursor() as cursor:
-        execute_values(cursor.cursor, query, vals)
+        cursor.execute(
+            query,
+            [
+                postgres_int_array(rows.user_profile_ids),
+                postgres_int_array(rows.message_ids),
+                postgres_int_array(rows.flags),
+            ],
+        )
 
 
 def bulk_insert_all_ums(
@@ -83,11 +119,28 @@ def bulk_insert_all_ums(
         """
         INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
         SELECT user_profile_id, message_id, %s AS flags
-          FROM UNNEST(%s) user_profile_id
-          CROSS JOIN UNNEST(%s) message_id
+          FROM UNNEST(%s::integer[]) user_profile_id
+          CROSS JOIN UNNEST(%s::integer[]) message_id
         ON CONFLICT {conflict}
         """
     ).format(conflict=conflict if conflict is not None else SQL("DO NOTHING"))
 
     with connection.cursor() as cursor:
-        cursor.execute(query, [flags, user_ids, message_ids])
+        cursor.execute(
+            query, [flags, postgres_int_array(user_ids), postgres_int_array(message_ids)]
+        )
+
+
+def flush_unread_snapshots_for_messages(message_ids: Collection[int]) -> None:
+    """Flushes the cached unread snapshots of the users for whom any of
+    these messages are unread; used when they are moved or deleted."""
+    if not message_ids:
+        return
+
+    user_ids = (
+        UserMessage.objects.filter(message_id__in=message_ids)
+        .extra(where=[UserMessage.where_unread()])  # noqa: S610
+        .values_list("user_profile_id", flat=True)
+        .distinct()
+    )
+    flush_user_unread_snapshots(user_ids)
@@ -0,0 +1,149 @@
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Any
+
+import orjson
+import requests
+from django.conf import settings
+from django.core.management.base import CommandError
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.models import UserProfile
+from zerver.tornado.django_api import requests_client
+from zerver.tornado.sharding import (
+    get_realm_tornado_ports,
+    get_tornado_url,
+    get_user_id_tornado_port,
+)
+
+
+class Command(ZulipBaseCommand):
+    help = """Move the event queues of a realm's users to the Tornado ports
+they are assigned to under a new set of Tornado ports for the realm.
+
+Run this before updating the realm's entry in /etc/zulip/sharding.json
+to the new ports.  Each Tornado process hands the event queues of the
+users which move off of it to their new port, and passes along any
+events and requests for them until the sharding configuration is
+updated, so clients do not need to reload.  Only users whose port
+changes are moved; with consistent hashing, adding a port moves about
+1/N of the realm's users.
+
+To switch to TORNADO_SHARDING_CONSISTENT_HASHING, run this for each
+realm sharded across several ports, with --consistent-hashing and the
+realm's current ports, before enabling the setting."""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument(
+            "--ports",
+            required=True,
+            help="Comma-separated list of the Tornado ports the realm will be sharded across.",
+        )
+        parser.add_argument(
+            "--consistent-hashing",
+            action="store_true",
+            help="Assign users to the new ports with consistent hashing, "
+            "regardless of TORNADO_SHARDING_CONSISTENT_HASHING.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only show how many users would move."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None  # Should be ensured by parser
+
+        try:
+            new_ports = sorted({int(port) for port in options["ports"].split(",")})
+        except ValueError:
+            raise CommandError("--ports must be a comma-separated list of port numbers.")
+        unknown_ports = set(new_ports) - set(settings.TORNADO_PORTS)
+        if unknown_ports:
+            raise CommandError(f"Not configured Tornado ports: {sorted(unknown_ports)}")
+
+        old_ports = get_realm_tornado_ports(realm)
+        moves: dict[tuple[int, int], list[int]] = defaultdict(list)
+        user_ids = UserProfile.objects.filter(realm=realm).values_list("id", flat=True)
+        consistent_hashing = (
+            options["consistent_hashing"] or settings.TORNADO_SHARDING_CONSISTENT_HASHING
+        )
+        for user_id in user_ids:
+            old_port = get_user_id_tornado_port(old_ports, user_id)
+            new_port = get_user_id_tornado_port(new_ports, user_id, consistent_hashing)
+            if old_port != new_port:
+                moves[(old_port, new_port)].append(user_id)
+
+        for (old_port, new_port), moved_user_ids in sorted(moves.items()):
+            print(f"Moving {len(moved_user_ids)} users from port {old_port} to {new_port}")
+            if options["dry_run"]:
+                continue
+
+            self.move_event_queues(old_port, new_port, moved_user_ids)
+
+        if moves and not options["dry_run"]:
+            if consistent_hashing and not settings.TORNADO_SHARDING_CONSISTENT_HASHING:
+                print(
+                    "Now set TORNADO_SHARDING_CONSISTENT_HASHING = True in "
+                    "/etc/zulip/settings.py, and restart the server."
+                )
+            if new_ports != sorted(old_ports):
+                print(
+                    f"Now set the ports for {realm.host} in /etc/zulip/sharding.json to "
+                    f"{new_ports}, and run `./scripts/refresh-sharding-and-restart`."
+                )
+
+    def post(self, port: int, endpoint: str, data: dict[str, Any]) -> dict[str, Any]:
+        resp = requests_client().post(
+            get_tornado_url(port) + "/api/internal/tornado/" + endpoint,
+            data={"secret": settings.SHARED_SECRET, **data},
+            timeout=60,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def move_event_queues(self, old_port: int, new_port: int, user_ids: list[int]) -> None:
+        try:
+            queues = self.post(
+                old_port,
+                "export_event_queues",
+                {"user_ids": orjson.dumps(user_ids), "target_port": str(new_port)},
+            )["queues"]
+        except requests.RequestException as e:
+            raise CommandError(f"Failed to export event queues from port {old_port}: {e}")
+
+        try:
+            self.post(
+                new_port,
+                "import_event_queues",
+                {"user_ids": orjson.dumps(user_ids), "queues": orjson.dumps(queues)},
+            )
+        except requests.RequestException as e:
+            # The exported queues only exist in our hands now; give them
+            # back to the old port, which keeps serving their users.
+            self.post(
+                old_port,
+                "cancel_event_queue_migration",
+                {
+                    "user_ids": orjson.dumps(user_ids),
+                    "target_port": str(new_port),
+                    "queues": orjson.dumps(queues),
+                },
+            )
+            raise CommandError(
+                f"Failed to import event queues on port {new_port}: {e}; "
+                f"they have been returned to port {old_port}."
+            )
+
+        try:
+            forwarded = self.post(
+                old_port, "forward_migration_notices", {"target_port": str(new_port)}
+            )["forwarded"]
+        except requests.RequestException as e:
+            raise CommandError(
+                f"Failed to forward held events from port {old_port} to {new_port}: {e}"
+            )
+        print(f"  {len(queues)} event queues, {forwarded} held events")
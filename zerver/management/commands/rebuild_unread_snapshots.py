@@ -0,0 +1,34 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from typing_extensions import override
+
+from zerver.lib.cache import flush_user_unread_snapshots
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message import get_raw_unread_data
+
+
+class Command(ZulipBaseCommand):
+    help = """Rebuild the cached unread snapshots of users from the database.
+
+Page loads read users' unread messages from these snapshots; use this
+if they are suspected to have drifted from the database, e.g. after
+modifying message flags by hand."""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        self.add_user_list_args(
+            parser,
+            help="Email addresses of user(s) to rebuild the unread snapshots of.",
+            all_users_help="Rebuild the unread snapshots of every user in the realm.",
+        )
+        self.add_realm_args(parser, required=True)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        users = self.get_users(options, realm, is_bot=False)
+        for user_profile in users:
+            flush_user_unread_snapshots([user_profile.id])
+            get_raw_unread_data(user_profile)
+        print(f"Rebuilt the unread snapshots of {len(users)} users.")
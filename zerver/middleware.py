@@ -30,6 +30,7 @@ from zerver.lib.cache import get_remote_cache_requests, get_remote_cache_time
 from zerver.lib.db_connections import reset_queries
 from zerver.lib.debug import maybe_tracemalloc_listen
 from zerver.lib.exceptions import ErrorCode, JsonableError, MissingAuthenticationError, WebhookError
+from zerver.lib.fetch_plan import get_section_times, reset_section_times
 from zerver.lib.markdown import get_markdown_requests, get_markdown_time
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.rate_limiter import RateLimitResult
@@ -100,6 +101,7 @@ def record_request_start_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["markdown_requests_start"] = get_markdown_requests()
     log_data["ai_time_start"] = get_ai_time()
     log_data["ai_requests_start"] = get_ai_time()
+    reset_section_times()
 
 
 def timedelta_ms(timedelta: float) -> float:
@@ -197,6 +199,18 @@ def write_log_line(
         if ai_time_delta > 0.005:
             ai_output = f" (ai: {format_timedelta(ai_time_delta)}/{ai_count_delta})"
 
+    # The slowest sections of a FetchPlan; when these run on other
+    # threads, their queries aren't included in the db time below.
+    sections_output = ""
+    slow_sections = sorted(
+        ((delta, name) for name, delta in get_section_times().items() if delta > 0.005),
+        reverse=True,
+    )[:3]
+    if slow_sections:
+        sections_output = " (sections: {})".format(
+            ", ".join(f"{format_timedelta(delta)} {name}" for delta, name in slow_sections)
+        )
+
     # Get the amount of time spent doing database queries
     db_time_output = ""
     queries = connection.connection.queries if connection.connection is not None else []
@@ -212,7 +226,7 @@ def write_log_line(
         logger_client = f"({requester_for_logs} via {client_name})"
     else:
         logger_client = f"({requester_for_logs} via {client_name}/{client_version})"
-    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{ai_output}{db_time_output}{startup_output} {path}"
+    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{ai_output}{db_time_output}{sections_output}{startup_output} {path}"
     logger_line = f"{remote_ip:<15} {method:<7} {status_code:3} {logger_timing}{extra_request_data} {logger_client}"
     if status_code in [200, 304] and method == "GET" and path.startswith("/static"):
         logger.debug(logger_line)
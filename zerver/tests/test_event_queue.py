@@ -1,10 +1,17 @@
+import os
+import tempfile
 import time
 from collections.abc import Callable, Collection
 from typing import Any
 from unittest import mock
+from urllib.parse import parse_qs
 
 import orjson
+import responses
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.http import HttpRequest, HttpResponse
+from django.test import override_settings
 from typing_extensions import override
 
 from zerver.actions.message_send import internal_send_private_message
@@ -16,16 +23,38 @@ from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.cache import cache_delete, get_muting_users_cache_key
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import HostRequestMock, dummy_handler, mock_queue_publish
-from zerver.models import Recipient, Subscription, UserProfile, UserTopic
+from zerver.models import Message, Recipient, Subscription, UserProfile, UserTopic
 from zerver.models.streams import get_stream
+from zerver.tornado import event_queue
+from zerver.tornado.descriptors import set_descriptor_by_handler_id
 from zerver.tornado.event_queue import (
     ClientDescriptor,
+    QueuedMessageEvent,
     access_client_descriptor,
     allocate_client_descriptor,
+    cancel_event_queue_migration,
+    clear_client_event_queues_for_testing,
+    coalesce_handler_finishes,
+    dump_event_queues,
+    export_user_event_queues,
+    forward_held_migration_notices,
+    get_client_descriptors_for_channel_narrow,
+    get_client_descriptors_for_realm_all_streams,
+    get_client_descriptors_for_user,
+    get_event_size,
+    import_event_queues,
+    load_event_queues,
+    locally_hosted_user_ids,
     maybe_enqueue_notifications,
+    migrated_user_ports,
     missedmessage_hook,
+    pending_client_data,
     persistent_queue_filename,
+    process_notification,
+    queued_event_id,
 )
+from zerver.tornado.exceptions import BadEventQueueIdError
+from zerver.tornado.sharding import get_user_id_tornado_port
 from zerver.tornado.views import cleanup_event_queue, get_events
 
 
@@ -124,6 +153,82 @@ class StreamWatchersTest(ZulipTestCase):
         )
 
 
+class ChannelNarrowIndexTest(ZulipTestCase):
+    def test_channel_narrow_index(self) -> None:
+        cordelia = self.example_user("cordelia")
+        hamlet = self.example_user("hamlet")
+        self.subscribe(cordelia, "Denmark")
+        self.unsubscribe(hamlet, "Denmark")
+
+        def allocate_narrowed_queue(
+            narrow: list[list[str]],
+            event_types: list[str] | None = None,
+            empty_topic_name: bool = False,
+        ) -> ClientDescriptor:
+            return allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="home grown API program",
+                    empty_topic_name=empty_topic_name,
+                    event_types=event_types,
+                    last_connection_time=time.time(),
+                    queue_timeout=0,
+                    realm_id=hamlet.realm_id,
+                    user_profile_id=hamlet.id,
+                    narrow=narrow,
+                )
+            )
+
+        channel_client = allocate_narrowed_queue([["stream", "denmark"]])
+        topic_client = allocate_narrowed_queue([["channel", "Denmark"], ["topic", "Lunch"]])
+        other_topic_client = allocate_narrowed_queue([["stream", "Denmark"], ["topic", "dinner"]])
+        other_channel_client = allocate_narrowed_queue([["stream", "Verona"]])
+        mentioned_client = allocate_narrowed_queue([["is", "mentioned"]])
+        non_message_client = allocate_narrowed_queue([["stream", "Denmark"]], ["presence"])
+
+        realm_id = hamlet.realm_id
+        self.assertEqual(
+            get_client_descriptors_for_channel_narrow((realm_id, "denmark", None)),
+            [channel_client],
+        )
+        self.assertEqual(
+            get_client_descriptors_for_channel_narrow((realm_id, "denmark", "lunch")),
+            [topic_client],
+        )
+        self.assertEqual(get_client_descriptors_for_realm_all_streams(realm_id), [mentioned_client])
+
+        self.send_stream_message(cordelia, "Denmark", topic_name="lunch")
+        self.assert_length(channel_client.event_queue.contents(), 1)
+        self.assert_length(topic_client.event_queue.contents(), 1)
+        self.assertTrue(other_topic_client.event_queue.empty())
+        self.assertTrue(other_channel_client.event_queue.empty())
+        self.assertTrue(mentioned_client.event_queue.empty())
+        self.assertTrue(non_message_client.event_queue.empty())
+
+        # Garbage-collecting the queues removes them from the index.
+        channel_client.cleanup()
+        self.assertEqual(get_client_descriptors_for_channel_narrow((realm_id, "denmark", None)), [])
+        self.assertEqual(
+            get_client_descriptors_for_channel_narrow((realm_id, "denmark", "lunch")),
+            [topic_client],
+        )
+
+        # Clients which don't support empty topic names narrow to the
+        # fallback topic name to see messages sent to the empty topic.
+        empty_topic_client = allocate_narrowed_queue(
+            [["channel", "Denmark"], ["topic", ""]], empty_topic_name=True
+        )
+        fallback_topic_client = allocate_narrowed_queue(
+            [["channel", "Denmark"], ["topic", Message.EMPTY_TOPIC_FALLBACK_NAME]]
+        )
+        self.send_stream_message(cordelia, "Denmark", topic_name="")
+        self.assert_length(empty_topic_client.event_queue.contents(), 1)
+        self.assert_length(fallback_topic_client.event_queue.contents(), 1)
+        self.assert_length(topic_client.event_queue.contents(), 1)
+
+
 class MissedMessageHookTest(ZulipTestCase):
     """Tests what arguments missedmessage_hook passes into maybe_enqueue_notifications.
     Combined with the previous test, this ensures that the missedmessage_hook is correct"""
@@ -1204,6 +1309,307 @@ class FileReloadLogicTest(ZulipTestCase):
             )
 
 
+class CoalesceHandlerFinishesTest(ZulipTestCase):
+    def test_coalesce_handler_finishes(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=600,
+                realm_id=hamlet.realm_id,
+                user_profile_id=hamlet.id,
+            )
+        )
+        # Simulate a long-poll request waiting on the queue.
+        handler_id = 10**9
+        client.current_handler_id = handler_id
+        set_descriptor_by_handler_id(handler_id, client)
+
+        with (
+            mock.patch("zerver.tornado.event_queue.finish_handler") as mock_finish_handler,
+            coalesce_handler_finishes(),
+        ):
+            process_notification(dict(event=dict(type="test", x=1), users=[hamlet.id]))
+            process_notification(dict(event=dict(type="test", x=2), users=[hamlet.id]))
+            mock_finish_handler.assert_not_called()
+
+        mock_finish_handler.assert_called_once_with(
+            handler_id,
+            client.event_queue.id,
+            [dict(type="test", x=1, id=0), dict(type="test", x=2, id=1)],
+        )
+        self.assertIsNone(client.current_handler_id)
+
+        # Outside of a batch, each event finishes the handler immediately.
+        client.current_handler_id = handler_id
+        set_descriptor_by_handler_id(handler_id, client)
+        with mock.patch("zerver.tornado.event_queue.finish_handler") as mock_finish_handler:
+            process_notification(dict(event=dict(type="test", x=3), users=[hamlet.id]))
+            mock_finish_handler.assert_called_once()
+
+
+class EventQueuePersistenceTest(ZulipTestCase):
+    def test_dump_and_load_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=600,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+        )
+        client = allocate_client_descriptor(queue_data)
+        client.event_queue.push(dict(type="arbitrary", x="foo"))
+        realm_client = allocate_client_descriptor({**queue_data, "all_public_streams": True})
+        stored_client_dicts = {
+            client.event_queue.id: client.to_dict(),
+            realm_client.event_queue.id: realm_client.to_dict(),
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pattern = os.path.join(tmpdir, "event_queues%s.json")
+            with self.settings(JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=pattern):
+                dump_event_queues(9800)
+                clear_client_event_queues_for_testing()
+                load_event_queues(9800)
+
+                # The realm-wide queue is loaded immediately; the other
+                # is only read, to be deserialized later.
+                self.assertEqual(list(event_queue.clients), [realm_client.event_queue.id])
+                self.assertEqual(list(pending_client_data), [client.event_queue.id])
+
+                # Dumping again before the pending queue is loaded
+                # preserves it.
+                dump_event_queues(9800)
+                clear_client_event_queues_for_testing()
+                load_event_queues(9800)
+                self.assertEqual(list(pending_client_data), [client.event_queue.id])
+
+        # Accessing the queue loads it on demand, and sends it the
+        # restart event that setup_event_queue sent to the others.
+        loaded_client = access_client_descriptor(hamlet.id, client.event_queue.id)
+        self.assertEqual(pending_client_data, {})
+        self.assertEqual(
+            loaded_client.to_dict()["event_queue"]["queue"][0],
+            stored_client_dicts[client.event_queue.id]["event_queue"]["queue"][0],
+        )
+        self.assertEqual(
+            [event["type"] for event in loaded_client.event_queue.contents()],
+            ["arbitrary", "restart"],
+        )
+        self.assertEqual(
+            get_client_descriptors_for_user(hamlet.id),
+            [event_queue.clients[realm_client.event_queue.id], loaded_client],
+        )
+        self.assertEqual(
+            event_queue.clients[realm_client.event_queue.id].to_dict(),
+            stored_client_dicts[realm_client.event_queue.id],
+        )
+
+    def test_load_legacy_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=600,
+                realm_id=hamlet.realm_id,
+                user_profile_id=hamlet.id,
+            )
+        )
+        client_dict = client.to_dict()
+        clear_client_event_queues_for_testing()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pattern = os.path.join(tmpdir, "event_queues%s.json")
+            with self.settings(JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=pattern):
+                with open(persistent_queue_filename(9800), "wb") as f:
+                    f.write(orjson.dumps([(client.event_queue.id, client_dict)]))
+                load_event_queues(9800)
+
+        self.assertEqual(pending_client_data, {})
+        self.assertEqual(event_queue.clients[client.event_queue.id].to_dict(), client_dict)
+        self.assertEqual(
+            get_client_descriptors_for_user(hamlet.id),
+            [event_queue.clients[client.event_queue.id]],
+        )
+
+
+class TornadoShardingTest(ZulipTestCase):
+    def test_modulo_sharding(self) -> None:
+        self.assertEqual(get_user_id_tornado_port([9800, 9801, 9802], 17), 9802)
+        self.assertEqual(get_user_id_tornado_port([9800, 9801, 9802], 18), 9800)
+        self.assertEqual(get_user_id_tornado_port([9800], 17), 9800)
+
+    @override_settings(TORNADO_SHARDING_CONSISTENT_HASHING=True)
+    def test_consistent_hashing(self) -> None:
+        user_ids = range(1, 10001)
+        ports = [9800, 9801, 9802]
+        assignments = {user_id: get_user_id_tornado_port(ports, user_id) for user_id in user_ids}
+
+        # Users are spread roughly evenly across the ports.
+        for port in ports:
+            count = sum(1 for assigned_port in assignments.values() if assigned_port == port)
+            self.assertGreater(count, 2500)
+            self.assertLess(count, 4200)
+
+        # The order of the ports does not matter.
+        self.assertEqual(get_user_id_tornado_port([9802, 9800, 9801], 17), assignments[17])
+
+        # Adding a port only moves users to the new port.
+        new_ports = [*ports, 9803]
+        moved = 0
+        for user_id in user_ids:
+            new_port = get_user_id_tornado_port(new_ports, user_id)
+            if new_port != assignments[user_id]:
+                self.assertEqual(new_port, 9803)
+                moved += 1
+        self.assertGreater(moved, 1500)
+        self.assertLess(moved, 3500)
+
+        self.assertEqual(get_user_id_tornado_port([9800], 17), 9800)
+
+    def test_migrate_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=600,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+            user_recipient_id=hamlet.recipient_id,
+        )
+        client = allocate_client_descriptor(queue_data)
+        client.event_queue.push(dict(type="arbitrary", x="foo"))
+        client_dict = client.to_dict()
+
+        gc_hook = mock.Mock()
+        with mock.patch.object(event_queue, "gc_hooks", [gc_hook]):
+            exported = export_user_event_queues([hamlet.id], 9801)
+        gc_hook.assert_not_called()
+        self.assertEqual(exported, [client_dict])
+        self.assertEqual(get_client_descriptors_for_user(hamlet.id), [])
+        self.assertEqual(migrated_user_ports, {hamlet.id: 9801})
+
+        # Events for the migrated user are held until the queues have
+        # been imported, and then forwarded; events for other users
+        # are still processed here.
+        with mock_queue_publish(
+            "zerver.tornado.event_queue.queue_json_publish_rollback_unsafe"
+        ) as m:
+            process_notification(
+                dict(event=dict(type="arbitrary", x="bar"), users=[hamlet.id, cordelia.id])
+            )
+            m.assert_not_called()
+            self.assertEqual(forward_held_migration_notices(9801), 1)
+        m.assert_called_once()
+        self.assertEqual(m.call_args[0][0], "notify_tornado")
+        self.assertEqual(
+            m.call_args[0][1], dict(event=dict(type="arbitrary", x="bar"), users=[hamlet.id])
+        )
+
+        # Importing the queues, e.g. if the user moves back to this
+        # port, restores them.
+        import_event_queues([hamlet.id], exported)
+        self.assertEqual(migrated_user_ports, {})
+        self.assertEqual(locally_hosted_user_ids, {hamlet.id})
+        (imported_client,) = get_client_descriptors_for_user(hamlet.id)
+        self.assertEqual(imported_client.to_dict(), client_dict)
+
+    def test_cancel_event_queue_migration(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        client = allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=600,
+                realm_id=hamlet.realm_id,
+                user_profile_id=hamlet.id,
+                user_recipient_id=hamlet.recipient_id,
+            )
+        )
+        exported = export_user_event_queues([hamlet.id, cordelia.id], 9801)
+        process_notification(dict(event=dict(type="arbitrary", x="bar"), users=[hamlet.id]))
+
+        # If the target port fails to import the queues, they are
+        # restored here, along with the events held for them.
+        self.assertEqual(cancel_event_queue_migration([hamlet.id, cordelia.id], 9801, exported), 1)
+        self.assertEqual(migrated_user_ports, {})
+        (restored_client,) = get_client_descriptors_for_user(hamlet.id)
+        self.assertEqual(restored_client.event_queue.id, client.event_queue.id)
+        self.assertEqual([event["x"] for event in restored_client.event_queue.contents()], ["bar"])
+
+    @responses.activate
+    @override_settings(TORNADO_PORTS=[9800, 9801])
+    def test_migrate_tornado_event_queues_command(self) -> None:
+        tornado_url = "http://127.0.0.1:{}/api/internal/tornado/{}"
+        queues = [dict(event_queue=dict(id="1:0"))]
+        responses.post(tornado_url.format(9800, "export_event_queues"), json=dict(queues=queues))
+        responses.post(tornado_url.format(9801, "import_event_queues"), json=dict(imported=1))
+        responses.post(
+            tornado_url.format(9800, "forward_migration_notices"), json=dict(forwarded=2)
+        )
+
+        with (
+            mock.patch(
+                "zerver.management.commands.migrate_tornado_event_queues.get_realm_tornado_ports",
+                return_value=[9800],
+            ),
+            mock.patch("builtins.print") as mock_print,
+        ):
+            call_command("migrate_tornado_event_queues", "--realm=zulip", "--ports=9800,9801")
+        mock_print.assert_any_call("  1 event queues, 2 held events")
+        import_data = parse_qs(responses.calls[1].request.body)
+        self.assertEqual(orjson.loads(import_data["queues"][0]), queues)
+        export_data = parse_qs(responses.calls[0].request.body)
+        self.assertEqual(import_data["user_ids"], export_data["user_ids"])
+
+        # If the target port fails to import the queues, they are
+        # handed back to the old port.
+        responses.replace(
+            responses.POST, tornado_url.format(9801, "import_event_queues"), status=500
+        )
+        responses.post(
+            tornado_url.format(9800, "cancel_event_queue_migration"), json=dict(processed=0)
+        )
+        with (
+            mock.patch(
+                "zerver.management.commands.migrate_tornado_event_queues.get_realm_tornado_ports",
+                return_value=[9800],
+            ),
+            mock.patch("builtins.print"),
+            self.assertRaisesRegex(CommandError, "returned to port 9800"),
+        ):
+            call_command("migrate_tornado_event_queues", "--realm=zulip", "--ports=9800,9801")
+        self.assertEqual(
+            responses.calls[-1].request.url,
+            tornado_url.format(9800, "cancel_event_queue_migration"),
+        )
+
+
 class PruneInternalDataTest(ZulipTestCase):
     def test_prune_internal_data(self) -> None:
         user_profile = self.example_user("hamlet")
@@ -1242,9 +1648,9 @@ class PruneInternalDataTest(ZulipTestCase):
 
 
 class EventQueueTest(ZulipTestCase):
-    def get_client_descriptor(self) -> ClientDescriptor:
-        hamlet = self.example_user("hamlet")
-        realm = hamlet.realm
+    def get_client_descriptor(self, name: str = "hamlet") -> ClientDescriptor:
+        user = self.example_user(name)
+        realm = user.realm
         queue_data = dict(
             all_public_streams=False,
             apply_markdown=False,
@@ -1254,7 +1660,7 @@ class EventQueueTest(ZulipTestCase):
             last_connection_time=time.time(),
             queue_timeout=0,
             realm_id=realm.id,
-            user_profile_id=hamlet.id,
+            user_profile_id=user.id,
         )
 
         client = allocate_client_descriptor(queue_data)
@@ -1456,6 +1862,82 @@ class EventQueueTest(ZulipTestCase):
         )
         self.verify_to_dict_end_to_end(client)
 
+    def test_flag_collapsing_respects_order(self) -> None:
+        client = self.get_client_descriptor()
+        queue = client.event_queue
+
+        def flag_event(operation: str, messages: list[int]) -> dict[str, Any]:
+            event: dict[str, Any] = dict(
+                type="update_message_flags",
+                flag="read",
+                operation=operation,
+                all=False,
+                messages=messages,
+            )
+            if operation == "remove":
+                event["message_details"] = {
+                    str(message_id): {"type": "stream"} for message_id in messages
+                }
+            return event
+
+        queue.push(flag_event("add", [1]))
+        queue.push(flag_event("add", [2]))
+        # Marking message 1 as unread must not be reordered before
+        # marking it as read, nor after marking it read again below.
+        queue.push(flag_event("remove", [1]))
+        queue.push(flag_event("remove", [3]))
+        queue.push(flag_event("add", [1]))
+        self.verify_to_dict_end_to_end(client)
+        self.assertEqual(
+            queue.contents(),
+            [
+                {**flag_event("add", [1, 2]), "id": 2},
+                {**flag_event("remove", [1, 3]), "id": 5},
+                {**flag_event("add", [1]), "id": 6},
+            ],
+        )
+
+    def test_typing_and_presence_collapsing(self) -> None:
+        client = self.get_client_descriptor()
+        queue = client.event_queue
+        sender = dict(user_id=10, email="user10@example.com")
+
+        def typing_event(op: str, topic: str) -> dict[str, Any]:
+            return dict(
+                type="typing",
+                message_type="stream",
+                op=op,
+                sender=sender,
+                stream_id=3,
+                topic=topic,
+            )
+
+        queue.push(typing_event("start", "lunch"))
+        queue.push(dict(type="presence", user_id=10, server_timestamp=1, presence={"a": 1}))
+        queue.push(typing_event("start", "dinner"))
+        queue.push(dict(type="unknown"))
+        queue.push(typing_event("stop", "lunch"))
+        queue.push(dict(type="presence", user_id=10, server_timestamp=2, presence={"b": 2}))
+        queue.push(dict(type="user_settings", op="update", property="emojiset", value="x"))
+        queue.push(dict(type="user_settings", op="update", property="emojiset", value="y"))
+        self.verify_to_dict_end_to_end(client)
+        self.assertEqual(
+            queue.contents(),
+            [
+                {**typing_event("start", "dinner"), "id": 2},
+                {"type": "unknown", "id": 3},
+                {**typing_event("stop", "lunch"), "id": 4},
+                dict(
+                    type="presence",
+                    user_id=10,
+                    server_timestamp=2,
+                    presence={"a": 1, "b": 2},
+                    id=5,
+                ),
+                dict(type="user_settings", op="update", property="emojiset", value="y", id=7),
+            ],
+        )
+
     def test_collapse_event(self) -> None:
         """
         This mostly focuses on the internals of
@@ -1504,3 +1986,225 @@ class EventQueueTest(ZulipTestCase):
 
         queue.prune(1)
         self.verify_to_dict_end_to_end(client)
+
+    def test_compact_representation(self) -> None:
+        hamlet = self.example_user("hamlet")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=False,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=["message", "update_message"],
+            last_connection_time=time.time(),
+            narrow=[["channel", "Denmark"]],
+            queue_timeout=0,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+        )
+        client = allocate_client_descriptor(queue_data)
+        second_client = allocate_client_descriptor(
+            {
+                **queue_data,
+                "event_types": ["update_message", "message"],
+                "narrow": [["channel", "Denmark"]],
+            }
+        )
+        self.assertFalse(hasattr(client, "__dict__"))
+        self.assertFalse(hasattr(client.event_queue, "__dict__"))
+
+        # Equal event types and narrows are shared between clients,
+        # as are the narrow predicates.
+        self.assertIs(client.event_types, second_client.event_types)
+        self.assertIs(client.narrow, second_client.narrow)
+        self.assertIs(client.narrow_predicate, second_client.narrow_predicate)
+        self.assertEqual(client.to_dict()["narrow"], [["channel", "Denmark"]])
+        self.assertEqual(client.to_dict()["event_types"], ["message", "update_message"])
+
+        # Idle queues don't allocate a deque.
+        queue = client.event_queue
+        self.assertIs(queue.queue, second_client.event_queue.queue)
+        queue.push(dict(type="unknown", timestamp="1"))
+        self.assertIsNot(queue.queue, second_client.event_queue.queue)
+        self.verify_to_dict_end_to_end(client)
+        queue.prune(0)
+        self.assertIs(queue.queue, second_client.event_queue.queue)
+        self.assertTrue(queue.empty())
+        self.verify_to_dict_end_to_end(client)
+
+        # Nor dictionaries of virtual events, until they receive one.
+        self.assertIs(queue.virtual_events, second_client.event_queue.virtual_events)
+        queue.push(dict(type="presence", user_id=10, server_timestamp=1, presence={}))
+        self.assertEqual(list(queue.virtual_events), ["presence/10"])
+        self.assertEqual(second_client.event_queue.virtual_events, {})
+        self.verify_to_dict_end_to_end(client)
+        queue.contents()
+        self.assertIs(queue.virtual_events, second_client.event_queue.virtual_events)
+        self.assertIs(queue.virtual_event_sizes, second_client.event_queue.virtual_event_sizes)
+
+    def test_event_sizes_cached(self) -> None:
+        hamlet = self.example_user("hamlet")
+        clients = [self.get_client_descriptor() for _ in range(4)]
+        clients[0].slim_presence = True
+        clients[1].slim_presence = True
+        event = dict(
+            type="presence",
+            user_id=hamlet.id,
+            email=hamlet.email,
+            server_timestamp=1,
+            presence={},
+        )
+
+        # Only the slim and legacy variants of the event are sized, not
+        # each queue's copy of them.
+        with mock.patch("zerver.tornado.event_queue.orjson.dumps", wraps=orjson.dumps) as m:
+            process_notification(dict(event=event, users=[hamlet.id]))
+            self.assertEqual(m.call_count, 2)
+            self.assertGreater(clients[0].event_queue.queued_bytes, 0)
+
+            # Draining the queues doesn't size the events again.
+            for client in clients:
+                client.event_queue.prune(0)
+                self.assertEqual(client.event_queue.queued_bytes, 0)
+            self.assertEqual(m.call_count, 2)
+
+    def test_queued_bytes_after_coalescing(self) -> None:
+        client = self.get_client_descriptor()
+        queue = client.event_queue
+
+        presence_events = [
+            dict(type="presence", user_id=10, server_timestamp=i, presence={"website": i})
+            for i in range(50)
+        ]
+        other_event = dict(type="unknown", timestamp="1")
+        remove_event = dict(type="realm_user", op="remove", person=dict(user_id=10))
+        last_presence_event = dict(type="presence", user_id=10, server_timestamp=50, presence={})
+        for event in presence_events:
+            queue.push(event)
+        queue.push(other_event)
+        # Removing the user delivers the coalesced presence event first.
+        queue.push(remove_event)
+        queue.push(last_presence_event)
+        self.assertEqual([queued_event_id(event) for event in queue.queue], [50, 51, 52])
+        self.assertEqual(list(queue.virtual_events), ["presence/10"])
+
+        # The coalesced event is counted at the total size of the
+        # events merged into it.
+        presence_bytes = sum(get_event_size(event) for event in presence_events)
+        self.assertEqual(list(queue.event_sizes)[1], presence_bytes)
+        self.assertEqual(
+            queue.queued_bytes,
+            get_event_size(other_event)
+            + presence_bytes
+            + get_event_size(remove_event)
+            + get_event_size(last_presence_event),
+        )
+        self.verify_to_dict_end_to_end(client)
+
+        # Pruning subtracts the stored sizes, without sizing the
+        # pruned events again.
+        with mock.patch("zerver.tornado.event_queue.orjson.dumps") as m:
+            queue.prune(51)
+        m.assert_not_called()
+        self.assertFalse(queue.empty())
+        self.assertEqual(
+            queue.queued_bytes, get_event_size(remove_event) + get_event_size(last_presence_event)
+        )
+        self.verify_to_dict_end_to_end(client)
+
+        queue.contents()
+        queue.prune(53)
+        self.assertTrue(queue.empty())
+        self.assertEqual(queue.queued_bytes, 0)
+
+    def test_queue_size_limits(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.get_client_descriptor()
+        queue_id = client.event_queue.id
+
+        def send_event(size: int) -> None:
+            process_notification(dict(event=dict(type="unknown", x="x" * size), users=[hamlet.id]))
+
+        with self.settings(EVENT_QUEUE_MAX_EVENTS=3, EVENT_QUEUE_MAX_BYTES=1000):
+            for _ in range(3):
+                send_event(10)
+            self.assertEqual(access_client_descriptor(hamlet.id, queue_id), client)
+            self.assertGreater(client.event_queue.queued_bytes, 30)
+
+            # Pruning the events the client has received frees up
+            # space in the queue.
+            client.event_queue.prune(2)
+            self.assertEqual(client.event_queue.queued_bytes, 0)
+            for _ in range(3):
+                send_event(10)
+
+            # The queue is garbage-collected once it overflows, so that
+            # the client gets a BAD_EVENT_QUEUE_ID error and reloads.
+            with self.assertLogs(level="INFO") as logs:
+                send_event(10)
+            self.assertIn(
+                f"Event queue {queue_id} ({hamlet.id} via website) exceeded", logs.output[0]
+            )
+            self.assertTrue(client.overflowed)
+            with self.assertRaises(BadEventQueueIdError):
+                access_client_descriptor(hamlet.id, queue_id)
+
+            # Large events count towards the byte limit.
+            client = self.get_client_descriptor()
+            with self.assertLogs(level="INFO"):
+                send_event(2000)
+            self.assertTrue(client.overflowed)
+            self.assertEqual(get_client_descriptors_for_user(hamlet.id), [])
+
+    def test_shared_message_payload(self) -> None:
+        client = self.get_client_descriptor()
+        second_client = self.get_client_descriptor()
+        othello_client = self.get_client_descriptor("othello")
+
+        self.send_stream_message(self.example_user("iago"), "Denmark")
+
+        # Both queues store a reference to the same payload, rather
+        # than their own copy of the event.
+        (entry,) = client.event_queue.queue
+        (second_entry,) = second_client.event_queue.queue
+        assert isinstance(entry, QueuedMessageEvent)
+        assert isinstance(second_entry, QueuedMessageEvent)
+        self.assertIs(entry.payload, second_entry.payload)
+        self.assertIsNotNone(entry.internal_data)
+        self.verify_to_dict_end_to_end(client)
+
+        # Neither user would be notified, so their identical internal
+        # data is shared as well.
+        (othello_entry,) = othello_client.event_queue.queue
+        assert isinstance(othello_entry, QueuedMessageEvent)
+        self.assertIs(othello_entry.internal_data, entry.internal_data)
+
+        (event,) = client.event_queue.contents()
+        self.assertEqual(event["type"], "message")
+        self.assertEqual(event["id"], 0)
+        self.assertEqual(event["flags"], [])
+        self.assertEqual(event["message"]["sender_id"], self.example_user("iago").id)
+        self.assertNotIn("internal_data", event)
+        self.assertNotIn("local_message_id", event)
+
+        (event,) = client.event_queue.contents(include_internal_data=True)
+        self.assertIn("internal_data", event)
+
+        client.event_queue.prune(0)
+        self.assertTrue(client.event_queue.empty())
+        self.assertEqual(client.event_queue.newest_pruned_id, 0)
+
+    def test_preserialized_message_payload(self) -> None:
+        client = self.get_client_descriptor()
+        second_client = self.get_client_descriptor()
+
+        self.send_stream_message(self.example_user("iago"), "Denmark")
+
+        (event,) = client.event_queue.contents(preserialized=True)
+        self.assertIsInstance(event["message"], orjson.Fragment)
+        (raw_event,) = client.event_queue.contents()
+        self.assertEqual(orjson.loads(orjson.dumps(event)), raw_event)
+
+        # The payload is encoded only once, no matter how many
+        # clients it is returned to.
+        (second_event,) = second_client.event_queue.contents(preserialized=True)
+        self.assertIs(second_event["message"], event["message"])
@@ -1,5 +1,6 @@
 import time
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from typing import Any
 from unittest import mock
 from urllib.parse import urlsplit
@@ -8,6 +9,7 @@ import orjson
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from django.test import override_settings
+from django.utils import translation
 from django.utils.timezone import now as timezone_now
 from typing_extensions import override
 
@@ -18,10 +20,13 @@ from zerver.actions.presence import do_update_user_presence
 from zerver.actions.streams import do_change_stream_folder
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_change_user_role
+from zerver.lib import fetch_plan
 from zerver.lib.event_schema import check_web_reload_client_event
 from zerver.lib.events import fetch_initial_state_data, post_process_state
 from zerver.lib.exceptions import AccessDeniedError
+from zerver.lib.fetch_plan import FetchPlan, get_section_times
 from zerver.lib.request import RequestVariableMissingError
+from zerver.lib.response import AsynchronousResponse
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import (
     HostRequestMock,
@@ -38,8 +43,11 @@ from zerver.models.users import get_system_bot
 from zerver.tornado.event_queue import (
     allocate_client_descriptor,
     clear_client_event_queues_for_testing,
+    export_user_event_queues,
     get_client_info_for_message_event,
+    import_event_queues,
     mark_clients_to_reload,
+    migrated_user_ports,
     process_message_event,
     send_web_reload_client_events,
 )
@@ -312,6 +320,97 @@ class EventsEndpointTest(ZulipTestCase):
         self.assert_json_success(result)
         self.assertEqual(orjson.loads(result.content)["sent_events"], 0)
 
+    def test_tornado_metrics(self) -> None:
+        hamlet = self.example_user("hamlet")
+        allocate_client_descriptor(
+            dict(
+                user_profile_id=hamlet.id,
+                realm_id=hamlet.realm_id,
+                event_types=None,
+                client_type_name="website",
+                apply_markdown=True,
+                client_gravatar=True,
+                slim_presence=True,
+                all_public_streams=False,
+                queue_timeout=600,
+                last_connection_time=time.time(),
+                narrow=[],
+            )
+        )
+        self.send_personal_message(self.example_user("othello"), hamlet)
+
+        result = self.client_get("/api/internal/tornado/metrics")
+        self.assertEqual(result.status_code, 200)
+        metrics = result.content.decode()
+        self.assertIn("zulip_tornado_event_queues 1.0", metrics)
+        self.assertIn('zulip_tornado_events_pushed_total{event_type="message"}', metrics)
+        self.assertIn("zulip_tornado_message_fanout_queues_count", metrics)
+        self.assertIn(
+            'zulip_tornado_notification_processing_seconds_count{event_type="message"}', metrics
+        )
+
+        result = self.client_get("/api/internal/tornado/metrics", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(result.status_code, 403)
+
+    def test_migrate_event_queue_endpoints(self) -> None:
+        # Minimal testing of the endpoints used by
+        # migrate_tornado_event_queues, which are otherwise tested in
+        # test_event_queue.
+        hamlet = self.example_user("hamlet")
+        client = allocate_client_descriptor(
+            dict(
+                user_profile_id=hamlet.id,
+                realm_id=hamlet.realm_id,
+                event_types=None,
+                client_type_name="website",
+                apply_markdown=True,
+                client_gravatar=True,
+                slim_presence=True,
+                all_public_streams=False,
+                queue_timeout=600,
+                last_connection_time=time.time(),
+                narrow=[],
+            )
+        )
+
+        def post(url: str, post_data: dict[str, Any]) -> dict[str, Any]:
+            req = HostRequestMock(
+                {**post_data, "secret": settings.SHARED_SECRET}, tornado_handler=dummy_handler
+            )
+            req.META["REMOTE_ADDR"] = "127.0.0.1"
+            result = self.client_post_request(url, req)
+            return self.assert_json_success(result)
+
+        queues = post(
+            "/api/internal/tornado/export_event_queues",
+            {"user_ids": orjson.dumps([hamlet.id]).decode(), "target_port": "9801"},
+        )["queues"]
+        self.assertEqual([queue["event_queue"]["id"] for queue in queues], [client.event_queue.id])
+        result = post("/api/internal/tornado/forward_migration_notices", {"target_port": "9801"})
+        self.assertEqual(result["forwarded"], 0)
+        result = post(
+            "/api/internal/tornado/import_event_queues",
+            {
+                "user_ids": orjson.dumps([hamlet.id]).decode(),
+                "queues": orjson.dumps(queues).decode(),
+            },
+        )
+        self.assertEqual(result["imported"], 1)
+
+        queues = post(
+            "/api/internal/tornado/export_event_queues",
+            {"user_ids": orjson.dumps([hamlet.id]).decode(), "target_port": "9801"},
+        )["queues"]
+        result = post(
+            "/api/internal/tornado/cancel_event_queue_migration",
+            {
+                "user_ids": orjson.dumps([hamlet.id]).decode(),
+                "target_port": "9801",
+                "queues": orjson.dumps(queues).decode(),
+            },
+        )
+        self.assertEqual(result["processed"], 0)
+
 
 class GetEventsTest(ZulipTestCase):
     def tornado_call(
@@ -323,6 +422,70 @@ class GetEventsTest(ZulipTestCase):
         request = HostRequestMock(post_data, user_profile, tornado_handler=dummy_handler)
         return view_func(request, user_profile)
 
+    def test_get_events_during_queue_migration(self) -> None:
+        # Until sharding.json is updated, hamlet stays assigned to port
+        # 9800, which has migrated his event queues to port 9801.
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+
+        @contextmanager
+        def on_port(port: int) -> Iterator[None]:
+            with (
+                mock.patch("zerver.tornado.views.get_user_tornado_port", return_value=9800),
+                mock.patch("zerver.tornado.views.get_current_port", return_value=port),
+                mock.patch("zerver.tornado.views.is_current_port", side_effect=lambda p: p == port),
+            ):
+                yield
+
+        def get_events_on_port(port: int, post_data: dict[str, Any]) -> HttpResponse:
+            with on_port(port):
+                return self.tornado_call(get_events, hamlet, post_data)
+
+        def get_events_internal_on_port(port: int, post_data: dict[str, Any]) -> HttpResponse:
+            req = HostRequestMock(
+                {**post_data, "user_profile_id": hamlet.id, "secret": settings.SHARED_SECRET},
+                tornado_handler=dummy_handler,
+            )
+            req.META["REMOTE_ADDR"] = "127.0.0.1"
+            with on_port(port):
+                return self.client_post_request("/api/v1/events/internal", req)
+
+        result = get_events_on_port(
+            9800,
+            {
+                "apply_markdown": "true",
+                "client_gravatar": "true",
+                "user_client": "website",
+                "dont_block": "true",
+            },
+        )
+        queue_id = self.assert_json_success(result)["queue_id"]
+        exported = export_user_event_queues([hamlet.id], 9801)
+        poll_data = {
+            "queue_id": queue_id,
+            "user_client": "website",
+            "last_event_id": -1,
+            "dont_block": "true",
+        }
+
+        # Port 9800 sends the user's requests along to port 9801.
+        result = get_events_on_port(9800, poll_data)
+        self.assertTrue(result["X-Accel-Redirect"].startswith("/internal/tornado/9801/"))
+        with mock.patch("zerver.tornado.views.start_forwarding_events_request") as forward:
+            result = get_events_internal_on_port(9800, poll_data)
+        self.assertIsInstance(result, AsynchronousResponse)
+        forward.assert_called_once()
+        self.assertEqual(forward.call_args[0][1], "http://127.0.0.1:9801/api/v1/events/internal")
+
+        # Port 9801 serves them itself, rather than redirecting them
+        # back to port 9800.
+        with mock.patch.dict(migrated_user_ports, clear=True):
+            import_event_queues([hamlet.id], exported)
+            result = get_events_on_port(9801, poll_data)
+            self.assertEqual(self.assert_json_success(result)["queue_id"], queue_id)
+            result = get_events_internal_on_port(9801, poll_data)
+            self.assertEqual(self.assert_json_success(result)["queue_id"], queue_id)
+
     def test_get_events(self) -> None:
         user_profile = self.example_user("hamlet")
         email = user_profile.email
@@ -1314,6 +1477,61 @@ class FetchQueriesTest(ZulipTestCase):
                 fetch_initial_state_data(user, realm=user.realm, event_types=event_types)
 
 
+class FetchPlanTest(ZulipTestCase):
+    @override_settings(FETCH_PLAN_THREADS=3)
+    def test_fetch_plan(self) -> None:
+        plan = FetchPlan()
+        plan.add("hamlet", lambda: self.example_user("hamlet").id)
+        plan.add("othello", lambda: self.example_user("othello").id)
+        plan.add(
+            "both",
+            lambda: [plan.result("hamlet"), plan.result("othello")],
+            after=["hamlet", "othello"],
+        )
+
+        # Sections can only depend on sections added before them.
+        with self.assertRaises(AssertionError):
+            plan.add("cordelia", lambda: None, after=["missing"])
+
+        # Tests run in a transaction, which the other threads' database
+        # connections couldn't see, so the sections are run in order.
+        plan.run()
+        self.assertEqual(
+            plan.result("both"), [self.example_user("hamlet").id, self.example_user("othello").id]
+        )
+        self.assertEqual(set(get_section_times()), {"hamlet", "othello", "both"})
+
+    @override_settings(FETCH_PLAN_THREADS=3)
+    def test_run_concurrently(self) -> None:
+        def fail() -> None:
+            raise ValueError("failed")
+
+        # Sections which don't use the database can run on the threads
+        # even inside the test's transaction.
+        with mock.patch("zerver.lib.fetch_plan.executor", None):
+            plan = FetchPlan()
+            plan.add("number", lambda: 2)
+            plan.add("language", translation.get_language)
+            plan.add("double", lambda: plan.result("number") * 2, after=["number"])
+            with translation.override("de"):
+                plan.run_concurrently()
+            self.assertEqual(plan.result("double"), 4)
+            # The sections run in the language of the request.
+            self.assertEqual(plan.result("language"), "de")
+            self.assertEqual(set(get_section_times()), {"number", "language", "double"})
+
+            # An exception in a section is raised by run_concurrently.
+            plan = FetchPlan()
+            plan.add("number", lambda: 2)
+            plan.add("fail", fail, after=["number"])
+            with self.assertRaisesRegex(ValueError, "failed"):
+                plan.run_concurrently()
+            self.assertNotIn("fail", plan.results)
+
+            assert fetch_plan.executor is not None
+            fetch_plan.executor.shutdown()
+
+
 class TestEventsRegisterAllPublicStreamsDefaults(ZulipTestCase):
     @override
     def setUp(self) -> None:
@@ -1683,13 +1683,13 @@ class NormalActionsTest(BaseAction):
         topic_name = "editing"
         with self.verify_action(state_change_expected=False) as events:
             do_send_stream_message_edit_typing_notification(
-                self.user_profile, channel.id, msg_id, "start", topic_name
+                self.user_profile, channel.recipient, msg_id, "start", topic_name
             )
         check_typing_edit_channel_message_start("events[0]", events[0])
 
         with self.verify_action(state_change_expected=False) as events:
             do_send_stream_message_edit_typing_notification(
-                self.user_profile, channel.id, msg_id, "stop", topic_name
+                self.user_profile, channel.recipient, msg_id, "stop", topic_name
             )
         check_typing_edit_channel_message_stop("events[0]", events[0])
 
@@ -25,7 +25,7 @@ from zerver.lib.rate_limiter import (
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import dns_txt_answer, ratelimit_rule
 from zerver.lib.zephyr import compute_mit_user_fullname
-from zerver.models import PushDeviceToken, UserProfile
+from zerver.models import Message, PushDeviceToken, UserProfile
 
 if settings.ZILENCER_ENABLED:
     from zilencer.models import RateLimitedRemoteZulipServer, RemoteZulipServer
@@ -193,6 +193,33 @@ class RateLimitTests(ZulipTestCase):
 
         self.do_test_hit_ratelimits(lambda: self.send_api_message(user, "some stuff"))
 
+    @ratelimit_rule(60, 5, domain="api_by_user")
+    def test_bulk_send_ratelimited_per_message(self) -> None:
+        user = self.example_user("cordelia")
+        RateLimitedUser(user).clear_history()
+        message = dict(type="channel", to="Verona", topic="whatever", content="some stuff")
+
+        def send_bulk(count: int) -> "TestHttpResponse":
+            return self.api_post(
+                user,
+                "/api/v1/messages/bulk",
+                {"messages": orjson.dumps([message] * count).decode()},
+            )
+
+        # Each message counts as an API call.
+        result = send_bulk(3)
+        self.assert_json_success(result)
+        self.assertEqual(result["X-RateLimit-Remaining"], "2")
+
+        message_count = Message.objects.count()
+        result = send_bulk(3)
+        self.assertEqual(result.status_code, 429)
+        self.assertEqual(Message.objects.count(), message_count)
+
+        # The rejected request was still charged as one call.
+        self.assert_json_success(send_bulk(1))
+        self.assertEqual(send_bulk(1).status_code, 429)
+
     @ratelimit_rule(1, 5, domain="email_change_by_user")
     def test_hit_change_email_ratelimit_as_user(self) -> None:
         user = self.example_user("cordelia")
@@ -1,11 +1,18 @@
 import os
 import re
+import signal
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from html import escape
 from textwrap import dedent
 from typing import Any
 from unittest import mock
 
+import bmemcached
 import orjson
+import re2
 import requests
 import responses
 from bs4 import BeautifulSoup
@@ -25,7 +32,7 @@ from zerver.actions.user_groups import (
     check_add_user_group,
     do_deactivate_user_group,
 )
-from zerver.actions.user_settings import do_change_user_setting
+from zerver.actions.user_settings import do_change_full_name, do_change_user_setting
 from zerver.actions.users import change_user_is_active
 from zerver.lib.alert_words import get_alert_word_automaton
 from zerver.lib.camo import get_camo_url
@@ -36,8 +43,11 @@ from zerver.lib.exceptions import JsonableError, MarkdownRenderingError
 from zerver.lib.markdown import (
     POSSIBLE_EMOJI_RE,
     InlineInterestingLinkProcessor,
+    LinkifierMatcher,
+    MarkdownEnginePool,
     MarkdownListPreprocessor,
     MessageRenderingResult,
+    ZulipMarkdown,
     clear_web_link_regex_for_testing,
     content_has_emoji_syntax,
     fetch_tweet_data,
@@ -46,12 +56,20 @@ from zerver.lib.markdown import (
     markdown_convert,
     maybe_update_markdown_engines,
     possible_linked_stream_names,
+    possible_tex_spans,
     render_message_markdown,
     topic_links,
     url_embed_preview_enabled,
     url_to_a,
 )
 from zerver.lib.markdown.fenced_code import FencedBlockPreprocessor
+from zerver.lib.markdown.render_pool import (
+    MarkdownRenderingPool,
+    MarkdownRenderRequest,
+    MarkdownRenderResult,
+    init_render_worker,
+    render_batch,
+)
 from zerver.lib.mdiff import diff_strings
 from zerver.lib.mention import (
     FullNameInfo,
@@ -67,11 +85,19 @@ from zerver.lib.mention import (
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.streams import user_has_content_access, user_has_metadata_access
 from zerver.lib.test_classes import ZulipTestCase
-from zerver.lib.tex import render_tex
+from zerver.lib.tex import render_tex, tex_cache
 from zerver.lib.types import UserGroupMembersData
 from zerver.lib.upload import upload_message_attachment
 from zerver.lib.user_groups import UserGroupMembershipDetails
-from zerver.models import Message, NamedUserGroup, RealmEmoji, RealmFilter, UserMessage, UserProfile
+from zerver.models import (
+    Message,
+    NamedUserGroup,
+    Realm,
+    RealmEmoji,
+    RealmFilter,
+    UserMessage,
+    UserProfile,
+)
 from zerver.models.clients import get_client
 from zerver.models.groups import SystemGroups
 from zerver.models.linkifiers import linkifiers_for_realm
@@ -217,6 +243,21 @@ def markdown_convert_wrapper(content: str) -> str:
     ).rendered_content
 
 
+def render_batch_without_database(
+    requests: list[MarkdownRenderRequest], timeout: float | None
+) -> list[MarkdownRenderResult]:
+    # Stands in for render_batch in MarkdownRenderingPool's workers,
+    # which can't use the test's database transaction.
+    if any(request.content == "fail" for request in requests):
+        raise ValueError("failed")
+    return [
+        MarkdownRenderResult(
+            key=request.key, rendered_content=f"{threading.get_ident()}:{request.content}"
+        )
+        for request in requests
+    ]
+
+
 class MarkdownMiscTest(ZulipTestCase):
     def test_diffs_work_as_expected(self) -> None:
         str1 = "<p>The quick brown fox jumps over the lazy dog.  Animal stories are fun, yeah</p>"
@@ -474,7 +515,73 @@ class MarkdownMiscTest(ZulipTestCase):
                 body="<i>html</i>",
                 content_type="text/html; charset=utf-8",
             )
-            self.assertEqual(render_tex("foo"), "<i>html</i>")
+            self.assertEqual(render_tex("bar"), "<i>html</i>")
+
+    @responses.activate
+    @override_settings(KATEX_SERVER=True, SHARED_SECRET="foo")
+    def test_katex_server_batch(self) -> None:
+        self.assertEqual(
+            possible_tex_spans("$$x$$ and $$y$$\n\n```math\na\n\nb\n```\n$$x$$"),
+            [("x", True), ("y", True), ("x", True), ("a", False), ("b", False)],
+        )
+
+        responses.post(
+            "http://localhost:9700/batch",
+            match=[
+                matchers.json_params_matcher(
+                    {
+                        "batch": [
+                            {"content": "x", "is_display": False},
+                            {"content": "y", "is_display": False},
+                            {"content": "a", "is_display": True},
+                            {"content": "b", "is_display": True},
+                        ],
+                        "shared_secret": "foo",
+                    }
+                )
+            ],
+            json={"results": ["<i>x</i>", "<i>y</i>\n", "<i>a</i>", None]},
+        )
+        # The formula which failed in the batch is retried on its own.
+        responses.post(
+            "http://localhost:9700/",
+            match=[
+                matchers.urlencoded_params_matcher(
+                    {"content": "b", "is_display": "true", "shared_secret": "foo"}
+                )
+            ],
+            content_type="text/html; charset=utf-8",
+            status=400,
+            body=r"KaTeX parse error: &#39;\&#39;",
+        )
+        rendered = markdown_convert_wrapper("$$x$$ and $$y$$\n\n```math\na\n\nb\n```\n$$x$$")
+        self.assertEqual(len(responses.calls), 2)
+        self.assertIn("<p><i>x</i> and <i>y</i></p>", rendered)
+        self.assertIn("<i>a</i>", rendered)
+        self.assertIn('<span class="tex-error">b</span>', rendered)
+        self.assertEqual(tex_cache[("y", True)], "<i>y</i>")
+        self.assertNotIn(("b", False), tex_cache)
+
+        # Formulas which are already cached, or a lone formula, are
+        # not sent in a batch.
+        responses.post(
+            "http://localhost:9700/",
+            content_type="text/html; charset=utf-8",
+            body="<i>z</i>",
+        )
+        self.assertEqual(markdown_convert_wrapper("$$x$$ $$z$$"), "<p><i>x</i> <i>z</i></p>")
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(responses.calls[2].request.url, "http://localhost:9700/")
+
+        responses.post("http://localhost:9700/batch", status=500, body="")
+        with self.assertLogs(level="WARNING") as m:
+            self.assertEqual(markdown_convert_wrapper("$$v$$ $$w$$"), "<p><i>z</i> <i>z</i></p>")
+        self.assertEqual(m.output, ["WARNING:root:KaTeX batch rendering failed: (500) "])
+
+        responses.post("http://localhost:9700/batch", body=requests.exceptions.ConnectionError())
+        with self.assertLogs(level="WARNING") as m:
+            self.assertEqual(markdown_convert_wrapper("$$s$$ $$t$$"), "<p><i>z</i> <i>z</i></p>")
+        self.assertEqual(m.output, ["WARNING:root:KaTeX batch rendering failed: ConnectionError"])
 
 
 class MarkdownListPreprocessorTest(ZulipTestCase):
@@ -1867,6 +1974,66 @@ class MarkdownLinkifierTest(ZulipTestCase):
         for index, cur_order in enumerate(sorted(order_values)):
             self.assertEqual(linkifiers[index]["id"], order_to_id[cur_order])
 
+    def test_linkifier_matcher(self) -> None:
+        matcher = LinkifierMatcher(
+            (
+                (r"#(?P<id>[0-9]+)", "https://trac.example.com/ticket/{id}"),
+                (r"(?P<id>[a-z+", "https://invalid.example.com/{id}"),
+                (r"ZUL-(?P<id>[0-9]+)", "https://jira.example.com/{id}"),
+                (r"#(?P<id>[0-9]+)-(?P<part>[a-z]+)", "https://trac.example.com/{id}/{part}"),
+            )
+        )
+        self.assertIsNone(matcher.patterns[1])
+        self.assertEqual(matcher.candidates("nothing to see"), frozenset())
+        self.assertEqual(matcher.candidates("fixes #12 and ZUL-3"), {0, 2})
+        self.assertEqual(matcher.candidates("see #12-abc"), {0, 3})
+        self.assertIsNone(matcher.search(2, "see #12-abc"))
+        match = matcher.search(3, "see #12-abc")
+        assert match is not None
+        self.assertEqual(match.group("part"), "abc")
+        self.assertEqual(
+            [m.group("id") for m in matcher.finditer(0, "#1, #2-ab and ZUL-3")], ["1", "2"]
+        )
+        self.assertEqual(list(matcher.finditer(2, "nothing to see")), [])
+
+        # A set of this many linkifiers needs more than re2's default
+        # memory budget to compile.
+        many_linkifiers = tuple(
+            (rf"PROJ{i}-(?P<id>[0-9]+)", f"https://tickets.example.com/proj{i}/{{id}}")
+            for i in range(300)
+        )
+        matcher = LinkifierMatcher(many_linkifiers)
+        self.assertIsNotNone(matcher.candidate_set)
+        self.assertEqual(matcher.candidates("PROJ250-1 and PROJ7-2"), {7, 250})
+
+        with mock.patch("re2.Set.Compile", side_effect=re2.error("Set too large")):
+            matcher = LinkifierMatcher(many_linkifiers)
+        self.assertIsNone(matcher.candidate_set)
+        self.assertEqual(len(matcher.candidates("nothing to see")), 300)
+
+        # Realms with many linkifiers render just as before.
+        realm = get_realm("zulip")
+        RealmFilter.objects.filter(realm=realm).delete()
+        for i in range(100):
+            RealmFilter(
+                realm=realm,
+                pattern=rf"PROJ{i}-(?P<id>[0-9]+)",
+                url_template=f"https://tickets.example.com/proj{i}/{{id}}",
+            ).save()
+        content = "PROJ7-12 and PROJ42-3, but not PROJ100-1"
+        self.assertEqual(
+            markdown_convert(content, message_realm=realm).rendered_content,
+            '<p><a href="https://tickets.example.com/proj7/12">PROJ7-12</a> and '
+            '<a href="https://tickets.example.com/proj42/3">PROJ42-3</a>, but not PROJ100-1</p>',
+        )
+        self.assertEqual(
+            topic_links(realm.id, content),
+            [
+                {"url": "https://tickets.example.com/proj7/12", "text": "PROJ7-12"},
+                {"url": "https://tickets.example.com/proj42/3", "text": "PROJ42-3"},
+            ],
+        )
+
     def test_realm_patterns_negative(self) -> None:
         realm = get_realm("zulip")
         RealmFilter(
@@ -1943,6 +2110,226 @@ class MarkdownLinkifierTest(ZulipTestCase):
                 [{"id": linkifier.id, "pattern": "whatever", "url_template": "whatever"}],
             )
 
+    def test_markdown_engine_pool(self) -> None:
+        zulip_realm = get_realm("zulip")
+        lear_realm = get_realm("lear")
+        zephyr_realm = get_realm("zephyr")
+        RealmFilter.objects.all().delete()
+        RealmFilter(
+            realm=zulip_realm,
+            pattern=r"#(?P<id>[0-9]+)",
+            url_template=r"https://trac.example.com/ticket/{id}",
+        ).save()
+        linked = '<p><a href="https://trac.example.com/ticket/123">#123</a></p>'
+
+        def render(realm: Realm, email_gateway: bool = False) -> str:
+            return markdown_convert(
+                "#123", message_realm=realm, email_gateway=email_gateway
+            ).rendered_content
+
+        pool = MarkdownEnginePool(2)
+        with mock.patch("zerver.lib.markdown.md_engines", pool):
+            self.assertEqual(render(zulip_realm), linked)
+            zulip_engine = pool.engines[(zulip_realm.id, False)]
+            self.assertEqual(render(zulip_realm), linked)
+            self.assertEqual(render(lear_realm), "<p>#123</p>")
+            self.assertEqual((pool.hits, pool.misses, pool.evictions), (1, 2, 0))
+
+            # The least recently used engine is evicted, and its
+            # processors are reused with the new realm's linkifiers.
+            self.assertEqual(render(zephyr_realm), "<p>#123</p>")
+            self.assertEqual((pool.hits, pool.misses, pool.evictions), (1, 3, 1))
+            self.assertNotIn((zulip_realm.id, False), pool)
+            self.assertIs(pool.engines[(zephyr_realm.id, False)], zulip_engine)
+            self.assert_length(pool, 2)
+
+            self.assertEqual(render(zulip_realm), linked)
+            self.assertEqual((pool.hits, pool.misses, pool.evictions), (1, 4, 2))
+            self.assertNotIn((lear_realm.id, False), pool)
+
+            # Engines of the other email gateway flavor are not reused.
+            render(lear_realm, email_gateway=True)
+            self.assertIsNot(pool.engines[(lear_realm.id, True)], zulip_engine)
+
+            # Changed linkifiers are swapped into the existing engine.
+            RealmFilter.objects.filter(realm=zulip_realm).delete()
+            flush_per_request_caches()
+            zulip_engine = pool.engines[(zulip_realm.id, False)]
+            self.assertEqual(render(zulip_realm), "<p>#123</p>")
+            self.assertIs(pool.engines[(zulip_realm.id, False)], zulip_engine)
+            self.assertEqual(pool.hits, 2)
+
+    @override_settings(CACHE_RENDERED_MARKDOWN=True)
+    def test_rendered_markdown_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        realm = hamlet.realm
+        RealmFilter.objects.filter(realm=realm).delete()
+        content = (
+            "Deploy of #123 to production by @**Othello, the Moor of Venice** failed: "
+            "https://example.com"
+        )
+
+        def render() -> MessageRenderingResult:
+            msg = Message(sender=hamlet, sending_client=get_client("test"), realm=realm)
+            rendering_result = render_message_markdown(
+                msg, content, realm_alert_words_automaton=get_alert_word_automaton(realm)
+            )
+            self.assertTrue(msg.has_link)
+            return rendering_result
+
+        expected = render()
+        self.assertEqual(expected.mentions_user_ids, {othello.id})
+        self.assertEqual(expected.user_ids_with_alert_words, set())
+
+        with mock.patch.object(ZulipMarkdown, "convert") as convert:
+            rendering_result = render()
+        convert.assert_not_called()
+        self.assertEqual(rendering_result, expected)
+
+        # Alert words are checked afresh for cached renderings.
+        do_add_alert_words(othello, ["production"])
+        with mock.patch.object(ZulipMarkdown, "convert") as convert:
+            rendering_result = render()
+        convert.assert_not_called()
+        self.assertEqual(rendering_result.user_ids_with_alert_words, {othello.id})
+
+        # Changing the realm's linkifiers or the mentioned users changes
+        # the cache key, so the content is rendered again.
+        RealmFilter(
+            realm=realm,
+            pattern=r"#(?P<id>[0-9]+)",
+            url_template=r"https://trac.example.com/ticket/{id}",
+        ).save()
+        self.assertIn('href="https://trac.example.com/ticket/123"', render().rendered_content)
+        do_change_full_name(othello, "Othello", acting_user=None)
+        self.assertEqual(render().mentions_user_ids, set())
+
+        # As does changing the realm's default code block language.
+        def render_code_block() -> str:
+            msg = Message(sender=hamlet, sending_client=get_client("test"), realm=realm)
+            return render_message_markdown(msg, "```\nprint(1)\n```").rendered_content
+
+        self.assertNotIn("data-code-language", render_code_block())
+        do_set_realm_property(realm, "default_code_block_language", "python", acting_user=None)
+        self.assertIn('data-code-language="Python"', render_code_block())
+
+        # Messages whose rendering depends on URL previews are not cached.
+        msg = Message(sender=hamlet, sending_client=get_client("test"), realm=realm)
+        with mock.patch("zerver.lib.markdown.cache_get") as cache_get:
+            render_message_markdown(msg, content, url_embed_data={})
+        cache_get.assert_not_called()
+
+    def test_markdown_rendering_pool(self) -> None:
+        realm = get_realm("zulip")
+        render_requests = [
+            MarkdownRenderRequest(key=i, content=f"**message {i}**", realm_id=realm.id)
+            for i in range(5)
+        ]
+        render_requests.append(MarkdownRenderRequest(key=5, content=":)", realm_id=realm.id))
+        render_requests.append(
+            MarkdownRenderRequest(key=6, content=":)", realm_id=realm.id, translate_emoticons=True)
+        )
+        with MarkdownRenderingPool(processes=1, realm_ids=[realm.id], batch_size=2) as pool:
+            results = {
+                result.key: result.rendered_content for result in pool.render(render_requests)
+            }
+        self.assertEqual(
+            results,
+            {
+                **{i: f"<p><strong>message {i}</strong></p>" for i in range(5)},
+                5: "<p>:)</p>",
+                6: (
+                    '<p><span aria-label="slight smile" class="emoji emoji-1f642" role="img"'
+                    ' title="slight smile">:slight_smile:</span></p>'
+                ),
+            },
+        )
+
+        with (
+            mock.patch("zerver.lib.markdown.render_pool.markdown_convert", side_effect=Exception),
+            MarkdownRenderingPool(processes=1) as pool,
+        ):
+            self.assertEqual(
+                list(pool.render(render_requests[:1])),
+                [MarkdownRenderResult(key=0, rendered_content=None)],
+            )
+
+    def test_markdown_rendering_pool_processes(self) -> None:
+        realm = get_realm("zulip")
+        render_requests = [
+            MarkdownRenderRequest(key=i, content=f"message {i}", realm_id=realm.id)
+            for i in range(9)
+        ]
+        memcached = mock.Mock(spec=bmemcached.Client)
+
+        def thread_pool(
+            max_workers: int, mp_context: Any, initializer: Callable[[], None]
+        ) -> ThreadPoolExecutor:
+            # The test runner's processes are daemonic, and so can't
+            # start worker processes; threads stand in for them.
+            self.assertEqual(mp_context.get_start_method(), "fork")
+            self.assertIs(initializer, init_render_worker)
+            return ThreadPoolExecutor(max_workers)
+
+        with (
+            mock.patch("zerver.lib.markdown.render_pool.ProcessPoolExecutor", thread_pool),
+            mock.patch(
+                "zerver.lib.markdown.render_pool.render_batch", render_batch_without_database
+            ),
+            mock.patch("zerver.lib.markdown.render_pool.connection") as connection,
+            mock.patch("zerver.lib.markdown.render_pool.cache", mock.Mock(_cache=memcached)),
+        ):
+            # More batches than the pool keeps in flight at once.
+            with MarkdownRenderingPool(processes=2, batch_size=2) as pool:
+                results = {
+                    result.key: result.rendered_content for result in pool.render(render_requests)
+                }
+            self.assertIsNone(pool.executor)
+            # The workers don't share the connections of this process.
+            connection.close.assert_called_once()
+            memcached.disconnect_all.assert_called_once()
+
+            self.assertEqual(set(results), set(range(9)))
+            for key, rendered_content in results.items():
+                assert rendered_content is not None
+                thread_id, content = rendered_content.split(":")
+                self.assertNotEqual(int(thread_id), threading.get_ident())
+                self.assertEqual(content, f"message {key}")
+
+            # Errors in the workers are raised by render.
+            with (
+                self.assertRaisesRegex(ValueError, "failed"),
+                MarkdownRenderingPool(processes=2, batch_size=1) as pool,
+            ):
+                list(pool.render([*render_requests, MarkdownRenderRequest(1, "fail", realm.id)]))
+            self.assertIsNone(pool.executor)
+
+    def test_markdown_rendering_timeout(self) -> None:
+        realm = get_realm("zulip")
+        old_handler = signal.getsignal(signal.SIGALRM)
+        self.addCleanup(signal.signal, signal.SIGALRM, old_handler)
+        init_render_worker()
+
+        # In the worker processes, the alarm interrupts rendering that
+        # takes too long.
+        with mock.patch(
+            "zerver.lib.markdown.render_pool.markdown_convert",
+            side_effect=lambda **kwargs: time.sleep(10),
+        ):
+            results = render_batch(
+                [MarkdownRenderRequest(key=0, content="slow", realm_id=realm.id)], timeout=0.01
+            )
+        self.assertEqual(results, [MarkdownRenderResult(key=0, rendered_content=None)])
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+        results = render_batch(
+            [MarkdownRenderRequest(key=1, content="**fast**", realm_id=realm.id)], timeout=10
+        )
+        self.assertEqual(
+            results, [MarkdownRenderResult(key=1, rendered_content="<p><strong>fast</strong></p>")]
+        )
+
 
 class MarkdownAlertTest(ZulipTestCase):
     def test_alert_words(self) -> None:
@@ -3,6 +3,8 @@ from unittest import mock
 
 from django.utils.timezone import now as timezone_now
 
+from zerver.actions.streams import do_rename_stream
+from zerver.actions.user_settings import do_change_full_name
 from zerver.lib.cache import cache_delete, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient
 from zerver.lib.markdown import version as markdown_version
@@ -530,6 +532,74 @@ class MessageHydrationTest(ZulipTestCase):
         # Make sure the email is up-to-date.
         self.assertEqual(cordelia_display_recipient["email"], cordelia_new_email)
 
+    def test_messages_for_ids_payload_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        message_id = self.send_stream_message(hamlet, "Verona", content="hello")
+        edit_history_policy = MessageEditHistoryVisibilityPolicyEnum.all.value
+
+        def fetch(user_profile: UserProfile, flags: list[str]) -> dict[str, Any]:
+            (message,) = messages_for_ids(
+                message_ids=[message_id],
+                user_message_flags={message_id: flags},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_empty_topic_name=True,
+                message_edit_history_visibility_policy=edit_history_policy,
+                user_profile=user_profile,
+                realm=user_profile.realm,
+            )
+            return message
+
+        message = fetch(cordelia, ["read"])
+        self.assertEqual(message["content"], "<p>hello</p>")
+
+        # The finalized payload is cached, and another user's flags
+        # are merged into it.
+        with mock.patch.object(
+            MessageDict, "post_process_dicts", wraps=MessageDict.post_process_dicts
+        ) as m:
+            message = fetch(othello, ["mentioned"])
+        self.assertEqual(m.call_args.args[0], [])
+        self.assertEqual(message["content"], "<p>hello</p>")
+        self.assertEqual(message["flags"], ["mentioned"])
+        self.assertEqual(message["sender_full_name"], hamlet.full_name)
+
+        # Renaming a user who didn't send or receive the message keeps
+        # the cached payload.
+        do_change_full_name(othello, "Othello, the Moor", acting_user=None)
+        with mock.patch.object(
+            MessageDict, "post_process_dicts", wraps=MessageDict.post_process_dicts
+        ) as m:
+            fetch(cordelia, [])
+        self.assertEqual(m.call_args.args[0], [])
+
+        # Renaming the sender or the stream, or editing the message,
+        # invalidates the cached payload.
+        do_change_full_name(hamlet, "Prince Hamlet", acting_user=None)
+        self.assertEqual(fetch(cordelia, [])["sender_full_name"], "Prince Hamlet")
+
+        do_rename_stream(get_stream("Verona", hamlet.realm), "Venice", hamlet)
+        self.assertEqual(fetch(cordelia, [])["display_recipient"], "Venice")
+
+        self.login_user(hamlet)
+        result = self.client_patch(f"/json/messages/{message_id}", {"content": "edited"})
+        self.assert_json_success(result)
+        message = fetch(cordelia, [])
+        self.assertEqual(message["content"], "<p>edited</p>")
+        self.assert_length(message["edit_history"], 1)
+
+        # Renaming the recipient of a direct message invalidates it.
+        message_id = self.send_personal_message(hamlet, othello, "hi")
+        fetch(hamlet, [])
+        do_change_full_name(othello, "Othello", acting_user=None)
+        self.assertIn(
+            "Othello",
+            [recipient["full_name"] for recipient in fetch(hamlet, [])["display_recipient"]],
+        )
+
 
 class TestMessageForIdsDisplayRecipientFetching(ZulipTestCase):
     def _verify_display_recipient(
@@ -1,14 +1,21 @@
+from contextlib import redirect_stdout
+from datetime import timedelta
+from io import StringIO
 from typing import TYPE_CHECKING, Any
 from unittest import mock
 
 import orjson
+from django.core.management import call_command
 from django.db import connection
+from django.utils.timezone import now as timezone_now
 from typing_extensions import override
 
+from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_flags import do_update_message_flags
 from zerver.actions.streams import do_change_stream_group_based_setting, do_change_stream_permission
 from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
+from zerver.lib.cache import cache_get, cache_set, user_unread_snapshot_cache_key
 from zerver.lib.fix_unreads import fix, fix_unsubscribed
 from zerver.lib.message import (
     MessageDetailsDict,
@@ -1524,6 +1531,109 @@ class GetUnreadMsgsTest(ZulipTestCase):
         result = get_unread_data()
         self.assertEqual(result["mentions"], [])
 
+    def test_unread_snapshot(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        cache_key = user_unread_snapshot_cache_key(hamlet.id)
+        message_ids = [
+            self.send_stream_message(cordelia, "Denmark", topic_name="snapshot") for i in range(3)
+        ]
+        start = timezone_now()
+
+        def get_unread_stream_dict(minutes: int) -> dict[int, Any]:
+            now = start + timedelta(minutes=minutes)
+            with mock.patch("zerver.lib.message.timezone_now", return_value=now):
+                return dict(get_raw_unread_data(hamlet)["stream_dict"])
+
+        # The IDs seen are only included in the snapshot at a page load
+        # UNREAD_SNAPSHOT_SEND_DELAY later.
+        stream_dict = get_unread_stream_dict(0)
+        self.assertTrue(set(message_ids) <= stream_dict.keys())
+        snapshot = cache_get(cache_key)[0]
+        self.assertEqual(snapshot.complete_through_id, 0)
+        self.assertEqual(snapshot.pending_through_id, message_ids[-1])
+
+        self.assertEqual(get_unread_stream_dict(2), stream_dict)
+        snapshot = cache_get(cache_key)[0]
+        self.assertEqual(snapshot.complete_through_id, message_ids[-1])
+        self.assertTrue(stream_dict.keys() <= set(snapshot.message_ids))
+
+        # Newer messages are fetched along with the cached snapshot.
+        new_message_id = self.send_stream_message(cordelia, "Denmark", topic_name="snapshot")
+        stream_dict = get_unread_stream_dict(2)
+        self.assertIn(new_message_id, stream_dict)
+        self.assertEqual(cache_get(cache_key)[0], snapshot)
+
+        # Messages before the realm's first visible message are
+        # filtered out when reading the snapshot, rather than dropped
+        # from it.
+        with mock.patch(
+            "zerver.lib.message.get_first_visible_message_id", return_value=message_ids[1]
+        ):
+            self.assertNotIn(message_ids[0], get_unread_stream_dict(2))
+        self.assertIn(message_ids[0], cache_get(cache_key)[0].message_ids)
+        self.assertIn(message_ids[0], get_unread_stream_dict(2))
+
+        # Marking messages as read or unread flushes the snapshot.
+        do_update_message_flags(hamlet, "add", "read", [message_ids[0]])
+        self.assertIsNone(cache_get(cache_key))
+        self.assertNotIn(message_ids[0], get_unread_stream_dict(4))
+        # Even if they were already read.
+        do_update_message_flags(hamlet, "add", "read", [message_ids[0]])
+        self.assertIsNone(cache_get(cache_key))
+
+        # A snapshot built from the database before a flush, but
+        # stored after it, is ignored.
+        cache_set(cache_key, snapshot)
+        self.assertNotIn(message_ids[0], get_unread_stream_dict(6))
+        do_update_message_flags(hamlet, "remove", "read", [message_ids[0]])
+        self.assertIsNone(cache_get(cache_key))
+        self.assertIn(message_ids[0], get_unread_stream_dict(8))
+
+        # As does moving them.
+        self.login("iago")
+        result = self.client_patch(
+            f"/json/messages/{message_ids[1]}",
+            {"topic": "moved", "propagate_mode": "change_one"},
+        )
+        self.assert_json_success(result)
+        self.assertIsNone(cache_get(cache_key))
+        self.assertEqual(get_unread_stream_dict(10)[message_ids[1]]["topic"], "moved")
+
+        # And deleting them.
+        do_delete_messages(hamlet.realm, [Message.objects.get(id=message_ids[2])], acting_user=None)
+        self.assertIsNone(cache_get(cache_key))
+        self.assertNotIn(message_ids[2], get_unread_stream_dict(12))
+
+        # The management command rebuilds the snapshot from scratch.
+        cache_set(cache_key, snapshot)
+        with redirect_stdout(StringIO()):
+            call_command("rebuild_unread_snapshots", "-r", "zulip", "-u", hamlet.delivery_email)
+        rebuilt_snapshot = cache_get(cache_key)[0]
+        self.assertNotEqual(rebuilt_snapshot.generation, snapshot.generation)
+        self.assertEqual(rebuilt_snapshot.complete_through_id, 0)
+
+    def test_unread_snapshot_slow_send(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        cache_key = user_unread_snapshot_cache_key(hamlet.id)
+
+        get_raw_unread_data(hamlet)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send_stream_message(cordelia, "Denmark")
+        self.assertIsNotNone(cache_get(cache_key))
+
+        # A send which takes close to UNREAD_SNAPSHOT_SEND_DELAY to
+        # commit flushes its recipients' snapshots.
+        with (
+            mock.patch(
+                "zerver.actions.message_send.UNREAD_SNAPSHOT_SEND_DELAY", timedelta(seconds=0)
+            ),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.send_stream_message(cordelia, "Denmark")
+        self.assertIsNone(cache_get(cache_key))
+
 
 class MessageAccessTests(ZulipTestCase):
     def test_update_invalid_flags(self) -> None:
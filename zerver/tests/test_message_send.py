@@ -18,6 +18,7 @@ from zerver.actions.message_send import (
     do_send_messages,
     extract_private_recipients,
     extract_stream_indicator,
+    get_recipient_info,
     internal_prep_private_message,
     internal_prep_stream_message_by_name,
     internal_send_group_direct_message,
@@ -40,6 +41,7 @@ from zerver.actions.user_groups import add_subgroups_to_user_group, check_add_us
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_change_can_forge_sender, do_deactivate_user
 from zerver.lib.addressee import Addressee
+from zerver.lib.cache import cache_get, cache_set, topic_participants_cache_key
 from zerver.lib.exceptions import (
     DirectMessageInitiationError,
     DirectMessagePermissionError,
@@ -63,6 +65,7 @@ from zerver.lib.test_helpers import (
     reset_email_visibility_to_everyone_in_zulip_realm,
 )
 from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.topic import add_topic_participants, participants_for_topic
 from zerver.lib.types import UserGroupMembersData
 from zerver.models import (
     Message,
@@ -1508,6 +1511,82 @@ class MessagePOSTTest(ZulipTestCase):
         result = self.api_post(sender, "/api/v1/messages", payload)
         self.assert_json_success(result)
 
+    def test_send_messages_bulk(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        self.login_user(hamlet)
+        messages = [
+            dict(type="channel", to="Verona", topic="backfill", content="First"),
+            dict(
+                type="stream",
+                to="Verona",
+                topic="backfill",
+                content="Second, for @**Cordelia, Lear's daughter**",
+            ),
+            dict(type="direct", to=[othello.id], content="Third"),
+            dict(type="channel", to="Verona", topic="backfill", content="Fourth"),
+        ]
+
+        with mock.patch(
+            "zerver.actions.message_send.get_recipient_info", wraps=get_recipient_info
+        ) as m:
+            result = self.client_post(
+                "/json/messages/bulk", {"messages": orjson.dumps(messages).decode()}
+            )
+        # The recipients are found once per addressee, not per message.
+        self.assertEqual(m.call_count, 2)
+
+        ids = self.assert_json_success(result)["ids"]
+        self.assert_length(ids, 4)
+        self.assertEqual(ids, sorted(ids))
+        sent_messages = {message.id: message for message in Message.objects.filter(id__in=ids)}
+        self.assertEqual(
+            [sent_messages[message_id].content for message_id in ids],
+            [message["content"] for message in messages],
+        )
+        self.assertEqual(sent_messages[ids[0]].topic_name(), "backfill")
+        self.assertEqual(sent_messages[ids[2]].recipient.type, Recipient.PERSONAL)
+
+        # Only the message mentioning Cordelia has the mentioned flag
+        # for her, though they were sent together.
+        flags = {
+            um.message_id: um.flags
+            for um in UserMessage.objects.filter(user_profile=cordelia, message_id__in=ids)
+        }
+        self.assertEqual(set(flags), {ids[0], ids[1], ids[3]})
+        self.assertFalse(flags[ids[0]].mentioned)
+        self.assertTrue(flags[ids[1]].mentioned)
+        self.assertFalse(flags[ids[3]].mentioned)
+
+        # Sent from the web app, so read by the sender.
+        self.assertTrue(
+            all(
+                um.flags.read
+                for um in UserMessage.objects.filter(user_profile=hamlet, message_id__in=ids)
+            )
+        )
+
+    def test_send_messages_bulk_errors(self) -> None:
+        self.login("hamlet")
+        self.make_stream("private stream", invite_only=True)
+        message = dict(type="channel", to="Verona", topic="backfill", content="Test")
+
+        with mock.patch("zerver.views.message_send.MAX_BULK_SEND_MESSAGES", 2):
+            result = self.client_post(
+                "/json/messages/bulk", {"messages": orjson.dumps([message] * 3).decode()}
+            )
+        self.assert_json_error(result, "At most 2 messages can be sent at once.")
+
+        # If any message can't be sent, none are.
+        message_count = Message.objects.count()
+        messages = [message, dict(message, to="private stream")]
+        result = self.client_post(
+            "/json/messages/bulk", {"messages": orjson.dumps(messages).decode()}
+        )
+        self.assert_json_error(result, "Not authorized to send to channel 'private stream'")
+        self.assertEqual(Message.objects.count(), message_count)
+
 
 class StreamMessagesTest(ZulipTestCase):
     def assert_stream_message(
@@ -2242,6 +2321,74 @@ class StreamMessagesTest(ZulipTestCase):
             ).flags.topic_wildcard_mentioned.is_set
         )
 
+    def test_topic_participants_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        iago = self.example_user("iago")
+        for user_profile in [hamlet, cordelia, iago]:
+            self.subscribe(user_profile, "Denmark")
+        recipient_id = get_stream("Denmark", hamlet.realm).recipient_id
+        assert recipient_id is not None
+
+        def participants(topic_name: str = "incident") -> set[int]:
+            return participants_for_topic(hamlet.realm_id, recipient_id, topic_name)
+
+        message_id = self.send_stream_message(hamlet, "Denmark", topic_name="incident")
+        self.assertEqual(participants(), {hamlet.id})
+        # Topics are case-insensitive.
+        with self.assert_database_query_count(0):
+            self.assertEqual(participants("INCIDENT"), {hamlet.id})
+
+        # Messages from existing participants keep the cached result.
+        self.send_stream_message(hamlet, "Denmark", topic_name="incident")
+        with self.assert_database_query_count(0):
+            self.assertEqual(participants(), {hamlet.id})
+
+        # New participants, by sending or reacting, flush it.
+        result = self.api_post(
+            cordelia, f"/api/v1/messages/{message_id}/reactions", {"emoji_name": "smile"}
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id, cordelia.id})
+        iago_message_id = self.send_stream_message(iago, "Denmark", topic_name="Incident")
+        self.assertEqual(participants(), {hamlet.id, cordelia.id, iago.id})
+
+        result = self.api_delete(
+            cordelia, f"/api/v1/messages/{message_id}/reactions", {"emoji_name": "smile"}
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id, iago.id})
+
+        self.assertEqual(participants("postmortem"), set())
+        result = self.api_patch(
+            iago,
+            f"/api/v1/messages/{iago_message_id}",
+            {
+                "topic": "postmortem",
+                "propagate_mode": "change_one",
+                "send_notification_to_old_thread": "false",
+                "send_notification_to_new_thread": "false",
+            },
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id})
+        self.assertEqual(participants("postmortem"), {iago.id})
+
+        result = self.api_delete(iago, f"/api/v1/messages/{iago_message_id}")
+        self.assert_json_success(result)
+        self.assertEqual(participants("postmortem"), set())
+
+        # Topics whose participants weren't cached are only flushed on
+        # commit, in case a concurrent request cached them from before
+        # the new participant's message.
+        key = topic_participants_cache_key(recipient_id, "rollout")
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch("zerver.lib.topic.cache_delete_many") as cache_delete_many:
+                add_topic_participants([(recipient_id, "rollout", hamlet.id)])
+            cache_delete_many.assert_not_called()
+            cache_set(key, set())
+        self.assertIsNone(cache_get(key))
+
     def test_user_group_mentions_via_subgroup(self) -> None:
         user_profile = self.example_user("iago")
         self.subscribe(user_profile, "Denmark")
@@ -57,6 +57,26 @@ class SlowQueryTest(ZulipTestCase):
                 r"123\.456\.789\.012 GET     200 10\.\ds .* \(unknown via \?\)",
             )
 
+    def test_section_times_log(self) -> None:
+        self.log_data["time_started"] = time.time()
+        section_times = {"presence": 0.001, "realm_user": 0.012, "subscription": 0.035}
+        with (
+            patch("zerver.middleware.get_section_times", return_value=section_times),
+            self.assertLogs("zulip.requests", level="INFO") as middleware_normal_logger,
+        ):
+            write_log_line(
+                self.log_data,
+                path="/json/register",
+                method="POST",
+                remote_ip="123.456.789.012",
+                requester_for_logs="unknown",
+                client_name="?",
+            )
+        self.assertIn(
+            " (sections: 35ms subscription, 12ms realm_user) /json/register",
+            middleware_normal_logger.output[0],
+        )
+
 
 class OpenGraphTest(ZulipTestCase):
     def check_title_and_description(
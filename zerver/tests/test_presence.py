@@ -8,9 +8,19 @@ from django.db import connection
 from django.utils.timezone import now as timezone_now
 from typing_extensions import override
 
+from zerver.actions.presence import (
+    PresenceUpdate,
+    do_bulk_update_user_presence,
+    do_update_user_presence,
+)
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_deactivate_user
-from zerver.lib.presence import format_legacy_presence_dict, get_presence_dict_by_realm
+from zerver.lib.presence import (
+    format_legacy_presence_dict,
+    get_cached_realm_presence_snapshot,
+    get_presence_dict_by_realm,
+)
+from zerver.lib.queue import queue_json_publish_rollback_unsafe
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import make_client, reset_email_visibility_to_everyone_in_zulip_realm
 from zerver.lib.timestamp import datetime_to_timestamp
@@ -21,6 +31,7 @@ from zerver.models import (
     UserPresence,
     UserProfile,
 )
+from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 
 
@@ -219,6 +230,117 @@ class UserPresenceModelTests(ZulipTestCase):
         )
         self.assertFalse(pushable())
 
+    def test_realm_presence_snapshot(self) -> None:
+        UserPresence.objects.all().delete()
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        cordelia = self.example_user("cordelia")
+        realm = hamlet.realm
+        client = get_client("website")
+        now = timezone_now()
+
+        do_update_user_presence(hamlet, client, now, UserPresence.LEGACY_STATUS_ACTIVE_INT)
+        with self.assert_database_query_count(1):
+            presence_dct, last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(
+            presence_dct,
+            {
+                str(hamlet.id): dict(
+                    active_timestamp=datetime_to_timestamp(now),
+                    idle_timestamp=datetime_to_timestamp(now),
+                )
+            },
+        )
+        self.assertEqual(
+            last_update_id, UserPresence.objects.get(user_profile=hamlet).last_update_id
+        )
+
+        # With no presence updates, the cached snapshot is served after
+        # only fetching the realm's last_update_id.
+        with self.assert_database_query_count(1, keep_cache_warm=True):
+            self.assertEqual(
+                get_presence_dict_by_realm(realm, slim_presence=True),
+                (presence_dct, last_update_id),
+            )
+
+        # Updates which aren't in the delta buffer, because their
+        # transaction's on-commit callbacks haven't run, are fetched
+        # from the database; the snapshot isn't rewritten.
+        do_update_user_presence(othello, client, now, UserPresence.LEGACY_STATUS_IDLE_INT)
+        with self.assert_database_query_count(2, keep_cache_warm=True):
+            presence_dct, new_last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(set(presence_dct), {str(hamlet.id), str(othello.id)})
+        self.assertEqual(new_last_update_id, last_update_id + 1)
+        snapshot = get_cached_realm_presence_snapshot(realm.id)
+        assert snapshot is not None
+        self.assertEqual(snapshot.last_update_id, last_update_id)
+
+        # Clients which pass their last_update_id only get the updates.
+        with self.assert_database_query_count(2, keep_cache_warm=True):
+            presence_dct, _ = get_presence_dict_by_realm(
+                realm, slim_presence=True, last_update_id_fetched_by_client=last_update_id
+            )
+        self.assertEqual(set(presence_dct), {str(othello.id)})
+
+        # Committed updates are recorded in the delta buffer, which
+        # serves clients without reading the snapshot.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_update_user_presence(cordelia, client, now, UserPresence.LEGACY_STATUS_ACTIVE_INT)
+        with (
+            self.assert_database_query_count(1, keep_cache_warm=True),
+            mock.patch("zerver.lib.presence.get_cached_realm_presence_snapshot") as mock_snapshot,
+        ):
+            presence_dct, last_update_id = get_presence_dict_by_realm(
+                realm, slim_presence=True, last_update_id_fetched_by_client=new_last_update_id
+            )
+        mock_snapshot.assert_not_called()
+        self.assertEqual(set(presence_dct), {str(cordelia.id)})
+        self.assertEqual(last_update_id, new_last_update_id + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            do_bulk_update_user_presence(
+                realm.id,
+                [
+                    PresenceUpdate(
+                        user_profile_id=hamlet.id,
+                        last_active_time=None,
+                        last_connected_time=now + timedelta(minutes=1),
+                    )
+                ],
+            )
+        with self.assert_database_query_count(1, keep_cache_warm=True):
+            presence_dct, new_last_update_id = get_presence_dict_by_realm(
+                realm, slim_presence=True, last_update_id_fetched_by_client=last_update_id
+            )
+        self.assertEqual(
+            presence_dct,
+            {
+                str(hamlet.id): dict(
+                    active_timestamp=datetime_to_timestamp(now),
+                    idle_timestamp=datetime_to_timestamp(now + timedelta(minutes=1)),
+                )
+            },
+        )
+        self.assertEqual(new_last_update_id, last_update_id + 1)
+
+        # Clients which are up to date get nothing.
+        with self.assert_database_query_count(1, keep_cache_warm=True):
+            self.assertEqual(
+                get_presence_dict_by_realm(
+                    realm, slim_presence=True, last_update_id_fetched_by_client=new_last_update_id
+                ),
+                ({}, new_last_update_id),
+            )
+
+        # Deactivated users are removed from the snapshot and deltas.
+        do_deactivate_user(cordelia, acting_user=None)
+        presence_dct, _ = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(set(presence_dct), {str(hamlet.id), str(othello.id)})
+        presence_dct, _ = get_presence_dict_by_realm(
+            realm, slim_presence=True, last_update_id_fetched_by_client=new_last_update_id - 2
+        )
+        self.assertEqual(set(presence_dct), {str(hamlet.id)})
+
 
 class UserPresenceTests(ZulipTestCase):
     @override
@@ -682,13 +804,14 @@ class UserPresenceTests(ZulipTestCase):
 
     def test_query_counts(self) -> None:
         self.login("hamlet")
-        with self.assert_database_query_count(6):
+        with self.assert_database_query_count(7):
             # 1. session
             # 2. narrow user cache
             # 3. client
-            # 4. lock the userpresence row
-            # 5. update the userpresence row
-            # 6. select other userpresence data
+            # 4. fetch the userpresence row, to find hamlet is newly online
+            # 5. lock the userpresence row
+            # 6. update the userpresence row
+            # 7. select other userpresence data
             self.assert_json_success(
                 self.client_post("/json/users/me/presence", {"status": "active"})
             )
@@ -705,6 +828,59 @@ class UserPresenceTests(ZulipTestCase):
                 self.client_post("/json/users/me/presence", {"status": "idle"})
             )
 
+    def test_heartbeats_queued(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        now = timezone_now().replace(microsecond=0)
+        UserPresence.objects.filter(user_profile=hamlet).update(
+            last_active_time=now - timedelta(days=1), last_connected_time=now - timedelta(days=1)
+        )
+
+        def post_presence(status: str, log_time: datetime) -> tuple[mock.Mock, mock.Mock]:
+            with (
+                time_machine.travel(log_time, tick=False),
+                mock.patch(
+                    "zerver.actions.presence.queue_json_publish_rollback_unsafe",
+                    wraps=queue_json_publish_rollback_unsafe,
+                ) as mock_queue,
+                mock.patch("zerver.actions.presence.send_presence_changed") as mock_send,
+                self.captureOnCommitCallbacks(execute=True),
+            ):
+                result = self.client_post("/json/users/me/presence", {"status": status})
+            self.assert_json_success(result)
+            return mock_queue, mock_send
+
+        # Coming back online is written immediately, and sent to clients.
+        mock_queue, mock_send = post_presence("active", now)
+        mock_queue.assert_not_called()
+        mock_send.assert_called_once()
+        presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(presence.last_active_time, now)
+        last_update_id = presence.last_update_id
+
+        # Another heartbeat right after that doesn't need writing.
+        mock_queue, mock_send = post_presence("active", now + timedelta(seconds=10))
+        mock_queue.assert_not_called()
+        mock_send.assert_not_called()
+
+        # Later heartbeats are queued for the user_presence worker,
+        # which processes them immediately in tests.
+        later = now + timedelta(seconds=settings.PRESENCE_UPDATE_MIN_FREQ_SECONDS + 1)
+        mock_queue, mock_send = post_presence("idle", later)
+        mock_queue.assert_called_once()
+        mock_send.assert_not_called()
+        presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(presence.last_active_time, now)
+        self.assertEqual(presence.last_connected_time, later)
+        self.assertEqual(presence.last_update_id, last_update_id + 1)
+
+        mock_queue, mock_send = post_presence("active", later + timedelta(seconds=60))
+        mock_queue.assert_called_once()
+        mock_send.assert_not_called()
+        presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(presence.last_active_time, later + timedelta(seconds=60))
+        self.assertEqual(presence.last_connected_time, later + timedelta(seconds=60))
+
 
 class SingleUserPresenceTests(ZulipTestCase):
     def test_email_access(self) -> None:
@@ -21,7 +21,7 @@ from zerver.lib.remote_server import PushNotificationBouncerRetryLaterError
 from zerver.lib.send_email import EmailNotDeliveredError, FromAddress
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import mock_queue_publish
-from zerver.models import ScheduledMessageNotificationEmail, UserActivity, UserProfile
+from zerver.models import ScheduledMessageNotificationEmail, UserActivity, UserPresence, UserProfile
 from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 from zerver.models.scheduled_jobs import NotificationTriggers
@@ -34,6 +34,7 @@ from zerver.worker.embed_links import FetchLinksEmbedData
 from zerver.worker.missedmessage_emails import MissedMessageWorker
 from zerver.worker.missedmessage_mobile_notifications import PushNotificationsWorker
 from zerver.worker.user_activity import UserActivityWorker
+from zerver.worker.user_presence import UserPresenceWorker
 
 Event: TypeAlias = dict[str, Any]
 
@@ -209,6 +210,73 @@ class WorkerTest(ZulipTestCase):
             activity_records[4].last_visit, datetime.fromtimestamp(now + 45, tz=timezone.utc)
         )
 
+    def test_user_presence_worker(self) -> None:
+        fake_client = FakeClient()
+
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        king = self.lear_user("king")
+        start = datetime(year=2024, month=1, day=1, tzinfo=timezone.utc)
+        for user in [hamlet, othello, king]:
+            UserPresence.objects.update_or_create(
+                user_profile=user,
+                defaults=dict(realm=user.realm, last_active_time=start, last_connected_time=start),
+            )
+        last_update_ids = {
+            presence.user_profile_id: presence.last_update_id
+            for presence in UserPresence.objects.filter(user_profile__in=[hamlet, othello, king])
+        }
+
+        def enqueue(user: UserProfile, status: int, seconds: int) -> None:
+            fake_client.enqueue(
+                "user_presence",
+                dict(
+                    user_profile_id=user.id,
+                    realm_id=user.realm_id,
+                    status=status,
+                    time=(start + timedelta(seconds=seconds)).timestamp(),
+                ),
+            )
+
+        # Several heartbeats for hamlet, which are collapsed to the
+        # latest of each kind, including one out of order.
+        enqueue(hamlet, UserPresence.LEGACY_STATUS_ACTIVE_INT, 60)
+        enqueue(hamlet, UserPresence.LEGACY_STATUS_IDLE_INT, 180)
+        enqueue(hamlet, UserPresence.LEGACY_STATUS_ACTIVE_INT, 120)
+        enqueue(othello, UserPresence.LEGACY_STATUS_IDLE_INT, 60)
+        enqueue(king, UserPresence.LEGACY_STATUS_ACTIVE_INT, 60)
+
+        # Run the worker; this will produce one update per realm.
+        with simulated_queue_client(fake_client):
+            worker = UserPresenceWorker()
+            worker.setup()
+            with self.assert_database_query_count(2):
+                worker.start()
+
+        hamlet_presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(hamlet_presence.last_active_time, start + timedelta(seconds=120))
+        self.assertEqual(hamlet_presence.last_connected_time, start + timedelta(seconds=180))
+        othello_presence = UserPresence.objects.get(user_profile=othello)
+        self.assertEqual(othello_presence.last_active_time, start)
+        self.assertEqual(othello_presence.last_connected_time, start + timedelta(seconds=60))
+        king_presence = UserPresence.objects.get(user_profile=king)
+        self.assertEqual(king_presence.last_active_time, start + timedelta(seconds=60))
+
+        # The users in each realm share a single new last_update_id.
+        self.assertEqual(hamlet_presence.last_update_id, othello_presence.last_update_id)
+        self.assertGreater(hamlet_presence.last_update_id, last_update_ids[hamlet.id])
+        self.assertGreater(king_presence.last_update_id, last_update_ids[king.id])
+
+        # Heartbeats older than the stored presence don't move it backwards.
+        enqueue(hamlet, UserPresence.LEGACY_STATUS_ACTIVE_INT, 30)
+        with simulated_queue_client(fake_client):
+            worker = UserPresenceWorker()
+            worker.setup()
+            worker.start()
+        hamlet_presence.refresh_from_db()
+        self.assertEqual(hamlet_presence.last_active_time, start + timedelta(seconds=120))
+        self.assertEqual(hamlet_presence.last_connected_time, start + timedelta(seconds=180))
+
     def test_missed_message_worker(self) -> None:
         cordelia = self.example_user("cordelia")
         hamlet = self.example_user("hamlet")
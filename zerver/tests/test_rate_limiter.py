@@ -112,6 +112,20 @@ class RateLimiterBackendBase(ZulipTestCase, ABC):
         with mock.patch("time.time", return_value=start_time + 2.01):
             self.make_request(obj, expect_ratelimited=False)
 
+    def test_charge_several_calls(self) -> None:
+        obj = self.create_object("test", [(4, 4)])
+        start_time = time.time()
+        with mock.patch("time.time", return_value=start_time):
+            self.assertEqual(obj.rate_limit(calls=3)[0], False)
+            self.requests_record[obj.key()] = [start_time] * 3
+            self.verify_api_calls_left(obj)
+
+            # Calls are only charged if all of them are allowed.
+            self.assertEqual(obj.rate_limit(calls=2)[0], True)
+            self.verify_api_calls_left(obj)
+            self.make_request(obj, expect_ratelimited=False)
+            self.make_request(obj, expect_ratelimited=True)
+
     def test_clear_history(self) -> None:
         obj = self.create_object("test", [(2, 3)])
         start_time = time.time()
@@ -16,7 +16,10 @@ from zerver.lib.soft_deactivation import (
     get_users_for_soft_deactivation,
     reactivate_user_if_soft_deactivated,
 )
-from zerver.lib.stream_subscription import get_subscriptions_for_send_message
+from zerver.lib.stream_subscription import (
+    get_stream_subscriber_settings,
+    get_user_ids_for_send_message,
+)
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import get_subscription, get_user_messages, make_client
 from zerver.models import (
@@ -578,7 +581,10 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         self.subscribe(cordelia, stream_name)
         self.subscribe(sender, stream_name)
 
-        stream_id = get_stream(stream_name, cordelia.realm).id
+        stream = get_stream(stream_name, cordelia.realm)
+        stream_id = stream.id
+        recipient_id = stream.recipient_id
+        assert recipient_id is not None
 
         def send_stream_message(content: str) -> None:
             self.send_stream_message(sender, stream_name, content, topic_name)
@@ -619,10 +625,11 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         ) -> None:
             self.assertEqual(
                 len(
-                    get_subscriptions_for_send_message(
+                    get_user_ids_for_send_message(
                         realm_id=realm_id,
                         stream_id=stream_id,
                         topic_name=topic_name,
+                        subscriber_settings=get_stream_subscriber_settings(recipient_id),
                         possible_stream_wildcard_mention=possible_stream_wildcard_mention,
                         topic_participant_user_ids=topic_participant_user_ids,
                         possibly_mentioned_user_ids=possibly_mentioned_user_ids,
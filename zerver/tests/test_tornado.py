@@ -7,6 +7,7 @@ from unittest import mock
 from urllib.parse import urlencode
 
 import orjson
+import tornado.web
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core import signals
@@ -194,3 +195,54 @@ class EventsTestCase(TornadoWebTestCase):
 
                 self.assert_length(queries, 1)
                 self.assertIn("django_session", queries[0].sql)
+
+    async def test_forward_events_request(self) -> None:
+        forwarded_bodies: list[bytes] = []
+
+        class TargetPortHandler(tornado.web.RequestHandler):
+            @override
+            def post(self) -> None:
+                forwarded_bodies.append(self.request.body)
+                self.set_status(400)
+                self.write({"result": "error", "msg": "Bad event queue ID: 1:0"})
+
+        # The Tornado process on another port, to which hamlet's event
+        # queues have been migrated.
+        target_server = HTTPServer(
+            tornado.web.Application([(r"/api/v1/events/internal", TargetPortHandler)])
+        )
+        sock = netutil.bind_sockets(0, "127.0.0.1", family=socket.AF_INET)[0]
+        target_port = sock.getsockname()[1]
+        target_server.add_sockets([sock])
+
+        async with self.with_tornado():
+            hamlet = await sync_to_async(lambda: self.example_user("hamlet"))()
+            post_data = {
+                "secret": settings.SHARED_SECRET,
+                "user_profile_id": hamlet.id,
+                "queue_id": "1:0",
+                "dont_block": "true",
+            }
+            try:
+                with (
+                    mock.patch.dict(event_queue.migrated_user_ports, {hamlet.id: target_port}),
+                    mock.patch("zerver.tornado.views.is_current_port", return_value=False),
+                ):
+                    response = await self.fetch_async(
+                        "POST",
+                        "/api/v1/events/internal",
+                        headers={"Content-Type": "application/x-www-form-urlencoded"},
+                        body=urlencode(post_data),
+                        raise_error=False,
+                    )
+            finally:
+                target_server.stop()
+
+            # The target port's response, errors included, is passed
+            # back unchanged.
+            self.assertEqual(response.code, 400)
+            self.assertEqual(
+                orjson.loads(response.body), {"result": "error", "msg": "Bad event queue ID: 1:0"}
+            )
+            self.assert_length(forwarded_bodies, 1)
+            self.assertIn(f"user_profile_id={hamlet.id}".encode(), forwarded_bodies[0])
@@ -481,7 +481,7 @@ class TypingHappyPathTestStreams(ZulipTestCase):
         )
 
         with (
-            self.assert_database_query_count(6),
+            self.assert_database_query_count(5),
             self.capture_send_event_calls(expected_num_events=1) as events,
         ):
             result = self.api_post(sender, "/api/v1/typing", params)
@@ -514,7 +514,7 @@ class TypingHappyPathTestStreams(ZulipTestCase):
         )
 
         with (
-            self.assert_database_query_count(6),
+            self.assert_database_query_count(5),
             self.capture_send_event_calls(expected_num_events=1) as events,
         ):
             result = self.api_post(sender, "/api/v1/typing", params)
@@ -531,6 +531,28 @@ class TypingHappyPathTestStreams(ZulipTestCase):
         self.assertEqual("typing", event["type"])
         self.assertEqual("stop", event["op"])
 
+    def test_repeated_start_coalesced(self) -> None:
+        sender = self.example_user("hamlet")
+        stream_name = self.get_streams(sender)[0]
+        stream_id = self.get_stream_id(stream_name)
+
+        def send_typing(op: str, expected_num_events: int, topic_name: str = "Some topic") -> None:
+            params = dict(type="stream", op=op, stream_id=str(stream_id), topic=topic_name)
+            with self.capture_send_event_calls(expected_num_events=expected_num_events):
+                result = self.api_post(sender, "/api/v1/typing", params)
+            self.assert_json_success(result)
+
+        with self.settings(STREAM_TYPING_START_COALESCE_SECONDS=15):
+            send_typing("start", 1)
+            send_typing("start", 0)
+            # Typing in another topic is not coalesced with it.
+            send_typing("start", 1, "Other topic")
+
+            # A "stop" is always sent, and the next "start" after it too.
+            send_typing("stop", 1)
+            send_typing("stop", 1)
+            send_typing("start", 1)
+
     def test_max_stream_size_for_typing_notifications_setting(self) -> None:
         sender = self.example_user("hamlet")
         stream_name = self.get_streams(sender)[0]
@@ -606,7 +628,7 @@ class TypingHappyPathTestStreams(ZulipTestCase):
         )
 
         with (
-            self.assert_database_query_count(6),
+            self.assert_database_query_count(5),
             self.capture_send_event_calls(expected_num_events=1) as events,
         ):
             result = self.api_post(sender, "/api/v1/typing", params)
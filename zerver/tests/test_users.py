@@ -19,6 +19,7 @@ from zerver.actions.invites import do_create_multiuse_invite_link, do_invite_use
 from zerver.actions.message_send import RecipientInfoResult, get_recipient_info
 from zerver.actions.muted_users import do_mute_user
 from zerver.actions.realm_settings import do_set_realm_property
+from zerver.actions.streams import do_change_subscription_property
 from zerver.actions.user_settings import bulk_regenerate_api_keys, do_change_user_setting
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.actions.users import (
@@ -43,6 +44,7 @@ from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import (
     get_subscription,
     get_test_image_file,
+    queries_captured,
     reset_email_visibility_to_everyone_in_zulip_realm,
     simulated_empty_cache,
 )
@@ -2680,6 +2682,69 @@ class RecipientInfoTest(ZulipTestCase):
                 stream_topic=stream_topic,
             )
 
+    def test_get_recipient_info_subscriber_settings_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        realm = hamlet.realm
+        for user in [hamlet, cordelia]:
+            self.subscribe(user, "Test stream")
+        stream = get_stream("Test stream", realm)
+        recipient = stream.recipient
+        assert recipient is not None
+
+        def get_info() -> RecipientInfoResult:
+            return get_recipient_info(
+                realm_id=realm.id,
+                recipient=recipient,
+                sender_id=hamlet.id,
+                stream_topic=StreamTopicTarget(stream_id=stream.id, topic_name="test topic"),
+            )
+
+        info = get_info()
+        self.assertEqual(info.active_user_ids, {hamlet.id, cordelia.id})
+        self.assertEqual(info.stream_push_user_ids, set())
+
+        # The subscriptions are only queried once.
+        with queries_captured(keep_cache_warm=True) as queries:
+            self.assertEqual(get_info(), info)
+        self.assertFalse(any("zerver_subscription" in query.sql for query in queries))
+
+        # Changes to subscriptions, and to users' settings, flush it.
+        do_change_subscription_property(
+            cordelia,
+            get_subscription("Test stream", cordelia),
+            stream,
+            "push_notifications",
+            True,
+            acting_user=None,
+        )
+        self.assertEqual(get_info().stream_push_user_ids, {cordelia.id})
+
+        do_change_user_setting(hamlet, "enable_stream_push_notifications", True, acting_user=None)
+        self.assertEqual(get_info().stream_push_user_ids, {hamlet.id, cordelia.id})
+
+        do_change_subscription_property(
+            hamlet,
+            get_subscription("Test stream", hamlet),
+            stream,
+            "in_home_view",
+            False,
+            acting_user=None,
+        )
+        info = get_info()
+        self.assertEqual(info.stream_push_user_ids, {cordelia.id})
+        self.assertTrue(info.sender_muted_stream)
+
+        self.unsubscribe(cordelia, "Test stream")
+        info = get_info()
+        self.assertEqual(info.active_user_ids, {hamlet.id})
+        self.assertEqual(info.stream_push_user_ids, set())
+
+        do_deactivate_user(hamlet, acting_user=None)
+        info = get_info()
+        self.assertEqual(info.active_user_ids, set())
+        self.assertIsNone(info.sender_muted_stream)
+
 
 class BulkUsersTest(ZulipTestCase):
     def test_client_gravatar_option(self) -> None:
@@ -22,6 +22,11 @@ def create_tornado_application(*, autoreload: bool = False) -> tornado.web.Appli
         r"/api/v1/events/internal",
         r"/api/internal/notify_tornado",
         r"/api/internal/web_reload_clients",
+        r"/api/internal/tornado/cancel_event_queue_migration",
+        r"/api/internal/tornado/export_event_queues",
+        r"/api/internal/tornado/forward_migration_notices",
+        r"/api/internal/tornado/import_event_queues",
+        r"/api/internal/tornado/metrics",
     )
 
     return tornado.web.Application(
@@ -23,6 +23,11 @@ def clear_descriptor_by_handler_id(handler_id: int) -> None:
 current_port: int | None = None
 
 
+def get_current_port() -> int:
+    assert current_port is not None
+    return current_port
+
+
 def is_current_port(port: int) -> int | None:
     return settings.TEST_SUITE or current_port == port
 
@@ -1,17 +1,29 @@
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html for
 # high-level documentation on how this system works.
+import asyncio
 import copy
+import itertools
 import logging
 import os
 import random
+import sys
 import time
 import traceback
 import uuid
-from collections import deque
-from collections.abc import Callable, Collection, Iterable, Mapping, MutableMapping, Sequence
+from collections import defaultdict, deque
+from collections.abc import (
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Sequence,
+)
 from collections.abc import Set as AbstractSet
-from contextlib import suppress
-from functools import cache
+from contextlib import contextmanager, suppress
+from functools import cache, lru_cache
+from types import MappingProxyType
 from typing import Any, Literal, TypedDict, cast
 
 import orjson
@@ -24,16 +36,23 @@ from typing_extensions import override
 from version import API_FEATURE_LEVEL, ZULIP_MERGE_BASE, ZULIP_VERSION
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message_cache import MessageDict
-from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
-from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_helpers import NeverNegatedNarrowTerm, narrow_dataclasses_from_tuples
+from zerver.lib.narrow_predicate import NarrowPredicate, build_narrow_predicate, channel_operators
 from zerver.lib.notification_data import UserMessageNotificationsData
 from zerver.lib.queue import queue_json_publish_rollback_unsafe, retry_event
-from zerver.lib.topic import ORIG_TOPIC, TOPIC_NAME
+from zerver.lib.topic import ORIG_TOPIC, TOPIC_NAME, get_topic_from_message_info
 from zerver.middleware import async_request_timer_restart
 from zerver.models import CustomProfileField, Message
 from zerver.tornado.descriptors import clear_descriptor_by_handler_id, set_descriptor_by_handler_id
 from zerver.tornado.exceptions import BadEventQueueIdError
 from zerver.tornado.handlers import finish_handler, get_handler_by_id, handler_stats_string
+from zerver.tornado.metrics import (
+    events_pushed,
+    longpoll_hold_seconds,
+    message_fanout_queues,
+    notification_processing_seconds,
+)
+from zerver.tornado.sharding import notify_tornado_queue_name
 
 # The idle timeout used to be a week, but we found that in that
 # situation, queues from dead browser sessions would grow quite large
@@ -59,7 +78,112 @@ def create_heartbeat_event() -> dict[str, str]:
     return dict(type="heartbeat")
 
 
+# While a batch of notices is being processed (see
+# coalesce_handler_finishes), maps queue ids to the clients whose
+# long-poll handlers have received new events.
+deferred_finish_clients: dict[str, "ClientDescriptor"] | None = None
+
+
+@contextmanager
+def coalesce_handler_finishes() -> Iterator[None]:
+    """Defers finishing long-poll handlers which receive events until
+    the end of the block, so that a handler which receives several
+    events, e.g. from a burst of notices about a bulk topic move, is
+    finished once, with all of them, rather than being finished with
+    the first one and having to poll again for the rest.
+    """
+    global deferred_finish_clients
+    assert deferred_finish_clients is None
+    deferred_finish_clients = {}
+    try:
+        yield
+    finally:
+        clients_to_finish = deferred_finish_clients
+        deferred_finish_clients = None
+        for client in clients_to_finish.values():
+            client.finish_current_handler()
+
+
+ChannelNarrowKey = tuple[int, str, str | None]
+
+
+def get_channel_narrow_key(
+    realm_id: int, narrow: Collection[NeverNegatedNarrowTerm]
+) -> ChannelNarrowKey | None:
+    """For a narrow which only matches messages in a single channel,
+    returns the (realm ID, channel name, topic name) key under which
+    queues with that narrow are indexed in clients_by_channel_narrow.
+    The names are lowercased, since narrows match them
+    case-insensitively, and the topic name is None if the narrow
+    does not restrict the topic.
+    """
+    channel_name = None
+    topic_name = None
+    for narrow_term in narrow:
+        if narrow_term.operator in channel_operators and channel_name is None:
+            channel_name = narrow_term.operand.lower()
+        elif narrow_term.operator == "topic" and topic_name is None:
+            topic_name = narrow_term.operand.lower()
+    if channel_name is None:
+        return None
+    return (realm_id, channel_name, topic_name)
+
+
+# Tornado memory usage grows linearly with the number of open event
+# queues, most of which are idle, so we keep ClientDescriptor and
+# EventQueue objects small: they use __slots__, and the event types
+# and narrows that many clients register with are shared between
+# them, as are the predicates built from those narrows.
+NarrowTuple = tuple[tuple[str, ...], ...]
+
+
+@lru_cache(maxsize=1024)
+def intern_event_types(event_types: frozenset[str]) -> frozenset[str]:
+    return event_types
+
+
+@lru_cache(maxsize=16384)
+def intern_narrow(narrow: NarrowTuple) -> NarrowTuple:
+    return narrow
+
+
+@lru_cache(maxsize=16384)
+def get_narrow_predicate(narrow: NarrowTuple) -> NarrowPredicate:
+    return build_narrow_predicate(narrow_dataclasses_from_tuples(narrow))
+
+
 class ClientDescriptor:
+    __slots__ = (
+        "_timeout_handle",
+        "all_public_streams",
+        "apply_markdown",
+        "archived_channels",
+        "bulk_message_deletion",
+        "channel_narrow_key",
+        "client_gravatar",
+        "client_type_name",
+        "current_client_name",
+        "current_handler_id",
+        "empty_topic_name",
+        "event_queue",
+        "event_types",
+        "include_deactivated_groups",
+        "last_connection_time",
+        "linkifier_url_template",
+        "narrow",
+        "narrow_predicate",
+        "overflowed",
+        "pronouns_field_type_supported",
+        "queue_timeout",
+        "realm_id",
+        "slim_presence",
+        "stream_typing_notifications",
+        "user_list_incomplete",
+        "user_profile_id",
+        "user_recipient_id",
+        "user_settings_object",
+    )
+
     def __init__(
         self,
         *,
@@ -85,9 +209,10 @@ class ClientDescriptor:
         archived_channels: bool,
         empty_topic_name: bool,
     ) -> None:
+        narrow_tuple = intern_narrow(tuple(tuple(term) for term in narrow))
         # TODO: We eventually want to upstream this code to the caller, but
         # serialization concerns make it a bit difficult.
-        modern_narrow = narrow_dataclasses_from_tuples(narrow)
+        modern_narrow = narrow_dataclasses_from_tuples(narrow_tuple)
 
         # These objects are serialized on shutdown and restored on restart.
         # If fields are added or semantics are changed, temporary code must be
@@ -99,16 +224,19 @@ class ClientDescriptor:
         self.current_handler_id: int | None = None
         self.current_client_name: str | None = None
         self.event_queue = event_queue
-        self.event_types = event_types
+        self.event_types = (
+            None if event_types is None else intern_event_types(frozenset(event_types))
+        )
         self.last_connection_time = time.time()
         self.apply_markdown = apply_markdown
         self.client_gravatar = client_gravatar
         self.slim_presence = slim_presence
         self.all_public_streams = all_public_streams
-        self.client_type_name = client_type_name
+        self.client_type_name = sys.intern(client_type_name)
         self._timeout_handle: Any = None  # TODO: should be return type of ioloop.call_later
-        self.narrow = narrow
-        self.narrow_predicate = build_narrow_predicate(modern_narrow)
+        self.narrow = narrow_tuple
+        self.narrow_predicate = get_narrow_predicate(narrow_tuple)
+        self.channel_narrow_key = get_channel_narrow_key(realm_id, modern_narrow)
         self.bulk_message_deletion = bulk_message_deletion
         self.stream_typing_notifications = stream_typing_notifications
         self.user_settings_object = user_settings_object
@@ -118,6 +246,8 @@ class ClientDescriptor:
         self.include_deactivated_groups = include_deactivated_groups
         self.archived_channels = archived_channels
         self.empty_topic_name = empty_topic_name
+        # Set once the queue exceeds its size limits; see overflow().
+        self.overflowed = False
 
         # Default for lifespan_secs is DEFAULT_EVENT_QUEUE_TIMEOUT_SECS;
         # but users can set it as high as MAX_QUEUE_TIMEOUT_SECS.
@@ -131,16 +261,17 @@ class ClientDescriptor:
         # loading event queues that lack that key.
         return dict(
             user_profile_id=self.user_profile_id,
+            user_recipient_id=self.user_recipient_id,
             realm_id=self.realm_id,
             event_queue=self.event_queue.to_dict(),
             queue_timeout=self.queue_timeout,
-            event_types=self.event_types,
+            event_types=None if self.event_types is None else sorted(self.event_types),
             last_connection_time=self.last_connection_time,
             apply_markdown=self.apply_markdown,
             client_gravatar=self.client_gravatar,
             slim_presence=self.slim_presence,
             all_public_streams=self.all_public_streams,
-            narrow=self.narrow,
+            narrow=[list(term) for term in self.narrow],
             client_type_name=self.client_type_name,
             bulk_message_deletion=self.bulk_message_deletion,
             stream_typing_notifications=self.stream_typing_notifications,
@@ -195,16 +326,76 @@ class ClientDescriptor:
         ret.last_connection_time = d["last_connection_time"]
         return ret
 
-    def add_event(self, event: Mapping[str, Any]) -> None:
+    def restart_current_handler_timer(self) -> None:
         if self.current_handler_id is not None:
             handler = get_handler_by_id(self.current_handler_id)
             if handler is not None:
                 assert handler._request is not None
                 async_request_timer_restart(handler._request)
 
-        self.event_queue.push(event)
+    def add_event(self, event: Mapping[str, Any], size: int | None = None) -> None:
+        if self.overflowed:
+            return
+        self.restart_current_handler_timer()
+        self.event_queue.push(event, size)
+        self.finish_current_handler_for_new_events()
+
+    def add_message_event(
+        self,
+        payload: "SharedMessagePayload",
+        *,
+        flags: Collection[str],
+        internal_data: dict[str, Any] | None,
+        local_message_id: str | None,
+    ) -> None:
+        if self.overflowed:
+            return
+        self.restart_current_handler_timer()
+        self.event_queue.push_message(
+            payload,
+            flags=flags,
+            internal_data=internal_data,
+            local_message_id=local_message_id,
+        )
+        self.finish_current_handler_for_new_events()
+
+    def finish_current_handler_for_new_events(self) -> None:
+        if self.current_handler_id is None:
+            # Nobody is polling this queue, so it may be accumulating
+            # events without bound.
+            if self.event_queue.exceeds_size_limits():
+                self.overflow()
+            return
+        if deferred_finish_clients is not None:
+            # We're processing a batch of notices; the handler will be
+            # finished, with all of the events it received from the
+            # batch, once the whole batch has been processed.
+            deferred_finish_clients[self.event_queue.id] = self
+            return
         self.finish_current_handler()
 
+    def overflow(self) -> None:
+        """Marks this queue, which has exceeded its size limits, to be
+        garbage-collected once the current notice has been processed.
+
+        Until then, it ignores new events, and when the client next
+        polls, it gets a BAD_EVENT_QUEUE_ID error, and so reloads its
+        state from the server; we do this rather than dropping events,
+        which would leave the client's state silently inconsistent.
+        """
+        global overflowed_queue_count
+        logging.info(
+            "Event queue %s (%d via %s) exceeded its size limits with %d events (%d bytes)",
+            self.event_queue.id,
+            self.user_profile_id,
+            self.client_type_name,
+            len(self.event_queue.queue),
+            self.event_queue.queued_bytes,
+        )
+        self.overflowed = True
+        overflowed_queue_count += 1
+        overflowed_clients[self.event_queue.id] = self
+
     def finish_current_handler(self) -> bool:
         if self.current_handler_id is None:
             return False
@@ -212,7 +403,7 @@ class ClientDescriptor:
             finish_handler(
                 self.current_handler_id,
                 self.event_queue.id,
-                self.event_queue.contents(),
+                self.event_queue.contents(preserialized=True),
             )
         except Exception:
             logging.exception(
@@ -274,10 +465,14 @@ class ClientDescriptor:
     def accepts_messages(self) -> bool:
         return self.event_types is None or "message" in self.event_types
 
+    def accepts_message_event(self, message: Mapping[str, Any], flags: Collection[str]) -> bool:
+        # Equivalent to accepts_event for a message event, without
+        # requiring the caller to build the event dictionary.
+        return self.accepts_messages() and self.narrow_predicate(message=message, flags=flags)
+
     def expired(self, now: float) -> bool:
-        return (
-            self.current_handler_id is None
-            and now - self.last_connection_time >= self.queue_timeout
+        return self.current_handler_id is None and (
+            self.overflowed or now - self.last_connection_time >= self.queue_timeout
         )
 
     def connect_handler(self, handler_id: int, client_name: str) -> None:
@@ -300,6 +495,7 @@ class ClientDescriptor:
     def disconnect_handler(self, client_closed: bool = False) -> None:
         if self.current_handler_id:
             clear_descriptor_by_handler_id(self.current_handler_id)
+            longpoll_hold_seconds.observe(time.time() - self.last_connection_time)
             if client_closed:
                 logging.info(
                     "Client disconnected for queue %s (%s via %s)",
@@ -334,17 +530,248 @@ def compute_full_event_type(event: Mapping[str, Any]) -> str:
     return event["type"]
 
 
+# Virtual events (see EventQueue.push) let a queue store a run of
+# events which describe successive changes to the same thing as a
+# single event, which keeps the queues of clients that are offline for
+# a while small.  Each kind of event that can be coalesced has a key,
+# naming what it changes, and a rule for merging an event into the
+# virtual event with the same key.
+#
+# A virtual event is delivered at the position of the last event
+# merged into it; this is correct because the coalesced event types
+# commute with the other events in the queue, except for those listed
+# by get_conflicting_virtual_event_keys.
+def get_virtual_event_key(event: Mapping[str, Any]) -> str | None:
+    event_type = event["type"]
+    if event_type == "update_message_flags":
+        if event["all"]:
+            return None
+        return compute_full_event_type(event)
+    if event_type == "typing":
+        if event["message_type"] == "stream":
+            # The topic is last, since it may contain slashes.
+            return "typing/{}/stream/{}/{}".format(
+                event["sender"]["user_id"], event["stream_id"], event["topic"]
+            )
+        recipient_ids = sorted(recipient["user_id"] for recipient in event["recipients"])
+        return "typing/{}/direct/{}".format(
+            event["sender"]["user_id"], ",".join(map(str, recipient_ids))
+        )
+    if event_type == "typing_edit_message":
+        return "typing_edit_message/{}/{}".format(event["sender_id"], event["message_id"])
+    if event_type == "presence":
+        return "presence/{}".format(event["user_id"])
+    if event_type == "user_settings" and event["op"] == "update":
+        return "user_settings/{}".format(event["property"])
+    if event_type == "update_display_settings":
+        return "update_display_settings/{}".format(event["setting_name"])
+    if event_type == "update_global_notifications":
+        return "update_global_notifications/{}".format(event["notification_name"])
+    return None
+
+
+def get_conflicting_virtual_event_keys(event: Mapping[str, Any]) -> list[str]:
+    """Returns the keys of the virtual events which must be delivered
+    before this event, rather than coalesced with later events."""
+    if event["type"] == "update_message_flags":
+        # Adding and removing the same flag don't commute; e.g. a
+        # message marked as read, then unread, must end up unread.
+        opposite_operation = "remove" if event["operation"] == "add" else "add"
+        return ["flags/{}/{}".format(opposite_operation, event["flag"])]
+    if event["type"] == "realm_user" and event["op"] == "remove":
+        return ["presence/{}".format(event["person"]["user_id"])]
+    return []
+
+
+def merge_message_flags_events(
+    virtual_event: dict[str, Any] | None, event: dict[str, Any]
+) -> dict[str, Any]:
+    if virtual_event is None:
+        # The virtual event's lists are extended in place, so it
+        # needs its own copies of them.
+        return copy.deepcopy(event)
+    virtual_event["id"] = event["id"]
+    virtual_event["messages"] += event["messages"]
+    if "message_details" in event:
+        virtual_event["message_details"].update(event["message_details"])
+    if "timestamp" in event:
+        virtual_event["timestamp"] = event["timestamp"]
+    return virtual_event
+
+
+def merge_presence_events(
+    virtual_event: dict[str, Any] | None, event: dict[str, Any]
+) -> dict[str, Any]:
+    if virtual_event is None:
+        return event
+    # Presence events contain the user's presence for one or more
+    # clients; the merged event contains the latest for each.
+    return {**event, "presence": {**virtual_event["presence"], **event["presence"]}}
+
+
+def replace_virtual_event(
+    virtual_event: dict[str, Any] | None, event: dict[str, Any]
+) -> dict[str, Any]:
+    # For events which contain the new state, such as the value of a
+    # setting, only the latest one matters.
+    return event
+
+
+VIRTUAL_EVENT_MERGERS: dict[
+    str, Callable[[dict[str, Any] | None, dict[str, Any]], dict[str, Any]]
+] = {
+    "presence": merge_presence_events,
+    "typing": replace_virtual_event,
+    "typing_edit_message": replace_virtual_event,
+    "update_display_settings": replace_virtual_event,
+    "update_global_notifications": replace_virtual_event,
+    "update_message_flags": merge_message_flags_events,
+    "user_settings": replace_virtual_event,
+}
+
+
+class SharedMessagePayload:
+    """The finalized message dictionary for one get_client_payload
+    variant of a message event.
+
+    A single instance is shared by reference between every event
+    queue that receives the message, so that fanning a message out
+    to N queues does not require N copies of the event dictionary.
+    The message dictionary must not be mutated once the payload has
+    been created.
+
+    Since the same payload is often sent to thousands of clients, we
+    also cache its JSON encoding, which API responses splice in as an
+    orjson.Fragment; a broadcast message thus costs one encode rather
+    than one per client.
+    """
+
+    __slots__ = ("_encoded_message", "encoded_size", "message")
+
+    def __init__(self, message: dict[str, Any]) -> None:
+        self.message = message
+        self._encoded_message: orjson.Fragment | None = None
+        self.encoded_size = 0
+
+    def encoded_message(self) -> orjson.Fragment:
+        if self._encoded_message is None:
+            encoded = orjson.dumps(self.message)
+            self._encoded_message = orjson.Fragment(encoded)
+            self.encoded_size = len(encoded)
+        return self._encoded_message
+
+
+class QueuedMessageEvent:
+    """A message event stored in an EventQueue: a reference to the
+    SharedMessagePayload, plus the small per-client part of the
+    event.  The event dictionary is only built by to_dict, when the
+    event is actually returned to the client.
+    """
+
+    __slots__ = ("flags", "id", "internal_data", "local_message_id", "payload")
+
+    def __init__(
+        self,
+        *,
+        id: int,
+        payload: SharedMessagePayload,
+        flags: Collection[str],
+        internal_data: dict[str, Any] | None,
+        local_message_id: str | None,
+    ) -> None:
+        self.id = id
+        self.payload = payload
+        self.flags = flags
+        self.internal_data = internal_data
+        self.local_message_id = local_message_id
+
+    def to_dict(
+        self, include_internal_data: bool = True, preserialized: bool = False
+    ) -> dict[str, Any]:
+        message = self.payload.encoded_message() if preserialized else self.payload.message
+        event: dict[str, Any] = dict(type="message", message=message, flags=self.flags)
+        if include_internal_data and self.internal_data is not None:
+            event["internal_data"] = self.internal_data
+        if self.local_message_id is not None:
+            event["local_message_id"] = self.local_message_id
+        event["id"] = self.id
+        return event
+
+
+def queued_event_id(event: dict[str, Any] | QueuedMessageEvent) -> int:
+    if isinstance(event, QueuedMessageEvent):
+        return event.id
+    return event["id"]
+
+
+# The same event templates are usually pushed to many queues in a
+# row, interleaved with the other variants of the same notice (e.g. slim
+# and legacy presence events), so we cache the sizes of the most
+# recently sized events, by identity.  Each entry keeps a reference to
+# its event, so that its id cannot be reused while it is cached.
+MAX_SIZED_EVENTS = 8
+sized_events: dict[int, tuple[Mapping[str, Any], int]] = {}
+
+
+def get_event_size(event: Mapping[str, Any] | QueuedMessageEvent) -> int:
+    """Returns the approximate size of the event, as encoded in an API
+    response, for enforcing settings.EVENT_QUEUE_MAX_BYTES."""
+    if isinstance(event, QueuedMessageEvent):
+        event.payload.encoded_message()
+        return event.payload.encoded_size
+    cached = sized_events.get(id(event))
+    if cached is not None and cached[0] is event:
+        return cached[1]
+    # This is only an estimate, so we don't fail on values which the
+    # API response encoding would handle differently.
+    size = len(orjson.dumps(event, default=str))
+    if len(sized_events) >= MAX_SIZED_EVENTS:
+        del sized_events[next(iter(sized_events))]
+    sized_events[id(event)] = (event, size)
+    return size
+
+
+# An empty deque takes about 600 bytes, more than the rest of an idle
+# event queue; queues without any events share this empty tuple, and
+# only allocate a deque when they receive an event.  EventQueue.queue
+# is thus a deque if and only if it is nonempty.
+EMPTY_QUEUE: tuple[()] = ()
+
+# Likewise, queues without virtual events share this empty mapping as
+# both virtual_events and virtual_event_sizes, which are dicts if and
+# only if the queue has had a virtual event since it was last fetched.
+EMPTY_VIRTUAL_EVENTS: Mapping[str, Any] = MappingProxyType({})
+
+
 class EventQueue:
+    __slots__ = (
+        "event_sizes",
+        "id",
+        "newest_pruned_id",
+        "next_event_id",
+        "queue",
+        "queued_bytes",
+        "virtual_event_sizes",
+        "virtual_events",
+    )
+
     def __init__(self, id: str) -> None:
         # When extending this list of properties, one must be sure to
         # update to_dict and from_dict.
 
-        self.queue: deque[dict[str, Any]] = deque()
+        self.queue: deque[dict[str, Any] | QueuedMessageEvent] | tuple[()] = EMPTY_QUEUE
         self.next_event_id: int = 0
         # will only be None for migration from old versions
         self.newest_pruned_id: int | None = -1
         self.id: str = id
-        self.virtual_events: dict[str, dict[str, Any]] = {}
+        self.virtual_events: Mapping[str, dict[str, Any]] = EMPTY_VIRTUAL_EVENTS
+        # The approximate sizes of the events in the queue, in the same
+        # order, and of the virtual events, which are the sums of the
+        # sizes of the events merged into them; queued_bytes is their
+        # total.  See exceeds_size_limits.
+        self.event_sizes: deque[int] | tuple[()] = EMPTY_QUEUE
+        self.virtual_event_sizes: Mapping[str, int] = EMPTY_VIRTUAL_EVENTS
+        self.queued_bytes = 0
 
     def to_dict(self) -> dict[str, Any]:
         # If you add a new key to this dict, make sure you add appropriate
@@ -353,8 +780,13 @@ class EventQueue:
         d = dict(
             id=self.id,
             next_event_id=self.next_event_id,
-            queue=list(self.queue),
-            virtual_events=self.virtual_events,
+            queue=[
+                event.to_dict() if isinstance(event, QueuedMessageEvent) else event
+                for event in self.queue
+            ],
+            virtual_events=dict(self.virtual_events),
+            event_sizes=list(self.event_sizes),
+            virtual_event_sizes=dict(self.virtual_event_sizes),
         )
         if self.newest_pruned_id is not None:
             d["newest_pruned_id"] = self.newest_pruned_id
@@ -365,103 +797,209 @@ class EventQueue:
         ret = cls(d["id"])
         ret.next_event_id = d["next_event_id"]
         ret.newest_pruned_id = d.get("newest_pruned_id")
-        ret.queue = deque(d["queue"])
-        ret.virtual_events = d.get("virtual_events", {})
+        if d["queue"]:
+            ret.queue = deque(d["queue"])
+        # Queues saved by older versions don't record the event sizes.
+        event_sizes = d.get("event_sizes")
+        if event_sizes is None:
+            event_sizes = [get_event_size(event) for event in ret.queue]
+        if event_sizes:
+            ret.event_sizes = deque(event_sizes)
+        virtual_events = d.get("virtual_events")
+        if virtual_events:
+            ret.virtual_events = virtual_events
+            virtual_event_sizes = d.get("virtual_event_sizes")
+            if virtual_event_sizes is None:
+                virtual_event_sizes = {
+                    key: get_event_size(event) for key, event in virtual_events.items()
+                }
+            ret.virtual_event_sizes = virtual_event_sizes
+        ret.queued_bytes = sum(ret.event_sizes) + sum(ret.virtual_event_sizes.values())
         return ret
 
-    def push(self, orig_event: Mapping[str, Any]) -> None:
+    def push(self, orig_event: Mapping[str, Any], size: int | None = None) -> None:
         # By default, we make a shallow copy of the event dictionary
         # to push into the target event queue; this allows the calling
         # code to send the same "event" object to multiple queues.
         # This behavior is important because the event_queue system is
         # about to mutate the event dictionary, minimally to add the
         # event_id attribute.
+        #
+        # Callers pushing per-queue copies of a shared template pass
+        # its size, to avoid sizing each copy.
         event = dict(orig_event)
+        events_pushed[event["type"]] += 1
+        if size is None:
+            size = get_event_size(orig_event)
+        self.queued_bytes += size
+        for key in get_conflicting_virtual_event_keys(event):
+            if key in self.virtual_events:
+                self.flush_virtual_event(key)
         event["id"] = self.next_event_id
         self.next_event_id += 1
-        full_event_type = compute_full_event_type(event)
-        if full_event_type.startswith("flags/") and not full_event_type.startswith(
-            "flags/remove/read"
-        ):
-            # virtual_events are an optimization that allows certain
-            # simple events, such as update_message_flags events that
-            # simply contain a list of message IDs to operate on, to
-            # be compressed together. This is primarily useful for
-            # flags/add/read, where normal Zulip usage will result in
-            # many small flags/add/read events as users scroll.
-            #
-            # We need to exclude flags/remove/read, because it has an
-            # extra message_details field that cannot be compressed.
-            #
-            # BUG: This compression algorithm is incorrect in the
-            # presence of mark-as-unread, since it does not respect
-            # the ordering of "mark as read" and "mark as unread"
-            # updates for a given message.
-            if full_event_type not in self.virtual_events:
-                self.virtual_events[full_event_type] = copy.deepcopy(event)
-                return
-
-            # Update the virtual event with the values from the event
-            virtual_event = self.virtual_events[full_event_type]
-            virtual_event["id"] = event["id"]
-            virtual_event["messages"] += event["messages"]
-            if "timestamp" in event:
-                virtual_event["timestamp"] = event["timestamp"]
 
-        else:
-            self.queue.append(event)
+        virtual_event_key = get_virtual_event_key(event)
+        if virtual_event_key is None:
+            self.append(event, size)
+            return
+
+        # virtual_events are an optimization that allows runs of
+        # certain events, such as update_message_flags events that
+        # simply contain a list of message IDs to operate on, to be
+        # compressed together. This is primarily useful for
+        # flags/add/read, where normal Zulip usage will result in many
+        # small flags/add/read events as users scroll, and for typing
+        # and presence events, which pile up in the queues of
+        # offline clients.  See get_virtual_event_key for details.
+        if not isinstance(self.virtual_events, dict):
+            self.virtual_events = {}
+            self.virtual_event_sizes = {}
+        assert isinstance(self.virtual_event_sizes, dict)
+        merge = VIRTUAL_EVENT_MERGERS[event["type"]]
+        self.virtual_events[virtual_event_key] = merge(
+            self.virtual_events.get(virtual_event_key), event
+        )
+        self.virtual_event_sizes[virtual_event_key] = (
+            self.virtual_event_sizes.get(virtual_event_key, 0) + size
+        )
+
+    def flush_virtual_event(self, key: str) -> None:
+        # The virtual event commutes with all of the events pushed
+        # since it was created, so we can deliver it now, rather than
+        # at its current position; we give it a new ID accordingly.
+        assert isinstance(self.virtual_events, dict)
+        assert isinstance(self.virtual_event_sizes, dict)
+        virtual_event = self.virtual_events.pop(key)
+        virtual_event["id"] = self.next_event_id
+        self.next_event_id += 1
+        self.append(virtual_event, self.virtual_event_sizes.pop(key))
+
+    def append(self, event: dict[str, Any] | QueuedMessageEvent, size: int) -> None:
+        if not isinstance(self.queue, deque):
+            self.queue = deque()
+            self.event_sizes = deque()
+        assert isinstance(self.event_sizes, deque)
+        self.queue.append(event)
+        self.event_sizes.append(size)
+
+    def push_message(
+        self,
+        payload: SharedMessagePayload,
+        *,
+        flags: Collection[str],
+        internal_data: dict[str, Any] | None,
+        local_message_id: str | None,
+    ) -> None:
+        # Message events are never collapsed, and the payload is
+        # shared with other queues, so rather than copying an event
+        # dictionary as push does, we just store a reference to it.
+        event = QueuedMessageEvent(
+            id=self.next_event_id,
+            payload=payload,
+            flags=flags,
+            internal_data=internal_data,
+            local_message_id=local_message_id,
+        )
+        events_pushed["message"] += 1
+        size = get_event_size(event)
+        self.queued_bytes += size
+        self.append(event, size)
+        self.next_event_id += 1
 
     # Note that pop ignores virtual events.  This is fine in our
     # current usage since virtual events should always be resolved to
     # a real event before being given to users.
-    def pop(self) -> dict[str, Any]:
-        return self.queue.popleft()
+    def pop(self) -> dict[str, Any] | QueuedMessageEvent:
+        assert isinstance(self.queue, deque)
+        assert isinstance(self.event_sizes, deque)
+        event = self.queue.popleft()
+        self.queued_bytes -= self.event_sizes.popleft()
+        if len(self.queue) == 0:
+            self.queue = EMPTY_QUEUE
+            self.event_sizes = EMPTY_QUEUE
+        return event
 
     def empty(self) -> bool:
         return len(self.queue) == 0 and len(self.virtual_events) == 0
 
+    def exceeds_size_limits(self) -> bool:
+        return (
+            len(self.queue) > settings.EVENT_QUEUE_MAX_EVENTS
+            or self.queued_bytes > settings.EVENT_QUEUE_MAX_BYTES
+        )
+
     # See the comment on pop; that applies here as well
     def prune(self, through_id: int) -> None:
-        while len(self.queue) != 0 and self.queue[0]["id"] <= through_id:
-            self.newest_pruned_id = self.queue[0]["id"]
+        while isinstance(self.queue, deque) and queued_event_id(self.queue[0]) <= through_id:
+            self.newest_pruned_id = queued_event_id(self.queue[0])
             self.pop()
 
-    def contents(self, include_internal_data: bool = False) -> list[dict[str, Any]]:
-        contents: list[dict[str, Any]] = []
-        virtual_id_map: dict[str, dict[str, Any]] = {}
-        for event_type in self.virtual_events:
-            virtual_id_map[self.virtual_events[event_type]["id"]] = self.virtual_events[event_type]
+    def contents(
+        self, include_internal_data: bool = False, preserialized: bool = False
+    ) -> list[dict[str, Any]]:
+        """Returns the events in the queue, in order.
+
+        With preserialized=True, message payloads are returned as
+        orjson.Fragment objects holding their cached JSON encoding;
+        this is intended for events that are only going to be
+        serialized into an API response.
+        """
+        contents: list[dict[str, Any] | QueuedMessageEvent] = []
+        sizes: list[int] = []
+        virtual_id_map: dict[int, str] = {}
+        for key, virtual_event in self.virtual_events.items():
+            virtual_id_map[virtual_event["id"]] = key
         virtual_ids = sorted(virtual_id_map.keys())
 
         # Merge the virtual events into their final place in the queue
         index = 0
         length = len(virtual_ids)
-        for event in self.queue:
-            while index < length and virtual_ids[index] < event["id"]:
-                contents.append(virtual_id_map[virtual_ids[index]])
+        for event, size in zip(self.queue, self.event_sizes, strict=True):
+            while index < length and virtual_ids[index] < queued_event_id(event):
+                key = virtual_id_map[virtual_ids[index]]
+                contents.append(self.virtual_events[key])
+                sizes.append(self.virtual_event_sizes[key])
                 index += 1
             contents.append(event)
+            sizes.append(size)
         while index < length:
-            contents.append(virtual_id_map[virtual_ids[index]])
+            key = virtual_id_map[virtual_ids[index]]
+            contents.append(self.virtual_events[key])
+            sizes.append(self.virtual_event_sizes[key])
             index += 1
 
-        self.virtual_events = {}
-        self.queue = deque(contents)
-
+        self.virtual_events = EMPTY_VIRTUAL_EVENTS
+        self.virtual_event_sizes = EMPTY_VIRTUAL_EVENTS
+        self.queue = deque(contents) if contents else EMPTY_QUEUE
+        self.event_sizes = deque(sizes) if sizes else EMPTY_QUEUE
+
+        events = [
+            event.to_dict(include_internal_data, preserialized)
+            if isinstance(event, QueuedMessageEvent)
+            else event
+            for event in contents
+        ]
         if include_internal_data:
-            return contents
-        return prune_internal_data(contents)
+            return events
+        return prune_internal_data(events)
 
 
 def prune_internal_data(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
     """Prunes the internal_data data structures, which are not intended to
     be exposed to API clients.
+
+    We only make shallow copies of the events here; in particular,
+    message payloads are shared between every queue that received
+    the message, so deep-copying them for every client would defeat
+    the point of sharing them.
     """
-    events = copy.deepcopy(events)
+    pruned_events = []
     for event in events:
-        if event["type"] == "message" and "internal_data" in event:
-            del event["internal_data"]
-    return events
+        event = dict(event)
+        if event["type"] == "message":
+            event.pop("internal_data", None)
+        pruned_events.append(event)
+    return pruned_events
 
 
 # Queue-ids which still need to be sent a web_reload_client event.
@@ -473,8 +1011,20 @@ web_reload_clients: dict[str, Literal[True]] = {}
 clients: dict[str, ClientDescriptor] = {}
 # maps user id to list of client descriptors
 user_clients: dict[int, list[ClientDescriptor]] = {}
-# maps realm id to list of client descriptors with all_public_streams=True
+# maps realm id to list of client descriptors with all_public_streams=True,
+# or with a narrow that does not restrict them to a single channel
 realm_clients_all_streams: dict[int, list[ClientDescriptor]] = {}
+# maps ChannelNarrowKey to list of message-receiving client descriptors
+# whose narrow restricts them to that channel (and topic); see
+# get_channel_narrow_key.
+clients_by_channel_narrow: dict[ChannelNarrowKey, list[ClientDescriptor]] = {}
+
+# Event queues which were read from disk at startup, but which have not
+# yet been deserialized; maps queue ids to the queue's user id and its
+# line in the stored event queues file.  See load_event_queues.
+pending_client_data: dict[str, tuple[int, bytes]] = {}
+# maps user id to the set of queue ids in pending_client_data
+pending_queue_ids_by_user: dict[int, set[str]] = {}
 
 # list of registered gc hooks.
 # each one will be called with a user profile id, queue, and bool
@@ -490,6 +1040,13 @@ def clear_client_event_queues_for_testing() -> None:
     web_reload_clients.clear()
     user_clients.clear()
     realm_clients_all_streams.clear()
+    clients_by_channel_narrow.clear()
+    pending_client_data.clear()
+    pending_queue_ids_by_user.clear()
+    migrated_user_ports.clear()
+    held_migration_notices.clear()
+    locally_hosted_user_ids.clear()
+    overflowed_clients.clear()
     gc_hooks.clear()
 
 
@@ -499,7 +1056,9 @@ def add_client_gc_hook(hook: Callable[[int, ClientDescriptor, bool], None]) -> N
 
 def access_client_descriptor(user_id: int, queue_id: str) -> ClientDescriptor:
     client = clients.get(queue_id)
-    if client is not None:
+    if client is None and queue_id in pending_client_data:
+        client = load_pending_client_descriptor(queue_id)
+    if client is not None and not client.overflowed:
         if user_id == client.user_profile_id:
             return client
         logging.warning(
@@ -513,6 +1072,9 @@ def access_client_descriptor(user_id: int, queue_id: str) -> ClientDescriptor:
 
 
 def get_client_descriptors_for_user(user_profile_id: int) -> list[ClientDescriptor]:
+    if user_profile_id in pending_queue_ids_by_user:
+        for queue_id in list(pending_queue_ids_by_user[user_profile_id]):
+            load_pending_client_descriptor(queue_id)
     return user_clients.get(user_profile_id, [])
 
 
@@ -520,9 +1082,20 @@ def get_client_descriptors_for_realm_all_streams(realm_id: int) -> list[ClientDe
     return realm_clients_all_streams.get(realm_id, [])
 
 
+def get_client_descriptors_for_channel_narrow(key: ChannelNarrowKey) -> list[ClientDescriptor]:
+    return clients_by_channel_narrow.get(key, [])
+
+
 def add_to_client_dicts(client: ClientDescriptor) -> None:
     user_clients.setdefault(client.user_profile_id, []).append(client)
-    if client.all_public_streams or client.narrow != []:
+    if client.channel_narrow_key is not None:
+        # Queues narrowed to a channel are indexed by that channel, so
+        # that delivering a message only considers the queues whose
+        # narrow could match it.  Queues that do not receive message
+        # events will never receive a message via this index.
+        if client.accepts_messages():
+            clients_by_channel_narrow.setdefault(client.channel_narrow_key, []).append(client)
+    elif client.all_public_streams or len(client.narrow) != 0:
         realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
 
 
@@ -536,10 +1109,14 @@ def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> Clie
 
 
 def do_gc_event_queues(
-    to_remove: AbstractSet[str], affected_users: AbstractSet[int], affected_realms: AbstractSet[int]
+    to_remove: AbstractSet[str],
+    affected_users: AbstractSet[int],
+    affected_realms: AbstractSet[int],
+    *,
+    run_gc_hooks: bool = True,
 ) -> None:
     def filter_client_dict(
-        client_dict: MutableMapping[int, list[ClientDescriptor]], key: int
+        client_dict: MutableMapping[Any, list[ClientDescriptor]], key: Any
     ) -> None:
         if key not in client_dict:
             return
@@ -556,14 +1133,22 @@ def do_gc_event_queues(
     for realm_id in affected_realms:
         filter_client_dict(realm_clients_all_streams, realm_id)
 
+    for channel_narrow_key in {
+        clients[id].channel_narrow_key
+        for id in to_remove
+        if clients[id].channel_narrow_key is not None
+    }:
+        filter_client_dict(clients_by_channel_narrow, channel_narrow_key)
+
     for id in to_remove:
         web_reload_clients.pop(id, None)
-        for cb in gc_hooks:
-            cb(
-                clients[id].user_profile_id,
-                clients[id],
-                clients[id].user_profile_id not in user_clients,
-            )
+        if run_gc_hooks:
+            for cb in gc_hooks:
+                cb(
+                    clients[id].user_profile_id,
+                    clients[id],
+                    clients[id].user_profile_id not in user_clients,
+                )
         del clients[id]
 
 
@@ -588,12 +1173,13 @@ def gc_event_queues(port: int) -> None:
     if settings.PRODUCTION:
         logging.info(
             "Tornado %d removed %d expired event queues owned by %d users in %.3fs."
-            "  Now %d active queues, %s",
+            "  Now %d active queues, %d removed for exceeding size limits since startup, %s",
             port,
             len(to_remove),
             len(affected_users),
             time.time() - start,
             len(clients),
+            overflowed_queue_count,
             handler_stats_string(),
         )
 
@@ -609,66 +1195,188 @@ def persistent_queue_filename(port: int, last: bool = False) -> str:
     return settings.JSON_PERSISTENT_QUEUE_FILENAME_PATTERN % ("." + str(port),)
 
 
+# Queues that have exceeded their size limits (see
+# ClientDescriptor.overflow), to be garbage-collected once the current
+# notice has been processed, and the number of them since startup.
+overflowed_clients: dict[str, ClientDescriptor] = {}
+overflowed_queue_count = 0
+
+
+def gc_overflowed_event_queues() -> None:
+    # Overflowed queues are never connected to a handler, since
+    # access_client_descriptor refuses them.
+    to_remove = {id for id in overflowed_clients if id in clients}
+    affected_users = {client.user_profile_id for client in overflowed_clients.values()}
+    affected_realms = {client.realm_id for client in overflowed_clients.values()}
+    overflowed_clients.clear()
+    do_gc_event_queues(to_remove, affected_users, affected_realms)
+
+
+# Event queues are stored on disk with one queue per line, so that
+# neither dumping nor loading them requires encoding or decoding every
+# queue on the server as a single (potentially multi-GB) JSON
+# document.  Each line is a small JSON header, a tab, and then the
+# JSON-encoded ClientDescriptor; the header lets us index a queue by
+# its id and user without decoding the (much larger) queue itself.
+#
+# Queues are written sorted by realm ID, so that as they are loaded,
+# web_reload_clients remains sorted by realm ID.
+def encode_stored_client(client: ClientDescriptor) -> bytes:
+    header = orjson.dumps(
+        [
+            client.event_queue.id,
+            client.user_profile_id,
+            client.all_public_streams or len(client.narrow) != 0,
+        ]
+    )
+    return header + b"\t" + orjson.dumps(client.to_dict()) + b"\n"
+
+
 def dump_event_queues(port: int) -> None:
     start = time.perf_counter()
 
     with open(persistent_queue_filename(port), "wb") as stored_queues:
-        stored_queues.write(
-            orjson.dumps([(qid, client.to_dict()) for (qid, client) in clients.items()])
+        stored_queues.writelines(
+            encode_stored_client(client)
+            for client in sorted(clients.values(), key=lambda client: client.realm_id)
         )
+        # Queues which we have not finished loading since the last
+        # restart are written back out unchanged.
+        stored_queues.writelines(line for _user_profile_id, line in pending_client_data.values())
 
     if len(clients) > 0 or settings.PRODUCTION:
         logging.info(
             "Tornado %d dumped %d event queues in %.3fs",
             port,
-            len(clients),
+            len(clients) + len(pending_client_data),
             time.perf_counter() - start,
         )
 
 
+def add_loaded_client_descriptor(client: ClientDescriptor) -> None:
+    # Put code for migrations due to event queue data format changes here
+
+    clients[client.event_queue.id] = client
+    add_to_client_dicts(client)
+    mark_clients_to_reload([client.event_queue.id])
+
+
 def load_event_queues(port: int) -> None:
-    global clients
+    """Reads the event queues stored on disk by dump_event_queues.
+
+    Only the queues which receive events for a whole realm (see
+    realm_clients_all_streams) are deserialized immediately; the rest
+    are stored in pending_client_data, to be deserialized either in
+    the background by load_pending_event_queues, or on demand when
+    the queue or its user is first accessed.  This lets Tornado start
+    handling requests without waiting for every queue to load.
+    """
     start = time.perf_counter()
 
     try:
         with open(persistent_queue_filename(port), "rb") as stored_queues:
-            data = orjson.loads(stored_queues.read())
+            if stored_queues.read(2) in (b"[[", b"[]"):
+                # TODO/compatibility: Servers running older versions
+                # stored the queues as a single JSON list of (queue_id,
+                # client) pairs.  Remove this when one can no longer
+                # directly upgrade from 11.x to main.  (Lines in the
+                # current format start with their header, '["'.)
+                stored_queues.seek(0)
+                data = orjson.loads(stored_queues.read())
+                loaded_clients = {qid: ClientDescriptor.from_dict(client) for (qid, client) in data}
+                clients.update(loaded_clients)
+                mark_clients_to_reload(clients.keys())
+                for client in clients.values():
+                    add_to_client_dicts(client)
+            else:
+                stored_queues.seek(0)
+                for line in stored_queues:
+                    header, client_data = line.split(b"\t", 1)
+                    qid, user_profile_id, all_streams = orjson.loads(header)
+                    if all_streams:
+                        add_loaded_client_descriptor(
+                            ClientDescriptor.from_dict(orjson.loads(client_data))
+                        )
+                    else:
+                        pending_client_data[qid] = (user_profile_id, line)
+                        pending_queue_ids_by_user.setdefault(user_profile_id, set()).add(qid)
     except FileNotFoundError:
         pass
-    except orjson.JSONDecodeError:
+    except Exception:
         logging.exception("Tornado %d could not deserialize event queues", port, stack_info=True)
-    else:
-        try:
-            clients = {qid: ClientDescriptor.from_dict(client) for (qid, client) in data}
-        except Exception:
-            logging.exception(
-                "Tornado %d could not deserialize event queues", port, stack_info=True
-            )
 
-    mark_clients_to_reload(clients.keys())
+    if len(clients) > 0 or len(pending_client_data) > 0 or settings.PRODUCTION:
+        logging.info(
+            "Tornado %d loaded %d event queues, and read %d more, in %.3fs",
+            port,
+            len(clients),
+            len(pending_client_data),
+            time.perf_counter() - start,
+        )
 
-    for client in clients.values():
-        # Put code for migrations due to event queue data format changes here
 
-        add_to_client_dicts(client)
+def load_pending_client_descriptor(queue_id: str) -> ClientDescriptor | None:
+    if queue_id not in pending_client_data:
+        return None
+    user_profile_id, line = pending_client_data.pop(queue_id)
+    user_queue_ids = pending_queue_ids_by_user[user_profile_id]
+    user_queue_ids.discard(queue_id)
+    if len(user_queue_ids) == 0:
+        del pending_queue_ids_by_user[user_profile_id]
 
-    if len(clients) > 0 or settings.PRODUCTION:
+    try:
+        client = ClientDescriptor.from_dict(orjson.loads(line.split(b"\t", 1)[1]))
+    except Exception:
+        logging.exception("Could not deserialize event queue %s", queue_id, stack_info=True)
+        return None
+
+    add_loaded_client_descriptor(client)
+    # Queues loaded after startup did not receive the restart event
+    # sent by setup_event_queue, so we send it now.
+    event = create_restart_event()
+    if client.accepts_event(event):
+        client.add_event(event)
+    return client
+
+
+# Number of event queues to deserialize between yields to the IOLoop.
+PENDING_QUEUE_LOAD_BATCH_SIZE = 1000
+
+
+async def load_pending_event_queues(port: int, send_reloads: bool) -> None:
+    start = time.perf_counter()
+    count = 0
+    while len(pending_client_data) > 0:
+        for queue_id in list(itertools.islice(pending_client_data, PENDING_QUEUE_LOAD_BATCH_SIZE)):
+            if load_pending_client_descriptor(queue_id) is not None:
+                count += 1
+        # Let the IOLoop handle requests and events between batches.
+        await asyncio.sleep(0)
+
+    if send_reloads:
+        send_web_reload_client_events(immediate=settings.DEVELOPMENT)
+
+    if count > 0 or settings.PRODUCTION:
         logging.info(
-            "Tornado %d loaded %d event queues in %.3fs",
+            "Tornado %d finished loading %d event queues in the background in %.3fs",
             port,
-            len(clients),
+            count,
             time.perf_counter() - start,
         )
 
 
-def send_restart_events() -> None:
-    event: dict[str, Any] = dict(
+def create_restart_event() -> dict[str, Any]:
+    return dict(
         type="restart",
         zulip_version=ZULIP_VERSION,
         zulip_merge_base=ZULIP_MERGE_BASE,
         zulip_feature_level=API_FEATURE_LEVEL,
         server_generation=settings.SERVER_GENERATION,
     )
+
+
+def send_restart_events() -> None:
+    event = create_restart_event()
     for client in clients.values():
         if client.accepts_event(event):
             client.add_event(event)
@@ -718,8 +1426,127 @@ async def setup_event_queue(
     pc.start()
 
     send_restart_events()
-    if send_reloads:
-        send_web_reload_client_events(immediate=settings.DEVELOPMENT)
+    # The remaining queues are loaded in the background; we wait
+    # until they have all been loaded to send any reload events.
+    tornado.ioloop.IOLoop.current().add_callback(load_pending_event_queues, port, send_reloads)
+
+
+# Users whose event queues have been migrated to the Tornado process
+# on another port (see export_user_event_queues), mapped to that port.
+migrated_user_ports: dict[int, int] = {}
+# Notices for users whose event queues are being migrated to a port,
+# which are held until that port has imported the queues.
+held_migration_notices: dict[int, list[dict[str, Any]]] = {}
+# Users whose event queues have been migrated to this process from
+# another port (see import_event_queues), which this process serves
+# even though the sharding configuration does not yet assign them to
+# it; migrated_user_ports takes precedence, if they move on again.
+locally_hosted_user_ids: set[int] = set()
+
+
+def export_user_event_queues(user_ids: Collection[int], target_port: int) -> list[dict[str, Any]]:
+    """Removes the event queues of the given users from this process, and
+    returns them to be imported by the Tornado process on target_port,
+    using import_event_queues.
+
+    This is used to move users between Tornado shards without
+    requiring their clients to reload.  Until the sharding
+    configuration is updated, this process keeps receiving the
+    users' notices and requests; notices are held until
+    forward_held_migration_notices is called, and then forwarded to
+    target_port, and requests are passed along to target_port by
+    zerver.tornado.views.
+    """
+    assert target_port not in held_migration_notices
+    held_migration_notices[target_port] = []
+
+    client_dicts: list[dict[str, Any]] = []
+    to_remove: set[str] = set()
+    affected_realms: set[int] = set()
+    for user_id in user_ids:
+        migrated_user_ports[user_id] = target_port
+        for client in get_client_descriptors_for_user(user_id):
+            # Wake any waiting long-poll, so that the client's next
+            # request is passed along to the target port.
+            client.finish_current_handler()
+            client_dicts.append(client.to_dict())
+            to_remove.add(client.event_queue.id)
+            affected_realms.add(client.realm_id)
+
+    # The queues live on in the target process, so we don't run the
+    # GC hooks, which would e.g. send missed-message notifications.
+    do_gc_event_queues(to_remove, set(user_ids), affected_realms, run_gc_hooks=False)
+    return client_dicts
+
+
+def restore_client_descriptors(client_dicts: Iterable[dict[str, Any]]) -> None:
+    for client_dict in client_dicts:
+        client = ClientDescriptor.from_dict(client_dict)
+        clients[client.event_queue.id] = client
+        add_to_client_dicts(client)
+
+
+def import_event_queues(user_ids: Collection[int], client_dicts: Iterable[dict[str, Any]]) -> None:
+    """Adds the event queues exported from another port by
+    export_user_event_queues to this process, which serves the given
+    users from now on, whether or not they had any queues."""
+    for user_id in user_ids:
+        # The user may be migrating back to this process.
+        migrated_user_ports.pop(user_id, None)
+        locally_hosted_user_ids.add(user_id)
+    restore_client_descriptors(client_dicts)
+
+
+def cancel_event_queue_migration(
+    user_ids: Collection[int], target_port: int, client_dicts: Iterable[dict[str, Any]]
+) -> int:
+    """Undoes export_user_event_queues, if the Tornado process on
+    target_port failed to import the queues: the queues are restored,
+    and the notices held for the users are processed here."""
+    for user_id in user_ids:
+        if migrated_user_ports.get(user_id) == target_port:
+            del migrated_user_ports[user_id]
+    restore_client_descriptors(client_dicts)
+    notices = held_migration_notices.pop(target_port)
+    for notice in notices:
+        process_notification(notice)
+    return len(notices)
+
+
+def forward_held_migration_notices(target_port: int) -> int:
+    notices = held_migration_notices.pop(target_port)
+    for notice in notices:
+        queue_json_publish_rollback_unsafe(notify_tornado_queue_name(target_port), notice)
+    return len(notices)
+
+
+def forward_notices_for_migrated_users(
+    event: Mapping[str, Any], users: list[int] | list[Mapping[str, Any]]
+) -> list[Any]:
+    """Forwards the part of a notice which is for users whose event queues
+    have been migrated to another port, and returns the users whose
+    event queues are handled by this process."""
+    local_users: list[Any] = []
+    users_by_port: dict[int, list[Any]] = defaultdict(list)
+    for user in users:
+        user_id = user if isinstance(user, int) else user["id"]
+        if user_id in migrated_user_ports:
+            users_by_port[migrated_user_ports[user_id]].append(user)
+        else:
+            local_users.append(user)
+
+    if event["type"] == "message" and "stream_name" in event:
+        # The target port also receives this message for its own
+        # users, and delivers it to its realm-wide queues then; we
+        # don't want them to receive it twice.
+        event = {key: value for key, value in event.items() if key != "stream_name"}
+    for port, port_users in users_by_port.items():
+        notice = dict(event=event, users=port_users)
+        if port in held_migration_notices:
+            held_migration_notices[port].append(notice)
+        else:
+            queue_json_publish_rollback_unsafe(notify_tornado_queue_name(port), notice)
+    return local_users
 
 
 def fetch_events(
@@ -770,7 +1597,7 @@ def fetch_events(
 
         if not client.event_queue.empty() or dont_block:
             response: dict[str, Any] = dict(
-                events=client.event_queue.contents(),
+                events=client.event_queue.contents(preserialized=True),
             )
             if orig_queue_id is None:
                 response["queue_id"] = queue_id
@@ -1031,10 +1858,24 @@ def get_client_info_for_message_event(
         return (sender_queue_id is not None) and client.event_queue.id == sender_queue_id
 
     # If we're on a public stream, look for clients (typically belonging to
-    # bots) that are registered to get events for ALL streams.
+    # bots) that are registered to get events for ALL streams, or
+    # narrowed to this stream.
     if "stream_name" in event_template and not event_template.get("invite_only"):
         realm_id = event_template["realm_id"]
-        for client in get_client_descriptors_for_realm_all_streams(realm_id):
+        channel_name = event_template["stream_name"].lower()
+        topic_names = [get_topic_from_message_info(event_template["message_dict"]).lower()]
+        if topic_names == [""]:
+            # Clients which don't support empty topic names see these
+            # messages in the fallback topic, and narrow to it.
+            topic_names.append(Message.EMPTY_TOPIC_FALLBACK_NAME.lower())
+        for client in itertools.chain(
+            get_client_descriptors_for_realm_all_streams(realm_id),
+            get_client_descriptors_for_channel_narrow((realm_id, channel_name, None)),
+            *(
+                get_client_descriptors_for_channel_narrow((realm_id, channel_name, topic_name))
+                for topic_name in topic_names
+            ),
+        ):
             send_to_clients[client.event_queue.id] = dict(
                 client=client,
                 flags=[],
@@ -1063,6 +1904,7 @@ def process_message_event(
     for high-level documentation on this subsystem.
     """
     send_to_clients = get_client_info_for_message_event(event_template, users)
+    message_fanout_queues.observe(len(send_to_clients))
 
     presence_idle_user_ids = set(event_template.get("presence_idle_user_ids", []))
     online_push_user_ids = set(event_template.get("online_push_user_ids", []))
@@ -1148,8 +1990,9 @@ def process_message_event(
         allow_empty_topic_name: bool,
         can_access_sender: bool,
         is_incoming_1_to_1: bool,
-    ) -> dict[str, Any]:
-        return MessageDict.finalize_payload(
+        invite_only_stream: bool,
+    ) -> SharedMessagePayload:
+        message_dict = MessageDict.finalize_payload(
             wide_dict,
             apply_markdown=apply_markdown,
             client_gravatar=client_gravatar,
@@ -1158,9 +2001,13 @@ def process_message_event(
             realm_host=realm_host,
             is_incoming_1_to_1=is_incoming_1_to_1,
         )
+        if invite_only_stream:
+            message_dict["invite_only_stream"] = True
+        return SharedMessagePayload(message_dict)
 
     # Extra user-specific data to include
-    extra_user_data: dict[int, Any] = {}
+    internal_data_by_user: dict[int, dict[str, Any]] = {}
+    shared_internal_data: dict[tuple[Any, ...], dict[str, Any]] = {}
 
     for user_data in users:
         user_profile_id: int = user_data["id"]
@@ -1198,18 +2045,24 @@ def process_message_event(
         # Remove fields sent through other pipes to save some space.
         internal_data.pop("user_id")
         internal_data["mentioned_user_group_id"] = mentioned_user_group_id
-        extra_user_data[user_profile_id] = dict(internal_data=internal_data)
 
         # If the message isn't notifiable had the user been idle, then the user
         # shouldn't receive notifications even if they were online. In that case we can
         # avoid the more expensive `receiver_is_off_zulip` call, and move on to process
         # the next user.
         if not user_notifications_data.is_notifiable(acting_user_id=sender_id, idle=True):
+            # These are most recipients of a message to a large channel,
+            # and their internal data is nearly always identical, so
+            # their queued events share a single copy of it.
+            internal_data_by_user[user_profile_id] = shared_internal_data.setdefault(
+                tuple(internal_data.values()), internal_data
+            )
             continue
+        internal_data_by_user[user_profile_id] = internal_data
 
         idle = receiver_is_off_zulip(user_profile_id) or (user_profile_id in presence_idle_user_ids)
 
-        extra_user_data[user_profile_id]["internal_data"].update(
+        internal_data.update(
             maybe_enqueue_notifications(
                 user_notifications_data=user_notifications_data,
                 acting_user_id=sender_id,
@@ -1220,49 +2073,44 @@ def process_message_event(
             )
         )
 
+    invite_only = bool(event_template.get("invite_only"))
+    local_message_id: str | None = event_template.get("local_id", None)
+
     for client_data in send_to_clients.values():
         client = client_data["client"]
         flags = client_data["flags"]
         is_sender: bool = client_data.get("is_sender", False)
-        extra_data: Mapping[str, bool] | None = extra_user_data.get(client.user_profile_id, None)
 
         if not client.accepts_messages():
-            # The actual check is the accepts_event() check below;
-            # this line is just an optimization to avoid copying
-            # message data unnecessarily
+            # The actual check is the accepts_message_event() check
+            # below; this line is just an optimization to avoid
+            # computing a payload unnecessarily.
+            continue
+
+        # The below prevents (Zephyr) mirroring loops.
+        if "mirror" in sending_client and sending_client.lower() == client.client_type_name.lower():
             continue
 
         can_access_sender = client.user_profile_id not in user_ids_without_access_to_sender
-        message_dict = get_client_payload(
+        payload = get_client_payload(
             apply_markdown=client.apply_markdown,
             client_gravatar=client.client_gravatar,
             allow_empty_topic_name=client.empty_topic_name,
             can_access_sender=can_access_sender,
             is_incoming_1_to_1=wide_dict["recipient_id"] == client.user_recipient_id,
+            # Make sure Zephyr mirroring bots know whether stream is invite-only
+            invite_only_stream=invite_only and "mirror" in client.client_type_name,
         )
 
-        # Make sure Zephyr mirroring bots know whether stream is invite-only
-        if "mirror" in client.client_type_name and event_template.get("invite_only"):
-            message_dict = message_dict.copy()
-            message_dict["invite_only_stream"] = True
-
-        user_event: dict[str, Any] = dict(type="message", message=message_dict, flags=flags)
-        if extra_data is not None:
-            user_event.update(extra_data)
-
-        if is_sender:
-            local_message_id = event_template.get("local_id", None)
-            if local_message_id is not None:
-                user_event["local_message_id"] = local_message_id
-
-        if not client.accepts_event(user_event):
+        if not client.accepts_message_event(payload.message, flags):
             continue
 
-        # The below prevents (Zephyr) mirroring loops.
-        if "mirror" in sending_client and sending_client.lower() == client.client_type_name.lower():
-            continue
-
-        client.add_event(user_event)
+        client.add_message_event(
+            payload,
+            flags=flags,
+            internal_data=internal_data_by_user.get(client.user_profile_id),
+            local_message_id=local_message_id if is_sender else None,
+        )
 
 
 def process_presence_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
@@ -1395,6 +2243,10 @@ def process_message_update_event(
     stream_name = event_template.get("stream_name")
     message_id = event_template["message_id"]
     rendering_only_update = event_template["rendering_only"]
+    # The per-user, per-client copies of the event differ from the
+    # template only in a few small fields, so we count them all at the
+    # template's size, rather than sizing each of them.
+    event_size = get_event_size(event_template)
 
     for user_data in users:
         user_profile_id = user_data["id"]
@@ -1457,7 +2309,7 @@ def process_message_update_event(
             if client.accepts_event(user_event_copy):
                 # We need to do another shallow copy, or we risk
                 # sending the same event to multiple clients.
-                client.add_event(user_event_copy)
+                client.add_event(user_event_copy, event_size)
 
 
 def process_custom_profile_fields_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
@@ -1670,6 +2522,11 @@ def process_notification(notice: Mapping[str, Any]) -> None:
     users: list[int] | list[Mapping[str, Any]] = notice["users"]
     start_time = time.perf_counter()
 
+    if migrated_user_ports:
+        users = forward_notices_for_migrated_users(event, users)
+        if len(users) == 0:
+            return
+
     if event["type"] == "message":
         process_message_event(event, cast(list[Mapping[str, Any]], users))
     elif event["type"] == "update_message":
@@ -1717,11 +2574,15 @@ def process_notification(notice: Mapping[str, Any]) -> None:
             client.cleanup()
     else:
         process_event(event, cast(list[int], users))
+    if overflowed_clients:
+        gc_overflowed_event_queues()
+    elapsed = time.perf_counter() - start_time
+    notification_processing_seconds.labels(event["type"]).observe(elapsed)
     logging.debug(
         "Tornado: Event %s for %s users took %sms",
         event["type"],
         len(users),
-        int(1000 * (time.perf_counter() - start_time)),
+        int(1000 * elapsed),
     )
 
 
@@ -1734,10 +2595,11 @@ def get_wrapped_process_notification(queue_name: str) -> Callable[[list[dict[str
         )
 
     def wrapped_process_notification(notices: list[dict[str, Any]]) -> None:
-        for notice in notices:
-            try:
-                process_notification(notice)
-            except Exception:
-                retry_event(queue_name, notice, failure_processor)
+        with coalesce_handler_finishes():
+            for notice in notices:
+                try:
+                    process_notification(notice)
+                except Exception:
+                    retry_event(queue_name, notice, failure_processor)
 
     return wrapped_process_notification
@@ -0,0 +1,96 @@
+from collections import Counter
+from collections.abc import Iterable
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.metrics_core import Metric
+from prometheus_client.process_collector import ProcessCollector
+from prometheus_client.registry import Collector
+from typing_extensions import override
+
+# Prometheus metrics for this Tornado process, served on each Tornado
+# port by zerver.tornado.views.tornado_metrics, for capacity-planning
+# Tornado shards and finding the event types which hurt latency.
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+notification_processing_seconds = Histogram(
+    "zulip_tornado_notification_processing_seconds",
+    "Time spent processing notices from Django, by event type",
+    ["event_type"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+    registry=registry,
+)
+message_fanout_queues = Histogram(
+    "zulip_tornado_message_fanout_queues",
+    "Number of event queues each message event is delivered to",
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+    registry=registry,
+)
+longpoll_hold_seconds = Histogram(
+    "zulip_tornado_longpoll_hold_seconds",
+    "Time long-polling requests are held before being answered",
+    buckets=(0.01, 0.1, 1, 5, 15, 30, 45, 50, 55, 60, 90),
+    registry=registry,
+)
+
+# Events are pushed to many queues per notice, so rather than using a
+# prometheus_client Counter, whose updates take a lock, we count them
+# in a plain Counter, which TornadoCollector reports.
+events_pushed: Counter[str] = Counter()
+
+
+class TornadoCollector(Collector):
+    @override
+    def collect(self) -> Iterable[Metric]:
+        # We import these here, to avoid an import cycle, since
+        # event_queue updates the metrics above.
+        from zerver.tornado import event_queue
+        from zerver.tornado.handlers import handlers
+
+        queued_events = 0
+        queued_bytes = 0
+        for client in event_queue.clients.values():
+            queue = client.event_queue
+            queued_events += len(queue.queue) + len(queue.virtual_events)
+            queued_bytes += queue.queued_bytes
+
+        yield GaugeMetricFamily(
+            "zulip_tornado_event_queues", "Number of event queues", len(event_queue.clients)
+        )
+        yield GaugeMetricFamily(
+            "zulip_tornado_pending_event_queues",
+            "Number of event queues loaded from disk but not yet deserialized",
+            len(event_queue.pending_client_data),
+        )
+        yield GaugeMetricFamily(
+            "zulip_tornado_queued_events", "Number of events held in event queues", queued_events
+        )
+        yield GaugeMetricFamily(
+            "zulip_tornado_queued_event_bytes",
+            "Estimated encoded size of the events held in event queues",
+            queued_bytes,
+        )
+        yield GaugeMetricFamily(
+            "zulip_tornado_handlers", "Number of open long-polling requests", len(handlers)
+        )
+        yield CounterMetricFamily(
+            "zulip_tornado_overflowed_event_queues",
+            "Number of event queues garbage-collected for exceeding their size limits",
+            event_queue.overflowed_queue_count,
+        )
+        pushed = CounterMetricFamily(
+            "zulip_tornado_events_pushed",
+            "Number of events pushed to event queues, by event type",
+            labels=["event_type"],
+        )
+        for event_type, count in sorted(events_pushed.items()):
+            pushed.add_metric([event_type], count)
+        yield pushed
+
+
+registry.register(TornadoCollector())
+
+
+def generate_metrics() -> bytes:
+    return generate_latest(registry)
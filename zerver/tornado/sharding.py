@@ -1,6 +1,9 @@
+import bisect
+import hashlib
 import json
 import os
 import re
+from functools import cache
 from re import Pattern
 
 from django.conf import settings
@@ -34,8 +37,45 @@ def get_realm_tornado_ports(realm: Realm) -> list[int]:
     return [settings.TORNADO_PORTS[0]]
 
 
-def get_user_id_tornado_port(realm_ports: list[int], user_id: int) -> int:
-    return realm_ports[user_id % len(realm_ports)]
+# With TORNADO_SHARDING_CONSISTENT_HASHING, users in realms sharded
+# across several Tornado ports are assigned to ports using consistent
+# hashing: each port is placed at TORNADO_SHARD_VIRTUAL_NODES points on
+# a hash ring, and each user is assigned to the port owning the next
+# point after the user's hash.  Adding a port to a realm thus only
+# moves about 1/N of its users (those whose next point now belongs to
+# the new port), rather than nearly all of them, as
+# `user_id % len(realm_ports)` does.  Users whose port changes can have
+# their event queues moved without a reload; see the
+# migrate_tornado_event_queues management command.
+TORNADO_SHARD_VIRTUAL_NODES = 160
+
+
+def get_shard_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+@cache
+def get_shard_ring(realm_ports: tuple[int, ...]) -> tuple[list[int], list[int]]:
+    ring = sorted(
+        (get_shard_hash(f"{port}-{node}"), port)
+        for port in realm_ports
+        for node in range(TORNADO_SHARD_VIRTUAL_NODES)
+    )
+    return [point for point, port in ring], [port for point, port in ring]
+
+
+def get_user_id_tornado_port(
+    realm_ports: list[int], user_id: int, consistent_hashing: bool | None = None
+) -> int:
+    if len(realm_ports) == 1:
+        return realm_ports[0]
+    if consistent_hashing is None:
+        consistent_hashing = settings.TORNADO_SHARDING_CONSISTENT_HASHING
+    if not consistent_hashing:
+        return realm_ports[user_id % len(realm_ports)]
+    points, ports = get_shard_ring(tuple(realm_ports))
+    index = bisect.bisect(points, get_shard_hash(str(user_id)))
+    return ports[index % len(ports)]
 
 
 def get_user_tornado_port(user: UserProfile) -> int:
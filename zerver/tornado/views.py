@@ -2,30 +2,47 @@ import time
 from collections.abc import Callable
 from typing import Annotated, Any, TypeVar
 
+import tornado.ioloop
 from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from django.utils.translation import gettext as _
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel, Json, NonNegativeInt, StringConstraints, model_validator
+from tornado.httpclient import AsyncHTTPClient
 from typing_extensions import ParamSpec
 
 from zerver.decorator import internal_api_view, process_client
-from zerver.lib.exceptions import JsonableError
+from zerver.lib.exceptions import AccessDeniedError, JsonableError
 from zerver.lib.queue import get_queue_client
+from zerver.lib.rate_limiter import is_local_addr
 from zerver.lib.request import RequestNotes
-from zerver.lib.response import AsynchronousResponse, json_success
+from zerver.lib.response import AsynchronousResponse, json_response, json_success
 from zerver.lib.sessions import narrow_request_user
 from zerver.lib.typed_endpoint import ApiParamConfig, DocumentationStatus, typed_endpoint
 from zerver.models import UserProfile
 from zerver.models.clients import get_client
-from zerver.tornado.descriptors import is_current_port
+from zerver.tornado.descriptors import get_current_port, is_current_port
 from zerver.tornado.event_queue import (
     access_client_descriptor,
+    cancel_event_queue_migration,
+    export_user_event_queues,
     fetch_events,
+    forward_held_migration_notices,
+    import_event_queues,
+    locally_hosted_user_ids,
+    migrated_user_ports,
     process_notification,
     send_web_reload_client_events,
 )
-from zerver.tornado.sharding import get_user_tornado_port, notify_tornado_queue_name
+from zerver.tornado.handlers import get_handler_by_id
+from zerver.tornado.metrics import generate_metrics
+from zerver.tornado.sharding import (
+    get_tornado_url,
+    get_user_tornado_port,
+    notify_tornado_queue_name,
+)
 
 P = ParamSpec("P")
 T = TypeVar("T")
@@ -67,6 +84,65 @@ def web_reload_clients(
     )
 
 
+@internal_api_view(True)
+@typed_endpoint
+def export_event_queues(
+    request: HttpRequest, *, user_ids: Json[list[int]], target_port: Json[int]
+) -> HttpResponse:
+    client_dicts = in_tornado_thread(export_user_event_queues)(user_ids, target_port)
+    return json_success(request, {"queues": client_dicts})
+
+
+@internal_api_view(True)
+@typed_endpoint
+def import_event_queues_view(
+    request: HttpRequest, *, user_ids: Json[list[int]], queues: Json[list[dict[str, Any]]]
+) -> HttpResponse:
+    in_tornado_thread(import_event_queues)(user_ids, queues)
+    return json_success(request, {"imported": len(queues)})
+
+
+@internal_api_view(True)
+@typed_endpoint
+def cancel_event_queue_migration_view(
+    request: HttpRequest,
+    *,
+    user_ids: Json[list[int]],
+    target_port: Json[int],
+    queues: Json[list[dict[str, Any]]],
+) -> HttpResponse:
+    processed = in_tornado_thread(cancel_event_queue_migration)(user_ids, target_port, queues)
+    return json_success(request, {"processed": processed})
+
+
+@internal_api_view(True)
+@typed_endpoint
+def forward_migration_notices(request: HttpRequest, *, target_port: Json[int]) -> HttpResponse:
+    forwarded = in_tornado_thread(forward_held_migration_notices)(target_port)
+    return json_success(request, {"forwarded": forwarded})
+
+
+def get_user_event_queue_port(user_profile: UserProfile) -> int:
+    # Users whose event queues were migrated by
+    # migrate_tornado_event_queues are served by the target port,
+    # until the sharding configuration is updated to match.
+    if user_profile.id in migrated_user_ports:
+        return migrated_user_ports[user_profile.id]
+    if user_profile.id in locally_hosted_user_ids:
+        return get_current_port()
+    return get_user_tornado_port(user_profile)
+
+
+@require_GET
+def tornado_metrics(request: HttpRequest) -> HttpResponse:
+    # Scraped by Prometheus on each Tornado port; like the other
+    # internal endpoints, this is only available from the server.
+    if not is_local_addr(request.META["REMOTE_ADDR"]):
+        raise AccessDeniedError
+    metrics = in_tornado_thread(generate_metrics)()
+    return HttpResponse(metrics, content_type=CONTENT_TYPE_LATEST)
+
+
 @typed_endpoint
 def cleanup_event_queue(
     request: HttpRequest, user_profile: UserProfile, *, queue_id: str
@@ -75,7 +151,7 @@ def cleanup_event_queue(
     assert log_data is not None
     log_data["extra"] = f"[{queue_id}]"
 
-    user_port = get_user_tornado_port(user_profile)
+    user_port = get_user_event_queue_port(user_profile)
     if not is_current_port(user_port):
         # X-Accel-Redirect is not supported for HTTP DELETE requests,
         # so we notify the shard hosting the acting user's queues via
@@ -97,19 +173,63 @@ def cleanup_event_queue(
     return json_success(request)
 
 
+def start_forwarding_events_request(handler_id: int, url: str, body: str) -> None:
+    tornado.ioloop.IOLoop.current().add_callback(forward_events_request, handler_id, url, body)
+
+
+async def forward_events_request(handler_id: int, url: str, body: str) -> None:
+    # This runs on the IOLoop, rather than in the thread running
+    # Django views, so that other requests aren't blocked meanwhile.
+    response = await AsyncHTTPClient().fetch(
+        url,
+        method="POST",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        body=body,
+        raise_error=False,
+    )
+
+    handler = get_handler_by_id(handler_id)
+    if handler is None:
+        return
+    if response.code == 599:
+        # Tornado's code for failing to get a response at all.
+        django_response: HttpResponse = json_response(
+            res_type="error", msg=f"Failed to forward events request: {response.error}", status=502
+        )
+    else:
+        django_response = HttpResponse(
+            response.body, status=response.code, content_type="application/json"
+        )
+    await handler.write_django_response_as_tornado_response(django_response)
+
+
 @internal_api_view(True)
 @typed_endpoint
 def get_events_internal(request: HttpRequest, *, user_profile_id: Json[int]) -> HttpResponse:
     user_profile = narrow_request_user(request, user_id=user_profile_id)
     assert isinstance(user_profile, UserProfile)
-    assert is_current_port(get_user_tornado_port(user_profile))
+    user_port = get_user_event_queue_port(user_profile)
+    if not is_current_port(user_port):
+        # The user's event queues were migrated to another port; pass
+        # the request along to it.  Internal requests come from Django
+        # directly, not through nginx, so we can't use X-Accel-Redirect
+        # as get_events does.
+        assert user_profile.id in migrated_user_ports
+        handler_id = RequestNotes.get_notes(request).tornado_handler_id
+        assert handler_id is not None
+        in_tornado_thread(start_forwarding_events_request)(
+            handler_id,
+            get_tornado_url(user_port) + "/api/v1/events/internal",
+            request.POST.urlencode(),
+        )
+        return AsynchronousResponse()
 
     process_client(request, user_profile, client_name="internal")
     return get_events_backend(request, user_profile)
 
 
 def get_events(request: HttpRequest, user_profile: UserProfile) -> HttpResponse:
-    user_port = get_user_tornado_port(user_profile)
+    user_port = get_user_event_queue_port(user_profile)
     if not is_current_port(user_port):
         # When a single realm is split across multiple Tornado shards,
         # any `GET /events` requests that are routed to the wrong
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from collections.abc import Iterable, Sequence
 from email.headerregistry import Address
 from typing import Annotated, Literal, cast
@@ -6,18 +7,23 @@ from django.core import validators
 from django.core.exceptions import ValidationError
 from django.http import HttpRequest, HttpResponse
 from django.utils.translation import gettext as _
-from pydantic import Json
+from pydantic import BaseModel, Json, StringConstraints
 
 from zerver.actions.message_send import (
+    check_messages,
     check_send_message,
     compute_irc_user_fullname,
     compute_jabber_user_fullname,
     create_mirror_user_if_needed,
+    do_send_messages,
     extract_private_recipients,
     extract_stream_indicator,
 )
+from zerver.lib.addressee import Addressee
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.markdown import render_message_markdown
+from zerver.lib.message import SendMessageRequest
+from zerver.lib.rate_limiter import rate_limit_user
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.typed_endpoint import (
@@ -127,32 +133,11 @@ def same_realm_jabber_user(user_profile: UserProfile, email: str) -> bool:
     return RealmDomain.objects.filter(realm=user_profile.realm, domain=domain).exists()
 
 
-@typed_endpoint
-def send_message_backend(
-    request: HttpRequest,
-    user_profile: UserProfile,
-    *,
-    forged_str: Annotated[
-        str | None, ApiParamConfig("forged", documentation_status=DOCUMENTATION_PENDING)
-    ] = None,
-    local_id: str | None = None,
-    message_content: Annotated[str, ApiParamConfig("content")],
-    queue_id: str | None = None,
-    read_by_sender: Json[bool] | None = None,
-    req_sender: Annotated[
-        str | None, ApiParamConfig("sender", documentation_status=DOCUMENTATION_PENDING)
-    ] = None,
-    req_to: Annotated[str | None, ApiParamConfig("to")] = None,
-    req_type: Annotated[Literal["direct", "private", "stream", "channel"], ApiParamConfig("type")],
-    time: Annotated[
-        Json[float] | None, ApiParamConfig("time", documentation_status=DOCUMENTATION_PENDING)
-    ] = None,
-    topic_name: OptionalTopic = None,
-    widget_content: Annotated[
-        str | None, ApiParamConfig("widget_content", documentation_status=DOCUMENTATION_PENDING)
-    ] = None,
-) -> HttpResponse:
-    recipient_type_name = req_type
+def parse_message_recipient(
+    req_type: Literal["direct", "private", "stream", "channel"],
+    req_to: str | int | list[int] | list[str] | None,
+) -> tuple[str, Sequence[int] | Sequence[str]]:
+    recipient_type_name: str = req_type
     if recipient_type_name == "direct":
         # For now, use "private" from Message.API_RECIPIENT_TYPES.
         # TODO: Use "direct" here, as well as in events and
@@ -168,7 +153,11 @@ def send_message_backend(
     # empty list of recipients.
     message_to: Sequence[int] | Sequence[str] = []
 
-    if req_to is not None:
+    if isinstance(req_to, list):
+        message_to = req_to
+    elif isinstance(req_to, int):
+        message_to = [req_to]
+    elif req_to is not None:
         if recipient_type_name == "stream":
             stream_indicator = extract_stream_indicator(req_to)
 
@@ -185,6 +174,36 @@ def send_message_backend(
         else:
             message_to = extract_private_recipients(req_to)
 
+    return recipient_type_name, message_to
+
+
+@typed_endpoint
+def send_message_backend(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    forged_str: Annotated[
+        str | None, ApiParamConfig("forged", documentation_status=DOCUMENTATION_PENDING)
+    ] = None,
+    local_id: str | None = None,
+    message_content: Annotated[str, ApiParamConfig("content")],
+    queue_id: str | None = None,
+    read_by_sender: Json[bool] | None = None,
+    req_sender: Annotated[
+        str | None, ApiParamConfig("sender", documentation_status=DOCUMENTATION_PENDING)
+    ] = None,
+    req_to: Annotated[str | None, ApiParamConfig("to")] = None,
+    req_type: Annotated[Literal["direct", "private", "stream", "channel"], ApiParamConfig("type")],
+    time: Annotated[
+        Json[float] | None, ApiParamConfig("time", documentation_status=DOCUMENTATION_PENDING)
+    ] = None,
+    topic_name: OptionalTopic = None,
+    widget_content: Annotated[
+        str | None, ApiParamConfig("widget_content", documentation_status=DOCUMENTATION_PENDING)
+    ] = None,
+) -> HttpResponse:
+    recipient_type_name, message_to = parse_message_recipient(req_type, req_to)
+
     # Temporary hack: We're transitioning `forged` from accepting
     # `yes` to accepting `true` like all of our normal booleans.
     forged = forged_str is not None and forged_str in ["yes", "true"]
@@ -271,6 +290,79 @@ def send_message_backend(
     return json_success(request, data=data)
 
 
+# The most messages which can be sent in a single request to
+# send_messages_backend; integrations backfilling more messages than
+# this should send them in several requests.  Each message counts
+# towards the user's API rate limit, so this is well below the
+# default limit of 200 API calls per minute.
+MAX_BULK_SEND_MESSAGES = 100
+
+
+class BulkSendMessageData(BaseModel):
+    type: Literal["direct", "private", "stream", "channel"]
+    to: int | str | list[int] | list[str]
+    topic: Annotated[str | None, StringConstraints(strip_whitespace=True)] = None
+    content: str
+
+
+@typed_endpoint
+def send_messages_backend(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    messages: Json[list[BulkSendMessageData]],
+    read_by_sender: Json[bool] | None = None,
+) -> HttpResponse:
+    if len(messages) > MAX_BULK_SEND_MESSAGES:
+        raise JsonableError(
+            _("At most {max_messages} messages can be sent at once.").format(
+                max_messages=MAX_BULK_SEND_MESSAGES
+            )
+        )
+    # The request was already charged as a single API call; the rest
+    # of its messages count as further calls, so that sending messages
+    # in bulk doesn't get around the rate limits for sending them.
+    if len(messages) > 1:
+        rate_limit_user(request, user_profile, domain="api_by_user", calls=len(messages) - 1)
+
+    client = RequestNotes.get_notes(request).client
+    assert client is not None
+
+    if read_by_sender is None:
+        read_by_sender = client.default_read_by_sender()
+
+    # Group the messages by addressee, so that the access checks and
+    # finding the recipients are done once per group, rather than
+    # once per message.
+    addressees: dict[tuple[str, tuple[int | str, ...], str | None], Addressee] = {}
+    groups: dict[tuple[str, tuple[int | str, ...], str | None], list[int]] = defaultdict(list)
+    for index, message in enumerate(messages):
+        recipient_type_name, message_to = parse_message_recipient(message.type, message.to)
+        key = (recipient_type_name, tuple(message_to), message.topic)
+        if key not in addressees:
+            addressees[key] = Addressee.legacy_build(
+                user_profile, recipient_type_name, message_to, message.topic
+            )
+        groups[key].append(index)
+
+    send_requests: list[SendMessageRequest | None] = [None] * len(messages)
+    for key, indexes in groups.items():
+        group_send_requests = check_messages(
+            user_profile, client, addressees[key], [messages[index].content for index in indexes]
+        )
+        for index, send_request in zip(indexes, group_send_requests, strict=True):
+            send_requests[index] = send_request
+
+    # All of the messages are sent in a single transaction, in the
+    # order they were requested in.
+    sent_message_results = do_send_messages(
+        send_requests, mark_as_read=[user_profile.id] if read_by_sender else []
+    )
+    return json_success(
+        request, data={"ids": [result.message_id for result in sent_message_results]}
+    )
+
+
 @typed_endpoint
 def zcommand_backend(
     request: HttpRequest, user_profile: UserProfile, *, command: str
@@ -95,10 +95,9 @@ def send_message_edit_notification_backend(
         if not user_profile.send_stream_typing_notifications:
             raise JsonableError(_("User has disabled typing notifications for channel messages"))
 
-        channel_id = recipient.type_id
         topic = message.topic_name()
         do_send_stream_message_edit_typing_notification(
-            user_profile, channel_id, message_id, operator, topic
+            user_profile, recipient, message_id, operator, topic
         )
 
     else:
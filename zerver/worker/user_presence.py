@@ -0,0 +1,52 @@
+# Documented in https://zulip.readthedocs.io/en/latest/subsystems/queuing.html
+from collections import defaultdict
+from typing import Any
+
+from typing_extensions import override
+
+from zerver.actions.presence import PresenceUpdate, do_bulk_update_user_presence
+from zerver.lib.timestamp import timestamp_to_datetime
+from zerver.models import UserPresence
+from zerver.worker.base import LoopQueueProcessingWorker, assign_queue
+
+
+@assign_queue("user_presence")
+class UserPresenceWorker(LoopQueueProcessingWorker):
+    """Writes the presence heartbeats queued by update_user_presence.
+
+    Every connected client sends a heartbeat every
+    PRESENCE_PING_INTERVAL_SECS, so this queue sees steady, heavy
+    traffic.  We collapse each batch to the latest timestamps for each
+    user, and write them with a single UPDATE per realm, rather than a
+    transaction per heartbeat, each taking the lock on its realm's
+    PresenceSequence row.
+    """
+
+    @override
+    def consume_batch(self, events: list[dict[str, Any]]) -> None:
+        updates: dict[int, dict[int, PresenceUpdate]] = defaultdict(dict)
+        for event in events:
+            user_profile_id = event["user_profile_id"]
+            log_time = timestamp_to_datetime(event["time"])
+            last_active_time = None
+            if event["status"] == UserPresence.LEGACY_STATUS_ACTIVE_INT:
+                last_active_time = log_time
+
+            realm_updates = updates[event["realm_id"]]
+            if user_profile_id not in realm_updates:
+                realm_updates[user_profile_id] = PresenceUpdate(
+                    user_profile_id=user_profile_id,
+                    last_active_time=last_active_time,
+                    last_connected_time=log_time,
+                )
+                continue
+
+            update = realm_updates[user_profile_id]
+            update.last_connected_time = max(update.last_connected_time, log_time)
+            if last_active_time is not None and (
+                update.last_active_time is None or last_active_time > update.last_active_time
+            ):
+                update.last_active_time = last_active_time
+
+        for realm_id, realm_updates in updates.items():
+            do_bulk_update_user_presence(realm_id, list(realm_updates.values()))
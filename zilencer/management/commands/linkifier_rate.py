@@ -0,0 +1,111 @@
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.markdown import (
+    MessageRenderingResult,
+    ZulipMarkdown,
+    get_linkifier_matcher,
+    linkifier_matcher_for,
+)
+from zerver.lib.types import LinkifierDict
+
+# Linkifier-heavy content, resembling that sent by CI and ticket
+# tracker integrations.
+CONTENT = """Build #4817 for PROJ7-1234 failed on **main**.
+
+* Blame: PROJ3-88, PROJ12-4099 (see #4816)
+* Logs: https://ci.example.com/builds/4817
+
+Please fix before the release of PROJ1-1."""
+
+
+def make_linkifiers(count: int) -> list[LinkifierDict]:
+    linkifiers = [
+        LinkifierDict(
+            pattern=r"#(?P<id>[0-9]+)",
+            url_template="https://ci.example.com/builds/{id}",
+            id=1,
+        )
+    ]
+    linkifiers += [
+        LinkifierDict(
+            pattern=rf"PROJ{i}-(?P<id>[0-9]+)",
+            url_template=f"https://tickets.example.com/proj{i}/{{id}}",
+            id=i + 1,
+        )
+        for i in range(1, count)
+    ]
+    return linkifiers
+
+
+def render(engine: ZulipMarkdown, content: str) -> str:
+    # Set up the engine as do_convert would, for a message without a realm.
+    engine.reset()
+    engine.zulip_message = None
+    engine.zulip_realm = None
+    engine.zulip_db_data = None
+    engine.image_preview_enabled = False
+    engine.url_embed_preview_enabled = False
+    engine.url_embed_data = None
+    engine.zulip_rendering_result = MessageRenderingResult(
+        rendered_content="",
+        mentions_topic_wildcard=False,
+        mentions_stream_wildcard=False,
+        mentions_user_ids=set(),
+        mentions_user_group_ids=set(),
+        alert_words=set(),
+        links_for_preview=set(),
+        user_ids_with_alert_words=set(),
+        potential_attachment_path_ids=[],
+        thumbnail_spinners=set(),
+    )
+    return engine.convert(content)
+
+
+def time_render(engine: ZulipMarkdown, reps: int) -> float:
+    return timeit(lambda: render(engine, CONTENT), number=reps) / reps
+
+
+class Command(ZulipBaseCommand):
+    help = """Times rendering a message in realms with many linkifiers.
+
+Reports the time to render a linkifier-heavy message with 1, 10, 100
+and 500 linkifiers, both with the combined linkifier matcher finding
+which linkifiers match the text, and with every linkifier's regex run
+over the text, as was done before."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--reps", help="Renders per measurement", default=200, type=int)
+        parser.add_argument(
+            "--linkifiers",
+            help="Numbers of linkifiers to time",
+            default=[1, 10, 100, 500],
+            nargs="+",
+            type=int,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        reps = options["reps"]
+        print(f"{'Linkifiers':>10}  {'Combined':>10}  {'Each regex':>10}")
+        for count in options["linkifiers"]:
+            linkifiers = make_linkifiers(count)
+            engine = ZulipMarkdown(linkifiers=linkifiers, linkifiers_key=0, email_gateway=False)
+            combined = time_render(engine, reps)
+
+            # Dropping the candidate set makes the matcher report every
+            # linkifier as a candidate for every text.
+            expected = render(engine, CONTENT)
+            matcher = linkifier_matcher_for(linkifiers)
+            matcher.candidate_set = None
+            matcher.last_candidates = ("", frozenset())
+            assert render(engine, CONTENT) == expected
+            each_regex = time_render(engine, reps)
+            get_linkifier_matcher.cache_clear()
+
+            print(f"{count:>10}  {1000 * combined:>8.2f}ms  {1000 * each_regex:>8.2f}ms")
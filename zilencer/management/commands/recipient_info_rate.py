@@ -0,0 +1,79 @@
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.actions.message_send import get_recipient_info
+from zerver.lib.cache import flush_stream_subscriber_settings
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.stream_topic import StreamTopicTarget
+from zerver.models import Stream, Subscription
+
+
+def time_recipient_info(stream: Stream, sender_id: int, reps: int, *, cold: bool) -> float:
+    assert stream.recipient is not None
+    recipient = stream.recipient
+
+    def run() -> None:
+        if cold:
+            flush_stream_subscriber_settings([recipient.id])
+        get_recipient_info(
+            realm_id=stream.realm_id,
+            recipient=recipient,
+            sender_id=sender_id,
+            stream_topic=StreamTopicTarget(stream_id=stream.id, topic_name="benchmark"),
+        )
+
+    run()
+    return timeit(run, number=reps) / reps
+
+
+class Command(ZulipBaseCommand):
+    help = """Times computing the recipients of a message sent to the
+channels of a realm, by channel size.
+
+This is the part of sending a channel message whose cost grows with
+the number of subscribers.  "Cold" times build the channel's
+subscriber settings from the database, as every message sent used to;
+"warm" times use the cached subscriber settings.  Create large
+channels with `./manage.py populate_db --extra-users`."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--reps", help="Runs per measurement", default=20, type=int)
+        parser.add_argument("--channels", help="Number of channels to time", default=10, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None  # Should be ensured by parser
+        reps = options["reps"]
+
+        # The largest channels, and a spread of smaller ones.
+        streams = sorted(
+            Stream.objects.filter(realm=realm, deactivated=False).select_related("recipient"),
+            key=lambda stream: stream.subscriber_count,
+            reverse=True,
+        )
+        step = max(1, len(streams) // options["channels"])
+        streams = streams[::step][: options["channels"]]
+
+        print(f"{'Subscribers':>11}  {'Cold':>10}  {'Warm':>10}  Channel")
+        for stream in streams:
+            sender_id = (
+                Subscription.objects.filter(
+                    recipient_id=stream.recipient_id, active=True, is_user_active=True
+                )
+                .values_list("user_profile_id", flat=True)
+                .first()
+            )
+            if sender_id is None:
+                continue
+            cold = time_recipient_info(stream, sender_id, reps, cold=True)
+            warm = time_recipient_info(stream, sender_id, reps, cold=False)
+            print(
+                f"{stream.subscriber_count:>11}  {1000 * cold:>8.2f}ms  {1000 * warm:>8.2f}ms"
+                f"  {stream.name}"
+            )
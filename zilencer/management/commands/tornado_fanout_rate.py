@@ -0,0 +1,85 @@
+import time
+import tracemalloc
+from typing import Any
+
+from django.core.management.base import CommandError, CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message_cache import MessageDict
+from zerver.models import Message, Recipient
+from zerver.tornado.event_queue import (
+    allocate_client_descriptor,
+    do_gc_event_queues,
+    process_message_event,
+)
+
+
+class Command(ZulipBaseCommand):
+    help = """Times fanning out a stream message to many Tornado event queues.
+
+Allocates the requested number of synthetic event queues in this
+process, delivers the most recent stream message to all of them via
+process_message_event, and reports the latency and the memory
+retained by the queued events."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--queues", help="Number of event queues", default=20000, type=int)
+        parser.add_argument("--messages", help="Number of messages to send", default=10, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        message = Message.objects.filter(recipient__type=Recipient.STREAM).order_by("-id").first()
+        if message is None:
+            raise CommandError("No stream messages to send; run populate_db first.")
+        wide_dict = MessageDict.wide_dict(message)
+        realm_id = message.realm_id
+
+        num_queues = options["queues"]
+        num_messages = options["messages"]
+        user_ids = range(1, num_queues + 1)
+        queue_ids: set[str] = set()
+        for user_id in user_ids:
+            client = allocate_client_descriptor(
+                dict(
+                    user_profile_id=user_id,
+                    realm_id=realm_id,
+                    event_types=None,
+                    client_type_name="website",
+                    apply_markdown=user_id % 2 == 0,
+                    client_gravatar=True,
+                    slim_presence=True,
+                    all_public_streams=False,
+                    queue_timeout=0,
+                    last_connection_time=time.time(),
+                    narrow=[],
+                    empty_topic_name=True,
+                )
+            )
+            queue_ids.add(client.event_queue.id)
+        users = [dict(id=user_id, flags=[]) for user_id in user_ids]
+
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        total_time = 0.0
+        for message_id in range(num_messages):
+            event_template = dict(
+                type="message",
+                realm_id=realm_id,
+                stream_name="benchmark",
+                message_dict={**wide_dict, "id": message_id},
+            )
+            start = time.perf_counter()
+            process_message_event(event_template, users)
+            total_time += time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"Fan-out of {num_messages} messages to {num_queues} queues:")
+        print(f"  Latency: {1000 * total_time / num_messages:.1f}ms per message")
+        bytes_per_event = (retained - baseline) / (num_messages * num_queues)
+        print(f"  Retained: {bytes_per_event:.1f} bytes per queued event")
+        print(f"  Peak: {(peak - baseline) / 1024 / 1024:.1f}MiB")
+
+        do_gc_event_queues(queue_ids, set(user_ids), {realm_id})
@@ -0,0 +1,75 @@
+import time
+import tracemalloc
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.tornado.event_queue import allocate_client_descriptor, do_gc_event_queues
+
+# A mix of registrations resembling the clients connected to a typical
+# server: mostly web and mobile clients receiving all events, plus
+# some API clients with event type filters or narrows.
+CLIENT_REGISTRATIONS: list[dict[str, Any]] = [
+    dict(client_type_name="website", event_types=None, narrow=[]),
+    dict(client_type_name="website", event_types=None, narrow=[]),
+    dict(client_type_name="ZulipMobile", event_types=None, narrow=[]),
+    dict(client_type_name="ZulipPython", event_types=["message"], narrow=[]),
+    dict(
+        client_type_name="ZulipPython",
+        event_types=["message", "update_message"],
+        narrow=[["channel", "general"]],
+    ),
+]
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the memory used by idle Tornado event queues.
+
+Allocates the requested number of event queues in this process, with
+a mix of typical registration parameters, and reports the memory
+retained per idle queue, as measured by tracemalloc."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--queues", help="Number of event queues", default=20000, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        num_queues = options["queues"]
+        realm_id = 1
+
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        queue_ids: set[str] = set()
+        for user_id in range(1, num_queues + 1):
+            registration = CLIENT_REGISTRATIONS[user_id % len(CLIENT_REGISTRATIONS)]
+            client = allocate_client_descriptor(
+                dict(
+                    user_profile_id=user_id,
+                    user_recipient_id=user_id,
+                    realm_id=realm_id,
+                    # Copy the lists, as each request creates its own.
+                    event_types=None
+                    if registration["event_types"] is None
+                    else list(registration["event_types"]),
+                    client_type_name=registration["client_type_name"],
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    slim_presence=True,
+                    all_public_streams=False,
+                    queue_timeout=0,
+                    last_connection_time=time.time(),
+                    narrow=[list(term) for term in registration["narrow"]],
+                    empty_topic_name=True,
+                )
+            )
+            queue_ids.add(client.event_queue.id)
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{num_queues} idle event queues:")
+        print(f"  Retained: {(retained - baseline) / num_queues:.0f} bytes per queue")
+
+        do_gc_event_queues(queue_ids, set(range(1, num_queues + 1)), {realm_id})
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.tornado.event_queue import (
+    allocate_client_descriptor,
+    clients,
+    do_gc_event_queues,
+    dump_event_queues,
+    load_event_queues,
+    load_pending_event_queues,
+    pending_client_data,
+    persistent_queue_filename,
+)
+
+
+class Command(ZulipBaseCommand):
+    help = """Times dumping and loading Tornado event queues across a restart.
+
+Allocates the requested number of synthetic event queues in this
+process, and reports how long dump_event_queues, load_event_queues
+and the background load_pending_event_queues take, as well as the
+peak memory used while dumping and loading."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--queues", help="Number of event queues", default=100000, type=int)
+        parser.add_argument("--events", help="Events in each queue", default=5, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        num_queues = options["queues"]
+        user_ids = range(1, num_queues + 1)
+        for user_id in user_ids:
+            client = allocate_client_descriptor(
+                dict(
+                    user_profile_id=user_id,
+                    realm_id=user_id % 10,
+                    event_types=None,
+                    client_type_name="website",
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    slim_presence=True,
+                    all_public_streams=False,
+                    queue_timeout=0,
+                    last_connection_time=time.time(),
+                    narrow=[],
+                )
+            )
+            # Reactions, unlike e.g. typing notifications, are never
+            # coalesced, so each queue holds all of its events.
+            for i in range(options["events"]):
+                client.event_queue.push(
+                    dict(
+                        type="reaction",
+                        op="add",
+                        user_id=i,
+                        message_id=i,
+                        emoji_name="smile",
+                        emoji_code="1f642",
+                        reaction_type="unicode_emoji",
+                    )
+                )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pattern = os.path.join(tmpdir, "event_queues%s.json")
+            with override_settings(JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=pattern):
+                tracemalloc.start()
+                start = time.perf_counter()
+                dump_event_queues(9800)
+                dump_time = time.perf_counter() - start
+                _, dump_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                file_size = os.path.getsize(persistent_queue_filename(9800))
+
+                do_gc_event_queues(set(clients), set(user_ids), set(range(10)))
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                load_event_queues(9800)
+                load_time = time.perf_counter() - start
+                start = time.perf_counter()
+                asyncio.run(load_pending_event_queues(9800, send_reloads=False))
+                background_time = time.perf_counter() - start
+                _, load_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+        assert len(pending_client_data) == 0
+        print(f"{len(clients)} event queues, {file_size / 1024 / 1024:.1f}MiB on disk:")
+        print(f"  Dump: {dump_time:.3f}s, peak {dump_peak / 1024 / 1024:.1f}MiB")
+        print(f"  Load before accepting requests: {load_time:.3f}s")
+        print(f"  Background load: {background_time:.3f}s, peak {load_peak / 1024 / 1024:.1f}MiB")
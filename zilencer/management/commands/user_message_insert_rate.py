@@ -0,0 +1,93 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+from psycopg2.sql import SQL
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.user_message import UserMessageRows, bulk_insert_ums
+from zerver.models import Message
+
+# Well beyond the IDs of any real users, so the rows don't conflict
+# with existing ones.
+FIRST_USER_ID = 2**30
+
+
+def insert_rows(message_id: int, recipients: int) -> None:
+    rows = UserMessageRows()
+    for user_profile_id in range(FIRST_USER_ID, FIRST_USER_ID + recipients):
+        rows.append(user_profile_id, message_id, 0)
+    bulk_insert_ums(rows)
+
+
+class UserMessageObject:
+    def __init__(self, user_profile_id: int, message_id: int, flags: int) -> None:
+        self.user_profile_id = user_profile_id
+        self.message_id = message_id
+        self.flags = flags
+
+
+def insert_values(message_id: int, recipients: int) -> None:
+    # The previous implementation of bulk_insert_ums: an object per
+    # row, sent as a VALUES list.
+    ums = [
+        UserMessageObject(user_profile_id, message_id, 0)
+        for user_profile_id in range(FIRST_USER_ID, FIRST_USER_ID + recipients)
+    ]
+    vals = [(um.user_profile_id, um.message_id, um.flags) for um in ums]
+    query = SQL(
+        """
+        INSERT into
+            zerver_usermessage (user_profile_id, message_id, flags)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+    """
+    )
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, query, vals)
+
+
+class Command(ZulipBaseCommand):
+    help = """Times inserting the UserMessage rows for a message sent to
+many recipients.
+
+Reports the time spent inside the send-message transaction building and
+inserting the rows, for 1k, 10k and 50k recipients, both as compact
+columns sent as arrays, and as an object per row sent as a VALUES
+list, as was done before.  The rows refer to users which don't exist;
+since foreign keys are only checked at commit, and the transactions
+are rolled back, no data is changed."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--reps", help="Inserts per measurement", default=5, type=int)
+        parser.add_argument(
+            "--recipients",
+            help="Numbers of recipients to time",
+            default=[1000, 10000, 50000],
+            nargs="+",
+            type=int,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        reps = options["reps"]
+        message_id = Message.objects.order_by("-id").values_list("id", flat=True).first()
+        assert message_id is not None
+
+        print(f"{'Recipients':>10}  {'Arrays':>10}  {'VALUES':>10}")
+        for recipients in options["recipients"]:
+            times = []
+            for insert in (insert_rows, insert_values):
+                elapsed = 0.0
+                for _ in range(reps):
+                    with transaction.atomic(durable=True):
+                        start = time.perf_counter()
+                        insert(message_id, recipients)
+                        elapsed += time.perf_counter() - start
+                        transaction.set_rollback(True)
+                times.append(elapsed / reps)
+            print(f"{recipients:>10}  {1000 * times[0]:>8.2f}ms  {1000 * times[1]:>8.2f}ms")
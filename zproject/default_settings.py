@@ -210,7 +210,28 @@ REMOTE_POSTGRES_PORT = ""
 REMOTE_POSTGRES_SSLMODE = ""
 
 TORNADO_PORTS: list[int] = []
+# Whether to assign the users of realms sharded across several Tornado
+# ports to ports with consistent hashing, so that adding a port only
+# moves a few of them, rather than by their user ID modulo the number
+# of ports.  Switching moves most users to another port; use the
+# migrate_tornado_event_queues management command to keep their event
+# queues when doing so.
+TORNADO_SHARDING_CONSISTENT_HASHING = False
 USING_TORNADO = True
+# Limits on the number and total size of the events held by a single
+# event queue, e.g. for a client which has stopped polling but whose
+# queue has not yet timed out.  Queues which exceed either limit are
+# garbage-collected, so their clients reload their state when they
+# next poll.
+EVENT_QUEUE_MAX_EVENTS = 50000
+EVENT_QUEUE_MAX_BYTES = 32 * 1024 * 1024
+# Maximum number of Markdown engines, one per realm with linkifiers
+# (and email gateway flavor), that each process keeps built.
+MAX_MARKDOWN_ENGINES = 256
+# Whether to cache the rendered Markdown of messages, keyed by their
+# content and the data their rendering depends on; useful for servers
+# with bots sending lots of identical messages.
+CACHE_RENDERED_MARKDOWN = False
 
 # ToS/Privacy templates
 POLICIES_DIRECTORY: str = "zerver/policies_absent"
@@ -676,7 +697,21 @@ TYPING_STARTED_WAIT_PERIOD_MILLISECONDS = 30000
 # The maximum number of subscribers for a stream to have typing
 # notifications enabled. Default is set to avoid excessive Tornado
 # load in large organizations.
-MAX_STREAM_SIZE_FOR_TYPING_NOTIFICATIONS = 100
+MAX_STREAM_SIZE_FOR_TYPING_NOTIFICATIONS = 5000
+
+# Repeated "start" typing notifications from a user for the same
+# conversation within this many seconds are only sent once; 0
+# disables this.  Should be well below
+# TYPING_STARTED_WAIT_PERIOD_MILLISECONDS, so that recipients see
+# the periodic "start" notifications from a user who is still typing.
+STREAM_TYPING_START_COALESCE_SECONDS = 15
+
+# The number of threads with which to run the independent sections of
+# the initial state fetched by /register and page loads concurrently;
+# 1 runs them one after another.  Each thread keeps its own database
+# connection, so the database must allow this many more connections
+# per server process.
+FETCH_PLAN_THREADS = 1
 
 # The maximum user-group size value upto which members should
 # be soft-reactivated in the case of user group mention.
@@ -152,6 +152,9 @@ S3_EXPORT_BUCKET = "test-export-bucket"
 
 INLINE_URL_EMBED_PREVIEW = False
 
+# Tests send repeated typing notifications, and expect each to be sent.
+STREAM_TYPING_START_COALESCE_SECONDS = 0
+
 HOME_NOT_LOGGED_IN = "/login/"
 LOGIN_URL = "/accounts/login/"
 
@@ -19,10 +19,15 @@ from zerver.lib.integrations import WEBHOOK_INTEGRATIONS
 from zerver.lib.rest import rest_path
 from zerver.lib.url_redirects import DOCUMENTATION_REDIRECTS
 from zerver.tornado.views import (
+    cancel_event_queue_migration_view,
     cleanup_event_queue,
+    export_event_queues,
+    forward_migration_notices,
     get_events,
     get_events_internal,
+    import_event_queues_view,
     notify,
+    tornado_metrics,
     web_reload_clients,
 )
 from zerver.views.alert_words import add_alert_words, list_alert_words, remove_alert_words
@@ -89,7 +94,12 @@ from zerver.views.message_flags import (
     update_message_flags_for_narrow,
 )
 from zerver.views.message_report import report_message_backend
-from zerver.views.message_send import render_message_backend, send_message_backend, zcommand_backend
+from zerver.views.message_send import (
+    render_message_backend,
+    send_message_backend,
+    send_messages_backend,
+    zcommand_backend,
+)
 from zerver.views.message_summary import get_messages_summary
 from zerver.views.muted_users import mute_user, unmute_user
 from zerver.views.navigation_views import (
@@ -417,6 +427,14 @@ v1_api_and_json_patterns = [
             {"intentionally_undocumented"},
         ),
     ),
+    rest_path(
+        "messages/bulk",
+        POST=(
+            send_messages_backend,
+            # Not documented since the API details haven't been finalized yet.
+            {"intentionally_undocumented"},
+        ),
+    ),
     rest_path("messages/render", POST=render_message_backend),
     rest_path("messages/flags", POST=update_message_flags),
     rest_path("messages/flags/narrow", POST=update_message_flags_for_narrow),
@@ -845,6 +863,11 @@ for app_name in settings.EXTRA_INSTALLED_APPS:
 # and Tornado processes
 urls += [
     path("api/internal/notify_tornado", notify),
+    path("api/internal/tornado/cancel_event_queue_migration", cancel_event_queue_migration_view),
+    path("api/internal/tornado/export_event_queues", export_event_queues),
+    path("api/internal/tornado/forward_migration_notices", forward_migration_notices),
+    path("api/internal/tornado/import_event_queues", import_event_queues_view),
+    path("api/internal/tornado/metrics", tornado_metrics),
     path("api/internal/tusd", handle_tusd_hook),
     path("api/internal/web_reload_clients", web_reload_clients),
     path("api/v1/events/internal", get_events_internal),